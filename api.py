@@ -0,0 +1,409 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import sys
+import threading
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+import jobs
+import metrics
+import settings
+
+# HTTP JSON API для автоматизации аренды. Работает в процессе сервиса и вызывает те же
+# container_backend и vm_backend, что и страницы, поэтому пулы соединений, планировщик и задания общие.
+#   POST   /api/v1/{containers|vms}/quote        расчёт стоимости
+#   POST   /api/v1/{containers|vms}              аренда, ответ 202 с id задания
+#   GET    /api/v1/{containers|vms}?limit=&offset=
+#   POST   /api/v1/{containers|vms}/{имя}/start  (/stop, /suspend для ВМ)
+#   DELETE /api/v1/{containers|vms}/{имя}
+#   GET    /api/v1/jobs/{id}, GET /api/v1/jobs/{id}/key - приватный ключ готовой аренды
+#          (только для токена, которым подана заявка; чужие задания и заявки со страниц - 404)
+# Доступ по заголовку Authorization: Bearer <токен из RENTAL_API_TOKENS>.
+#   python api.py    # отдельный процесс только с API
+
+PREFIX = "/api/v1"
+MAX_BODY = 64 * 1024
+MAX_HEADERS = 100
+
+REQUESTS = metrics.counter("rental_api_requests_total", "Запросы к HTTP API.")
+
+STATUS_TEXT = {
+    200: "OK", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _int(body, name, low, high, default=None):
+    value = body.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ApiError(400, f"Поле '{name}' должно быть целым числом.")
+    if not low <= value <= high:
+        raise ApiError(400, f"Поле '{name}' должно быть от {low} до {high}.")
+    return value
+
+
+def _choice(body, name, options, default=None):
+    value = body.get(name, default)
+    if value not in options:
+        raise ApiError(400, f"Поле '{name}' должно быть одним из: {', '.join(map(str, options))}.")
+    return value
+
+
+# Параметры аренды с теми же ограничениями, что у ползунков на страницах
+def container_params(body):
+    import image_builder
+    import storage_tiers
+
+    tier = _choice(body, "tier", list(storage_tiers.STORAGE_TIERS), "bind")
+    if tier == "tmpfs":
+        storage = _int(body, "storage", 1, settings.CONTAINER_TMPFS_MAX_GB, 1)
+    elif tier == "volume":
+        storage = _int(body, "storage", 1, 1000, 10)
+    else:
+        storage = 0
+    return (
+        _int(body, "cpu", 1, 32, 4),
+        _int(body, "ram", 1, 128, 8),
+        _choice(body, "os_name", list(image_builder.BASE_IMAGES), "Ubuntu 20.04"),
+        _choice(body, "location", settings.LOCATIONS),
+        _int(body, "duration", 1, 60, 10),
+        tier,
+        storage,
+        _choice(body, "io_class", list(storage_tiers.IO_CLASSES), storage_tiers.DEFAULT_IO_CLASS),
+    )
+
+
+def vm_params(body):
+    import domain_xml
+    import golden_images
+    import storage_tiers
+
+    return (
+        _int(body, "cpu", 1, 32, 4),
+        _int(body, "ram", 1, 128, 8),
+        _int(body, "storage", 10, 1000, 10),
+        _choice(body, "os_name", list(golden_images.GOLDEN_IMAGES), "Ubuntu 20.04"),
+        _choice(body, "location", settings.LOCATIONS),
+        _int(body, "duration", 1, 60, 10),
+        _choice(body, "profile", list(domain_xml.PROFILES), "standard"),
+        _choice(body, "io_class", list(storage_tiers.IO_CLASSES), storage_tiers.DEFAULT_IO_CLASS),
+    )
+
+
+# Backend-модули импортируются при первом запросе: им нужны Docker и libvirt
+def _backend(kind):
+    if kind == "containers":
+        import container_backend
+
+        return container_backend
+    import vm_backend
+
+    return vm_backend
+
+
+def quote(kind, body):
+    if kind == "containers":
+        cpu, ram, _, _, duration, tier, storage, io_class = container_params(body)
+        price = _backend(kind).calculate_price(cpu, ram, duration, tier, storage, io_class)
+    else:
+        cpu, ram, storage, _, _, duration, profile, io_class = vm_params(body)
+        price = _backend(kind).calculate_price(cpu, ram, storage, duration, profile, io_class)
+    return 200, {"price": round(price, 2), "currency": "RUB"}
+
+
+# Заявка уходит в общий пул заданий. Повтор с тем же Idempotency-Key возвращает то же задание.
+def rent(kind, body, token, idempotency_key):
+    if kind == "containers":
+        job_kind, params, fn = "container", container_params(body), _backend(kind).create_container
+    else:
+        job_kind, params, fn = "vm", vm_params(body), _backend(kind).create_vm
+    if idempotency_key:
+        key = f"api:{hmac.new(token.encode(), idempotency_key.encode(), 'sha256').hexdigest()}:{params!r}"
+    else:
+        key = f"api:{uuid.uuid4().hex}"
+    try:
+        job = jobs.get_engine().submit(job_kind, key, fn, *params, owner=_owner(token))
+    except RuntimeError as e:
+        raise ApiError(429, str(e))
+    return 202, {"job": job.id, "status": job.status, "href": f"{PREFIX}/jobs/{job.id}"}
+
+
+def list_items(kind, query):
+    limit = _query_int(query, "limit", settings.API_PAGE_LIMIT, 1, settings.API_PAGE_LIMIT)
+    offset = _query_int(query, "offset", 0, 0, sys.maxsize)
+    backend = _backend(kind)
+    items = backend.list_containers() if kind == "containers" else backend.list_vms()
+    items.sort(key=lambda item: (item["host"], item["name"]))
+    page = items[offset:offset + limit]
+    next_offset = offset + limit if offset + limit < len(items) else None
+    return 200, {"items": page, "total": len(items), "next_offset": next_offset}
+
+
+def _query_int(query, name, default, low, high):
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[0])
+    except ValueError:
+        raise ApiError(400, f"Параметр '{name}' должен быть целым числом.")
+    return max(low, min(high, value))
+
+
+# Действия API и соответствующие им действия backend
+ACTIONS = {
+    "containers": {"start": "start", "stop": "stop", "delete": "delete"},
+    "vms": {"start": "start", "stop": "shutdown", "suspend": "suspend", "delete": "delete"},
+}
+
+
+def manage(kind, name, action, token):
+    if action not in ACTIONS[kind]:
+        raise ApiError(404, f"Неизвестное действие: {action}")
+    # Сообщения backend (тот же интерфейс, что у st) собираются в задание и возвращаются в ответе
+    out = jobs.Job(kind, f"api:{kind}:{name}:{action}", ())
+    backend = _backend(kind)
+    manage_fn = backend.manage_container if kind == "containers" else backend.manage_vm
+    result = manage_fn(ACTIONS[kind][action], name, out)
+    messages = _messages(out.snapshot())
+    if result is None:
+        errors = [message["text"] for message in messages if message["level"] in ("warning", "error")]
+        raise ApiError(409, errors[-1] if errors else f"Действие {action} не выполнено.")
+    # Ожидание готовности после запуска ВМ - тоже задание, его опрашивает тот же клиент
+    ready_job = jobs.get_engine().get(result.get("ready_job"))
+    if ready_job is not None:
+        ready_job.owner = _owner(token)
+    return 200, dict(result, messages=messages)
+
+
+def _messages(snapshot):
+    return [{"level": level, "text": text} for level, text in snapshot["messages"]]
+
+
+# Задания различаются по хешу токена: сам токен в памяти заданий не хранится
+def _owner(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Задание, поданное этим токеном. На чужое задание отвечаем так же, как на несуществующее.
+def _own_job(job_id, token):
+    job = jobs.get_engine().get(job_id)
+    if job is None or job.owner is None or not hmac.compare_digest(job.owner, _owner(token)):
+        raise ApiError(404, f"Задание '{job_id}' не найдено.")
+    return job
+
+
+def job_status(job_id, token):
+    job = _own_job(job_id, token)
+    snapshot = job.snapshot()
+    # Путь к ключу на сервере клиенту не нужен, сам ключ отдаётся отдельным запросом
+    if isinstance(snapshot["result"], dict):
+        snapshot["result"] = {key: value for key, value in snapshot["result"].items() if key != "private_key_path"}
+    snapshot["messages"] = _messages(snapshot)
+    return 200, snapshot
+
+
+def job_key(job_id, token):
+    result = _own_job(job_id, token).result
+    path = result.get("private_key_path") if isinstance(result, dict) else None
+    if path is None:
+        raise ApiError(404, f"Ключ задания '{job_id}' не найден.")
+    with open(path, "rb") as f:
+        return 200, f.read()
+
+
+# Маршрутизация: (метод, путь) -> функция, которая выполняется в потоке (все вызовы backend блокирующие)
+def route(method, path, query, body, token, headers):
+    parts = [part for part in path[len(PREFIX):].split("/") if part]
+    if not path.startswith(PREFIX + "/") or not parts:
+        raise ApiError(404, "Нет такого ресурса.")
+    if parts[0] == "jobs" and len(parts) in (2, 3) and method == "GET":
+        if len(parts) == 3:
+            if parts[2] != "key":
+                raise ApiError(404, "Нет такого ресурса.")
+            return lambda: job_key(parts[1], token)
+        return lambda: job_status(parts[1], token)
+    kind = parts[0]
+    if kind not in ACTIONS:
+        raise ApiError(404, "Нет такого ресурса.")
+    if len(parts) == 1:
+        if method == "GET":
+            return lambda: list_items(kind, query)
+        if method == "POST":
+            return lambda: rent(kind, body, token, headers.get("idempotency-key"))
+    elif len(parts) == 2:
+        if parts[1] == "quote" and method == "POST":
+            return lambda: quote(kind, body)
+        if method == "DELETE":
+            return lambda: manage(kind, parts[1], "delete", token)
+    elif len(parts) == 3 and method == "POST":
+        return lambda: manage(kind, parts[1], parts[2], token)
+    raise ApiError(405, "Метод не поддерживается для этого ресурса.")
+
+
+def authorize(headers):
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        # Сравнение за постоянное время, чтобы токен нельзя было подобрать по задержке ответа
+        for known in settings.API_TOKENS:
+            if hmac.compare_digest(token.encode(), known.encode()):
+                return token
+    raise ApiError(401, "Нужен заголовок Authorization: Bearer <токен>.")
+
+
+# Ошибки backend: аренда не найдена - 404, неверные параметры - 400, остальное - 500
+def error_status(error):
+    import inventory
+
+    if isinstance(error, inventory.NotFound):
+        return 404
+    if isinstance(error, ValueError):
+        return 400
+    return 500
+
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, version = request_line.decode("latin-1").split()
+    except ValueError:
+        raise ApiError(400, "Некорректная строка запроса.")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise ApiError(400, "Слишком много заголовков.")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY:
+        raise ApiError(413, "Слишком большое тело запроса.")
+    raw = await reader.readexactly(length) if length else b""
+    return method.upper(), target, version, headers, raw
+
+
+def _response(status, payload, keep_alive):
+    if isinstance(payload, bytes):
+        body, content_type = payload, "application/octet-stream"
+    else:
+        body, content_type = json.dumps(payload, ensure_ascii=False, default=str).encode(), "application/json; charset=utf-8"
+    head = (
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+    )
+    if status == 401:
+        head += "WWW-Authenticate: Bearer\r\n"
+    return head.encode() + b"\r\n" + body
+
+
+# Одно соединение: запросы HTTP/1.1 обрабатываются по очереди, соединение держится до Connection: close
+async def handle(reader, writer):
+    try:
+        while True:
+            keep_alive = False
+            try:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, target, version, headers, raw = request
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                token = authorize(headers)
+                url = urlsplit(target)
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    raise ApiError(400, "Тело запроса должно быть JSON.")
+                if not isinstance(body, dict):
+                    raise ApiError(400, "Тело запроса должно быть JSON-объектом.")
+                fn = route(method, url.path.rstrip("/"), parse_qs(url.query), body, token, headers)
+                with metrics.span("api.request", method=method):
+                    status, payload = await asyncio.to_thread(fn)
+            except ApiError as e:
+                status, payload = e.status, {"error": str(e)}
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except Exception as e:
+                status, payload = error_status(e), {"error": str(e)}
+                if status == 500:
+                    print(f"Ошибка обработки запроса API: {e!r}", file=sys.stderr)
+                    payload = {"error": "Внутренняя ошибка сервера."}
+            REQUESTS.inc(status=str(status))
+            writer.write(_response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+_thread = None
+_port = None
+_lock = threading.Lock()
+
+
+# Сервер API в отдельном потоке со своим циклом asyncio. Запускается один раз на процесс,
+# возвращает номер порта или None, если API выключен или порт не открылся.
+def serve(port=None, host=None):
+    global _thread, _port
+    port = settings.API_PORT if port is None else port
+    if not port:
+        return None
+    with _lock:
+        if _thread is None:
+            if not settings.API_TOKENS:
+                print("HTTP API не запущен: не задан RENTAL_API_TOKENS", file=sys.stderr)
+                return None
+            ready = threading.Event()
+
+            async def _main():
+                global _port
+                server = await asyncio.start_server(handle, host or settings.API_HOST, port)
+                _port = port
+                ready.set()
+                async with server:
+                    await server.serve_forever()
+
+            def _run():
+                try:
+                    asyncio.run(_main())
+                except OSError as e:
+                    print(f"Не удалось открыть порт API {port}: {e}", file=sys.stderr)
+                finally:
+                    ready.set()
+
+            _thread = threading.Thread(target=_run, name="api", daemon=True)
+            _thread.start()
+            ready.wait()
+        return _port
+
+
+if __name__ == "__main__":
+    import time
+
+    import idle
+
+    metrics.serve()
+    idle.get_detector()
+    # Обработчики просроченных аренд регистрируются при импорте backend-модулей
+    _backend("containers")
+    _backend("vms")
+    if serve() is None:
+        sys.exit(1)
+    print(f"HTTP API слушает {settings.API_HOST}:{_port}{PREFIX}", file=sys.stderr)
+    while True:
+        time.sleep(3600)
@@ -0,0 +1,136 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import run
+
+# Нагрузочный тест HTTP API на тех же локальных заменах, что и run.py: поддельный Docker и test:///default.
+# API запускается в этом же процессе, запросы идут по HTTP с keep-alive из нескольких потоков.
+#   python bench/api_load.py
+#   python bench/api_load.py --suite container --requests 500 --concurrency 1,16,64
+
+TOKEN = "bench"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# HTTP-клиент с одним соединением на поток
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+        conn.request(
+            method, f"/api/v1{path}", body=json.dumps(body) if body is not None else None,
+            headers=dict(headers or {}, Authorization=f"Bearer {TOKEN}"),
+        )
+        response = conn.getresponse()
+        data = response.read()
+        payload = json.loads(data) if response.getheader("Content-Type", "").startswith("application/json") else data
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path}: {response.status} {payload}")
+        return payload
+
+    # Аренда целиком: заявка и опрос задания до завершения
+    def rent(self, kind, body):
+        job = self.request("POST", f"/{kind}", body)
+        while True:
+            status = self.request("GET", f"/jobs/{job['job']}")
+            if status["status"] in ("done", "failed"):
+                break
+            time.sleep(0.02)
+        if status["status"] != "done":
+            raise RuntimeError(f"Аренда не удалась: {status['error'] or status['messages'][-1:]}")
+        return status["result"]["name"]
+
+
+def suite(client, kind, body, iterations, levels):
+    results = []
+    for concurrency in levels:
+        operations = [
+            ("quote", lambda _: client.request("POST", f"/{kind}/quote", body), range(iterations)),
+            ("list", lambda _: client.request("GET", f"/{kind}?limit=50"), range(iterations)),
+        ]
+        for op, fn, items in operations:
+            stats, _ = run.measure(fn, items, concurrency)
+            results.append(dict(stats, suite=f"api.{kind}", op=op, size=iterations, concurrency=concurrency))
+        stats, names = run.measure(lambda _: client.rent(kind, body), range(iterations), concurrency)
+        results.append(dict(stats, suite=f"api.{kind}", op="rent", size=iterations, concurrency=concurrency))
+        for action in ("start", "stop"):
+            stats, _ = run.measure(
+                lambda name: client.request("POST", f"/{kind}/{name}/{action}"), names, concurrency
+            )
+            results.append(dict(stats, suite=f"api.{kind}", op=action, size=iterations, concurrency=concurrency))
+        stats, _ = run.measure(lambda name: client.request("DELETE", f"/{kind}/{name}"), names, concurrency)
+        results.append(dict(stats, suite=f"api.{kind}", op="delete", size=iterations, concurrency=concurrency))
+        print(f"api.{kind}: concurrency={concurrency} готово", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест HTTP API аренды")
+    parser.add_argument("--suite", default="container,vm", help="наборы через запятую: container, vm")
+    parser.add_argument("--concurrency", default="1,8,32", help="число одновременных клиентов")
+    parser.add_argument("--requests", type=int, default=100, help="запросов каждого вида на шаг")
+    parser.add_argument("--latency", type=float, default=0.0, help="искусственная задержка ответа Docker (с)")
+    parser.add_argument("--out", help="файл результата (по умолчанию bench/results/api-<коммит>.json)")
+    args = parser.parse_args()
+
+    from fake_docker import FakeDockerServer
+
+    state_dir = tempfile.mkdtemp(prefix="rental-api-bench-")
+    fake = FakeDockerServer(latency=args.latency)
+    run.prepare_environment(state_dir, fake.base_url)
+    port = free_port()
+    os.environ.update({"RENTAL_API_TOKENS": TOKEN, "RENTAL_API_PORT": str(port), "RENTAL_API_PAGE_LIMIT": "1000"})
+    import api
+
+    if api.serve() is None:
+        sys.exit("HTTP API не запустился")
+    client = Client(port)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    commit, dirty = run.git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {"concurrency": levels, "requests": args.requests, "latency": args.latency},
+        "results": [],
+    }
+    suites = args.suite.split(",")
+    if "container" in suites:
+        body = {"cpu": 1, "ram": 1, "os_name": run.OS_NAME, "location": run.LOCATION, "duration": 60}
+        report["results"] += suite(client, "containers", body, args.requests, levels)
+    if "vm" in suites:
+        import golden_images
+        import vm_backend
+
+        golden_images.GOLDEN_IMAGES[run.OS_NAME] = run.serve_golden_image(state_dir)
+        vm_backend.get_os_image(run.OS_NAME, run.new_job("vm"))
+        body = {"cpu": 1, "ram": 1, "storage": 10, "os_name": run.OS_NAME, "location": run.LOCATION, "duration": 60}
+        report["results"] += suite(client, "vms", body, args.requests, levels)
+
+    os.makedirs(run.RESULTS_DIR, exist_ok=True)
+    out = args.out or os.path.join(run.RESULTS_DIR, f"api-{commit[:12]}{'-dirty' if dirty else ''}.json")
+    with open(out, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    run.print_table(report["results"])
+    print(f"Результаты сохранены в {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+import hashlib
+import json
+import queue
+import re
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_VERSION = "1.43"
+
+
+# Заглушка sshd: на каждое соединение отвечает баннером SSH, чтобы проверка готовности проходила
+class BannerServer:
+    def __init__(self, host="127.0.0.1"):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, 0))
+        self._sock.listen(128)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._serve, name="fake-sshd", daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            try:
+                conn.sendall(b"SSH-2.0-OpenSSH_bench\r\n")
+            except OSError:
+                pass
+            conn.close()
+
+    def close(self):
+        self._sock.close()
+
+
+# Состояние поддельного Docker: образы, контейнеры и подписчики на события
+class FakeDocker:
+    def __init__(self, ssh_port, latency=0.0):
+        self.ssh_port = ssh_port
+        self.latency = latency
+        self.images = {}  # тег или ID -> образ
+        self.containers = {}  # ID -> контейнер
+        self.subscribers = []
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _emit(self, container, action, extra=None):
+        attributes = dict(container["Labels"], name=container["Name"], image=container["Image"])
+        attributes.update(extra or {})
+        event = {
+            "Type": "container",
+            "Action": action,
+            "status": action,
+            "id": container["Id"],
+            "Actor": {"ID": container["Id"], "Attributes": attributes},
+            "time": int(time.time()),
+            "timeNano": time.time_ns(),
+        }
+        for subscriber in list(self.subscribers):
+            subscriber.put(event)
+
+    def add_image(self, tag, labels=None):
+        image_id = "sha256:" + hashlib.sha256(tag.encode()).hexdigest()
+        image = {"Id": image_id, "RepoTags": [tag], "Config": {"Labels": labels or {}}, "Size": 0}
+        with self.lock:
+            self.images[tag] = image
+            self.images[image_id] = image
+        return image
+
+    def find_image(self, name):
+        with self.lock:
+            if name in self.images:
+                return self.images[name]
+            if ":" not in name and f"{name}:latest" in self.images:
+                return self.images[f"{name}:latest"]
+            for key, image in self.images.items():
+                if image["Id"].startswith(f"sha256:{name}") or image["Id"].startswith(name):
+                    return image
+        return None
+
+    def find_container(self, ref):
+        with self.lock:
+            if ref in self.containers:
+                return self.containers[ref]
+            for container in self.containers.values():
+                if container["Name"] == ref or container["Id"].startswith(ref):
+                    return container
+        return None
+
+    def create(self, name, body):
+        container_id = uuid.uuid4().hex + uuid.uuid4().hex
+        container = {
+            "Id": container_id,
+            "Name": name or container_id[:12],
+            "Image": body.get("Image", ""),
+            "Labels": body.get("Labels") or {},
+            "HostConfig": body.get("HostConfig") or {},
+            "State": "created",
+            "Created": int(time.time()),
+        }
+        with self.lock:
+            if any(other["Name"] == container["Name"] for other in self.containers.values()):
+                return None
+            self.containers[container_id] = container
+        self._emit(container, "create")
+        return container
+
+    # Заполняем Docker n контейнерами, чтобы замерить работу на большом списке
+    def seed(self, count, prefix="seed_"):
+        for index in range(count):
+            container = self.create(f"{prefix}{index:05d}", {"Image": "seed:latest"})
+            if container is not None and index % 2 == 0:
+                self.set_state(container, "running", "start")
+
+    def set_state(self, container, state, action):
+        with self.lock:
+            container["State"] = state
+        self._emit(container, action)
+
+    def remove(self, container):
+        with self.lock:
+            self.containers.pop(container["Id"], None)
+        self._emit(container, "destroy")
+
+    def rename(self, container, new_name):
+        old_name = container["Name"]
+        with self.lock:
+            container["Name"] = new_name
+        self._emit(container, "rename", {"oldName": "/" + old_name})
+
+    def inspect(self, container):
+        running = container["State"] == "running"
+        ports = {"22/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(self.ssh_port)}]} if running else {}
+        return {
+            "Id": container["Id"],
+            "Name": "/" + container["Name"],
+            "Created": container["Created"],
+            "Image": container["Image"],
+            "State": {"Status": container["State"], "Running": running},
+            "Config": {"Image": container["Image"], "Labels": container["Labels"]},
+            "HostConfig": container.get("HostConfig", {}),
+            "Mounts": self.mounts(container),
+            "NetworkSettings": {"Ports": ports},
+        }
+
+    # Монтирования из Binds: абсолютный путь - каталог хоста, иначе - именованный том
+    def mounts(self, container):
+        mounts = []
+        for bind in container.get("HostConfig", {}).get("Binds") or []:
+            source, destination = bind.split(":")[:2]
+            if source.startswith("/"):
+                mounts.append({"Type": "bind", "Source": source, "Destination": destination})
+            else:
+                mounts.append({"Type": "volume", "Name": source, "Destination": destination})
+        return mounts
+
+    def summary(self, container):
+        return {
+            "Id": container["Id"],
+            "Names": ["/" + container["Name"]],
+            "Image": container["Image"],
+            "State": container["State"],
+            "Status": container["State"],
+            "Labels": container["Labels"],
+            "Created": container["Created"],
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeDocker"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def docker(self):
+        return self.server.docker
+
+    def _route(self):
+        parsed = urlparse(self.path)
+        path = re.sub(r"^/v[0-9.]+", "", parsed.path)
+        return path, {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            return self.rfile.read(length)
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            data = b""
+            while True:
+                size = int(self.rfile.readline().strip() or b"0", 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return data
+                data += self.rfile.read(size)
+                self.rfile.readline()
+        return b""
+
+    def _json(self, status, data=None):
+        body = json.dumps(data).encode() if data is not None else b""
+        self.send_response(status)
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_found(self, what):
+        self._json(404, {"message": f"No such {what}"})
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data):
+        payload = json.dumps(data).encode() + b"\r\n"
+        self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _handle(self, method):
+        self.docker.requests += 1
+        if self.docker.latency:
+            time.sleep(self.docker.latency)
+        path, query = self._route()
+        body = self._body() if method in ("POST", "PUT") else b""
+        if path == "/_ping":
+            payload = b"OK"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        if path == "/version":
+            return self._json(200, {"ApiVersion": API_VERSION, "Version": "24.0.0-bench", "MinAPIVersion": "1.12"})
+        if path == "/info":
+            return self._json(200, {"NCPU": 1024, "MemTotal": 1024 ** 4, "Containers": len(self.docker.containers)})
+        if path == "/events":
+            return self._events()
+        if path == "/images/create" and method == "POST":
+            tag = f"{query.get('fromImage')}:{query.get('tag') or 'latest'}"
+            self.docker.add_image(tag)
+            self._start_stream()
+            self._chunk({"status": f"Pulling from {query.get('fromImage')}", "id": query.get("tag") or "latest"})
+            for layer in ("0a1b2c3d4e5f", "1b2c3d4e5f60"):
+                self._chunk({"status": "Downloading", "id": layer, "progressDetail": {"current": 512, "total": 1024}})
+                self._chunk({"status": "Pull complete", "id": layer, "progressDetail": {}})
+            self._chunk({"status": f"Downloaded newer image for {tag}"})
+            return self._end_stream()
+        if path == "/build" and method == "POST":
+            labels = json.loads(query.get("labels") or "{}")
+            image = self.docker.add_image(query.get("t") or uuid.uuid4().hex, labels)
+            self._start_stream()
+            self._chunk({"stream": "Step 1/1 : FROM bench\n"})
+            self._chunk({"aux": {"ID": image["Id"]}})
+            self._chunk({"stream": f"Successfully built {image['Id'][7:19]}\n"})
+            return self._end_stream()
+        if path == "/images/json":
+            with self.docker.lock:
+                images = {image["Id"]: image for image in self.docker.images.values()}.values()
+            return self._json(200, [
+                {"Id": image["Id"], "RepoTags": image["RepoTags"], "Labels": image["Config"]["Labels"], "Size": 0}
+                for image in images
+            ])
+        match = re.match(r"^/images/(.+)/json$", path)
+        if match:
+            image = self.docker.find_image(match.group(1))
+            return self._json(200, image) if image else self._not_found("image")
+        if path == "/containers/json":
+            containers = list(self.docker.containers.values())
+            if query.get("all") not in ("1", "true", "True"):
+                containers = [container for container in containers if container["State"] == "running"]
+            return self._json(200, [self.docker.summary(container) for container in containers])
+        if path == "/containers/create" and method == "POST":
+            if self.docker.find_image(json.loads(body or b"{}").get("Image", "")) is None:
+                return self._not_found("image")
+            container = self.docker.create(query.get("name"), json.loads(body or b"{}"))
+            if container is None:
+                return self._json(409, {"message": "Conflict. The container name is already in use"})
+            return self._json(201, {"Id": container["Id"], "Warnings": []})
+        if path == "/volumes/create" and method == "POST":
+            request = json.loads(body or b"{}")
+            return self._json(201, {"Name": request.get("Name"), "Driver": "local", "Labels": request.get("Labels"),
+                                    "Options": request.get("DriverOpts"), "Mountpoint": "", "Scope": "local"})
+        if re.match(r"^/volumes/[^/]+$", path) and method == "DELETE":
+            return self._json(204)
+        match = re.match(r"^/containers/([^/]+)(/[a-z]+)?$", path)
+        if match:
+            container = self.docker.find_container(match.group(1))
+            if container is None:
+                return self._not_found(f"container: {match.group(1)}")
+            return self._container(method, container, match.group(2) or "", query)
+        self._json(404, {"message": f"page not found: {method} {path}"})
+
+    def _container(self, method, container, action, query):
+        if method == "GET" and action == "/json":
+            return self._json(200, self.docker.inspect(container))
+        if method == "GET" and action == "/stats":
+            return self._json(200, {
+                "read": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "cpu_stats": {"cpu_usage": {"total_usage": int(time.monotonic() * 1e9)},
+                              "system_cpu_usage": int(time.monotonic() * 1e10), "online_cpus": 1},
+                "precpu_stats": {"cpu_usage": {"total_usage": 0}, "system_cpu_usage": 0},
+                "memory_stats": {"usage": 64 * 1024 * 1024, "limit": 1024 ** 3},
+                "networks": {"eth0": {"rx_bytes": 0, "tx_bytes": 0}},
+                "blkio_stats": {"io_service_bytes_recursive": []},
+            })
+        if method == "POST" and action == "/start":
+            if container["State"] == "running":
+                return self._json(304)
+            self.docker.set_state(container, "running", "start")
+            return self._json(204)
+        if method == "POST" and action == "/stop":
+            if container["State"] != "running":
+                return self._json(304)
+            self.docker.set_state(container, "exited", "die")
+            self.docker.set_state(container, "exited", "stop")
+            return self._json(204)
+        if method == "POST" and action == "/update":
+            return self._json(200, {"Warnings": []})
+        if method == "POST" and action == "/rename":
+            self.docker.rename(container, query.get("name"))
+            return self._json(204)
+        if method == "PUT" and action == "/archive":
+            return self._json(200)
+        if method == "DELETE" and action == "":
+            if container["State"] == "running" and query.get("force") not in ("1", "true", "True"):
+                return self._json(409, {"message": "You cannot remove a running container"})
+            self.docker.remove(container)
+            return self._json(204)
+        self._json(404, {"message": f"page not found: {method} {action}"})
+
+    # Поток событий: держим соединение и пишем события по мере появления
+    def _events(self):
+        events = queue.Queue()
+        self.docker.subscribers.append(events)
+        try:
+            self._start_stream()
+            while True:
+                try:
+                    event = events.get(timeout=1)
+                except queue.Empty:
+                    continue
+                self._chunk(event)
+        except OSError:
+            pass
+        finally:
+            self.docker.subscribers.remove(events)
+            self.close_connection = True
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def do_HEAD(self):
+        self._handle("HEAD")
+
+
+# Поддельный Docker Engine API на 127.0.0.1: реализует только то, что вызывает сервис
+class FakeDockerServer:
+    def __init__(self, latency=0.0):
+        self.banner = BannerServer()
+        self.docker = FakeDocker(self.banner.port, latency)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.docker = self.docker
+        self.base_url = f"tcp://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, name="fake-docker", daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self.banner.close()
+
+
+if __name__ == "__main__":
+    server = FakeDockerServer()
+    print(f"DOCKER_HOST={server.base_url}")
+    threading.Event().wait()
@@ -0,0 +1,303 @@
+import argparse
+import http.server
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+OS_NAME = "Ubuntu 20.04"
+LOCATION = "Europe"
+
+
+# Нагрузочный тест жизненного цикла аренд на локальных заменах:
+# контейнеры - на поддельном Docker API (fake_docker.py), ВМ - на драйвере libvirt test:///default.
+#   python bench/run.py                              # все наборы, результат в bench/results/<коммит>.json
+#   python bench/run.py --suite container --sizes 10,100 --concurrency 1,8
+#   python bench/run.py --compare bench/results/old.json bench/results/new.json
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR, capture_output=True, text=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+# Выполняем fn(item) для всех items в concurrency потоках и собираем задержки
+def measure(fn, items, concurrency):
+    latencies = []
+    errors = []
+    results = []
+    lock = threading.Lock()
+
+    def _one(item):
+        started = time.perf_counter()
+        try:
+            result = fn(item)
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if result is not None:
+                results.append(result)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(_one, items))
+    wall = time.perf_counter() - started
+    return {
+        "count": len(latencies),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "ops_per_s": round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+    }, results
+
+
+# Окружение задаётся до импорта модулей сервиса: settings читает переменные при импорте
+def prepare_environment(state_dir, docker_url):
+    hosts = [{
+        "name": "bench",
+        "locations": [LOCATION],
+        "libvirt_uri": "test:///default",
+        "docker": docker_url,
+        "cpu": 1000000,
+        "ram": 1000000,
+        "local": True,
+    }]
+    os.environ.update({
+        "RENTAL_STATE_DIR": state_dir,
+        "RENTAL_LIBVIRT_IMAGES_DIR": os.path.join(state_dir, "images"),
+        "RENTAL_DOWNLOAD_STORE_DIR": os.path.join(state_dir, "images", "golden", "sha256"),
+        "RENTAL_LIBVIRT_URI": "test:///default",
+        "RENTAL_VM_DOMAIN_TYPE": "test",
+        "RENTAL_HOSTS": json.dumps(hosts),
+        "RENTAL_WARM_POOL": "0",
+        "RENTAL_PUBLIC_HOST": "127.0.0.1",
+        "RENTAL_JOB_QUEUE_LIMIT": "100000",
+        "RENTAL_VM_READY_TIMEOUT": "1",
+        "DOCKER_HOST": docker_url,
+    })
+    os.makedirs(os.path.join(state_dir, "images"), exist_ok=True)
+    sys.path.insert(0, REPO_DIR)
+
+
+# Локальный HTTP-сервер с маленьким qcow2 вместо облачного образа
+def serve_golden_image(state_dir):
+    directory = os.path.join(state_dir, "http")
+    os.makedirs(directory, exist_ok=True)
+    image_path = os.path.join(directory, "bench.qcow2")
+    subprocess.run(["qemu-img", "create", "-f", "qcow2", image_path, "1G"], check=True, capture_output=True)
+    import downloader
+
+    with open(os.path.join(directory, "SHA256SUMS"), "w") as f:
+        f.write(f"{downloader.sha256_file(image_path)}  bench.qcow2\n")
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=directory, **kwargs)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    return {"url": f"{base}/bench.qcow2", "checksums": f"{base}/SHA256SUMS"}
+
+
+def new_job(kind):
+    import jobs
+
+    return jobs.Job(kind, f"bench:{kind}", ())
+
+
+def container_suite(fake, sizes, levels, iterations):
+    import container_backend
+
+    results = []
+    for size in sizes:
+        fake.docker.seed(max(0, size - len(fake.docker.containers)), prefix=f"seed{size}_")
+        # Ждём, пока список в памяти догонит события
+        time.sleep(1)
+        for concurrency in levels:
+            def create(_):
+                result = container_backend.create_container(
+                    1, 1, OS_NAME, LOCATION, 60, "bind", 0, None, job=new_job("container")
+                )
+                if result is None:
+                    raise RuntimeError("create_container вернул None")
+                return result["name"]
+
+            stats, names = measure(create, range(iterations), concurrency)
+            results.append(dict(stats, suite="container", op="create_container", size=size, concurrency=concurrency))
+            phases = [
+                ("start_container", lambda name: container_backend.start_container(name, new_job("container"))),
+                ("manage_container.stop", lambda name: container_backend.manage_container("stop", name, new_job("container"))),
+                ("manage_container.delete", lambda name: container_backend.manage_container("delete", name, new_job("container"))),
+            ]
+            for op, fn in phases:
+                stats, _ = measure(fn, names, concurrency)
+                results.append(dict(stats, suite="container", op=op, size=size, concurrency=concurrency))
+
+            _, names = measure(create, range(iterations), concurrency)
+            stats, _ = measure(container_backend._expire_container, names, concurrency)
+            results.append(dict(stats, suite="container", op="expire", size=size, concurrency=concurrency))
+
+            stats, _ = measure(lambda _: container_backend.list_containers(), range(iterations), concurrency)
+            results.append(dict(stats, suite="container", op="show_all", size=size, concurrency=concurrency))
+            print(f"container: size={size} concurrency={concurrency} готово", file=sys.stderr)
+    return results
+
+
+def seed_domains(count, prefix):
+    import libvirt_pool
+
+    def _define(conn):
+        for index in range(count):
+            conn.defineXML(
+                f"<domain type='test'><name>{prefix}{index:05d}</name><memory>65536</memory>"
+                "<os><type>hvm</type></os></domain>"
+            )
+    libvirt_pool.call("bench.seed", _define)
+
+
+def vm_suite(state_dir, sizes, levels, iterations):
+    import golden_images
+    import vm_backend
+
+    golden_images.GOLDEN_IMAGES[OS_NAME] = serve_golden_image(state_dir)
+    # Первый вызов скачивает образ, дальше он берётся из хранилища, как на рабочем хосте
+    vm_backend.get_os_image(OS_NAME, new_job("vm"))
+    results = []
+    existing = 0
+    for size in sizes:
+        seed_domains(max(0, size - existing), prefix=f"seed{size}_")
+        existing = max(existing, size)
+        for concurrency in levels:
+            def create(_):
+                result = vm_backend.create_vm(1, 1, 10, OS_NAME, LOCATION, 60, "standard", None, job=new_job("vm"))
+                if result is None:
+                    raise RuntimeError("create_vm вернул None")
+                return result["name"]
+
+            stats, names = measure(create, range(iterations), concurrency)
+            results.append(dict(stats, suite="vm", op="create_vm", size=size, concurrency=concurrency))
+            for action in ("start", "shutdown", "delete"):
+                stats, _ = measure(lambda name: vm_backend.manage_vm(action, name, new_job("vm")), names, concurrency)
+                results.append(dict(stats, suite="vm", op=f"manage_vm.{action}", size=size, concurrency=concurrency))
+
+            stats, _ = measure(lambda _: vm_backend.list_vms(), range(iterations), concurrency)
+            results.append(dict(stats, suite="vm", op="show_all", size=size, concurrency=concurrency))
+            print(f"vm: size={size} concurrency={concurrency} готово", file=sys.stderr)
+    return results
+
+
+def run(args):
+    from fake_docker import FakeDockerServer
+
+    state_dir = tempfile.mkdtemp(prefix="rental-bench-")
+    fake = FakeDockerServer(latency=args.latency)
+    prepare_environment(state_dir, fake.base_url)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    commit, dirty = git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "params": {"sizes": sizes, "concurrency": levels, "iterations": args.iterations, "latency": args.latency},
+        "results": [],
+    }
+    suites = args.suite.split(",")
+    if "container" in suites:
+        report["results"] += container_suite(fake, sizes, levels, args.iterations)
+    if "vm" in suites:
+        report["results"] += vm_suite(state_dir, sizes, levels, args.iterations)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = args.out or os.path.join(RESULTS_DIR, f"{commit[:12]}{'-dirty' if dirty else ''}.json")
+    with open(out, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print_table(report["results"])
+    print(f"Результаты сохранены в {out}")
+
+
+def print_table(results):
+    print(f"{'набор':<10} {'операция':<26} {'размер':>6} {'потоки':>6} {'p50 мс':>9} {'p95 мс':>9} "
+          f"{'p99 мс':>9} {'оп/с':>9} {'ошибки':>6}")
+    for row in results:
+        print(f"{row['suite']:<10} {row['op']:<26} {row['size']:>6} {row['concurrency']:>6} {row['p50_ms']:>9} "
+              f"{row['p95_ms']:>9} {row['p99_ms']:>9} {row['ops_per_s']:>9} {row['errors']:>6}")
+
+
+# Сравнение двух прогонов: регрессия - рост p95 или падение оп/с больше порога
+def compare(old_path, new_path, threshold):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    key = lambda row: (row["suite"], row["op"], row["size"], row["concurrency"])
+    baseline = {key(row): row for row in old["results"]}
+    print(f"{old['commit'][:12]} -> {new['commit'][:12]}")
+    print(f"{'операция':<36} {'p95 было':>10} {'p95 стало':>10} {'Δp95':>8} {'оп/с было':>10} {'оп/с стало':>10} {'Δоп/с':>8}")
+    regressions = 0
+    for row in new["results"]:
+        before = baseline.get(key(row))
+        if before is None:
+            continue
+        p95_delta = (row["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+        ops_delta = (row["ops_per_s"] - before["ops_per_s"]) / before["ops_per_s"] if before["ops_per_s"] else 0.0
+        regressed = p95_delta > threshold or ops_delta < -threshold
+        regressions += regressed
+        name = f"{row['suite']}/{row['op']} n={row['size']} c={row['concurrency']}"
+        print(f"{name:<36} {before['p95_ms']:>10} {row['p95_ms']:>10} {p95_delta:>+8.1%} "
+              f"{before['ops_per_s']:>10} {row['ops_per_s']:>10} {ops_delta:>+8.1%}{'  РЕГРЕССИЯ' if regressed else ''}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест аренды контейнеров и ВМ")
+    parser.add_argument("--suite", default="container,vm", help="наборы через запятую: container, vm")
+    parser.add_argument("--sizes", default="10,100,1000", help="число уже существующих нагрузок")
+    parser.add_argument("--concurrency", default="1,4,16", help="число одновременных операций")
+    parser.add_argument("--iterations", type=int, default=50, help="операций каждого вида на шаг")
+    parser.add_argument("--latency", type=float, default=0.0, help="искусственная задержка ответа Docker (с)")
+    parser.add_argument("--out", help="файл результата (по умолчанию bench/results/<коммит>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два файла результатов")
+    parser.add_argument("--threshold", type=float, default=0.10, help="порог регрессии (доля)")
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold))
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import run
+from fake_docker import FakeDockerServer
+
+# Время импорта модулей страниц и время перерисовки приложения (streamlit.testing AppTest).
+#   python bench/startup.py                      # текущее дерево
+#   python bench/startup.py --before HEAD~1      # плюс то же самое для другого коммита (через git worktree)
+MODULES = ("home_page", "container_page", "vm_page")
+
+APP_SCRIPT = """
+import json, time
+from streamlit.testing.v1 import AppTest
+
+timings = {}
+started = time.perf_counter()
+at = AppTest.from_file("main.py", default_timeout=120).run()
+timings["cold_start_home_s"] = time.perf_counter() - started
+started = time.perf_counter()
+at.run()
+timings["rerun_home_s"] = time.perf_counter() - started
+at.session_state["page"] = "container"
+started = time.perf_counter()
+at.run()
+timings["first_container_page_s"] = time.perf_counter() - started
+started = time.perf_counter()
+at.slider[0].set_value(8).run()
+timings["slider_rerun_container_s"] = time.perf_counter() - started
+at.session_state["page"] = "vm"
+started = time.perf_counter()
+at.run()
+timings["first_vm_page_s"] = time.perf_counter() - started
+started = time.perf_counter()
+at.slider[0].set_value(8).run()
+timings["slider_rerun_vm_s"] = time.perf_counter() - started
+print(json.dumps(timings))
+"""
+
+
+def _time_import(tree, module):
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=tree, capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=tree)
+    )
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def _app_timings(tree):
+    result = subprocess.run(
+        [sys.executable, "-c", APP_SCRIPT], cwd=tree, capture_output=True, text=True,
+        env=dict(os.environ, PYTHONPATH=tree),
+    )
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "неизвестная ошибка"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_tree(tree, repeats):
+    imports = {}
+    for module in MODULES:
+        samples = [sample for sample in (_time_import(tree, module) for _ in range(repeats)) if sample is not None]
+        imports[module] = round(statistics.median(samples), 4) if samples else None
+    runs = [_app_timings(tree) for _ in range(repeats)]
+    app = {}
+    for key in runs[0]:
+        values = [item[key] for item in runs if isinstance(item.get(key), float)]
+        app[key] = round(statistics.median(values), 4) if values else runs[0][key]
+    return {"import_s": imports, "app": app}
+
+
+def measure_commit(rev, repeats):
+    tree = tempfile.mkdtemp(prefix="rental-startup-")
+    subprocess.run(["git", "worktree", "add", "--detach", tree, rev], cwd=run.REPO_DIR, check=True, capture_output=True)
+    try:
+        return measure_tree(tree, repeats)
+    finally:
+        subprocess.run(["git", "worktree", "remove", "--force", tree], cwd=run.REPO_DIR, capture_output=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер времени запуска и перерисовки приложения")
+    parser.add_argument("--before", help="коммит для сравнения (например, HEAD~1)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--out", help="файл результата (по умолчанию bench/results/startup-<коммит>.json)")
+    args = parser.parse_args()
+
+    fake = FakeDockerServer()
+    run.prepare_environment(tempfile.mkdtemp(prefix="rental-bench-"), fake.base_url)
+    commit, dirty = run.git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "after": measure_tree(run.REPO_DIR, args.repeats),
+    }
+    if args.before:
+        report["before_commit"] = args.before
+        report["before"] = measure_commit(args.before, args.repeats)
+    os.makedirs(run.RESULTS_DIR, exist_ok=True)
+    out = args.out or os.path.join(run.RESULTS_DIR, f"startup-{commit[:12]}{'-dirty' if dirty else ''}.json")
+    with open(out, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(json.dumps(report, ensure_ascii=False, indent=1))
+    print(f"Результаты сохранены в {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import run
+import vm_profiles
+
+# Проверка классов хранилища и лимитов ввода-вывода на настоящем хосте с Docker и KVM.
+# Для каждого сочетания создаётся аренда, внутри неё запускается набор заданий в духе fio
+# (последовательные запись и чтение блоками 1 МиБ, синхронные запись и чтение блоками 4 КиБ в обход кеша),
+# замеры сравниваются с лимитами класса. В образах аренд нет fio, поэтому задания выполняются через dd.
+#   sudo python bench/storage_qos.py                                   # контейнеры и ВМ, все классы
+#   sudo python bench/storage_qos.py --suite container --tiers volume,tmpfs --io-classes basic
+sys.path.insert(0, run.REPO_DIR)
+
+# Допуск на погрешность замера: троттлинг cgroup и QEMU усредняет лимит за короткое окно
+TOLERANCE = 1.15
+
+
+# Задания: (имя, команда, единица). {dir} - каталог проверки, {direct} - флаги обхода кеша.
+# В tmpfs обхода кеша нет, там меряется сама память.
+def job_commands(directory, size_mb, count, direct):
+    oflag = "oflag=direct" if direct else ""
+    iflag = "iflag=direct" if direct else ""
+    sync = "oflag=direct,dsync" if direct else "oflag=dsync"
+    return [
+        ("seq_write_mb_s", f"dd if=/dev/zero of={directory}/bench.bin bs=1M count={size_mb} {oflag} conv=fsync", size_mb),
+        ("seq_read_mb_s", f"dd if={directory}/bench.bin of=/dev/null bs=1M {iflag}", size_mb),
+        ("sync_write_iops", f"dd if=/dev/zero of={directory}/bench4k.bin bs=4k count={count} {sync}", count),
+        ("direct_read_iops", f"dd if={directory}/bench4k.bin of=/dev/null bs=4k {iflag}", count),
+    ]
+
+
+def run_jobs(execute, directory, args, direct=True):
+    report = {}
+    for name, command, amount in job_commands(directory, args.size_mb, args.iops_count, direct):
+        seconds = vm_profiles.dd_seconds(execute(f"{command} 2>&1 | tail -1").strip().splitlines()[-1])
+        report[name] = round(amount / seconds, 1)
+    execute(f"rm -f {directory}/bench.bin {directory}/bench4k.bin")
+    return report
+
+
+# Замеры против лимитов класса: превышение больше допуска - лимит не работает
+def check_limits(report, io_class):
+    import storage_tiers
+
+    if io_class is None:
+        return report
+    spec = storage_tiers.IO_CLASSES[io_class]
+    limits = {
+        "seq_write_mb_s": spec["bytes_sec"] / 1024 ** 2, "seq_read_mb_s": spec["bytes_sec"] / 1024 ** 2,
+        "sync_write_iops": spec["iops_sec"], "direct_read_iops": spec["iops_sec"],
+    }
+    report["limits"] = {key: round(value, 1) for key, value in limits.items()}
+    report["within_limits"] = all(report[key] <= limit * TOLERANCE for key, limit in limits.items())
+    return report
+
+
+def container_case(container_backend, tier, io_class, args):
+    job = run.new_job("container")
+    storage = args.storage if tier != "bind" else 0
+    result = container_backend.create_and_start_container(
+        1, 2, run.OS_NAME, run.LOCATION, 60, tier, storage, io_class, job=job
+    )
+    if result is None:
+        errors = [text for level, text in job.snapshot()["messages"] if level == "error"]
+        return {"error": errors[-1] if errors else "контейнер не создан"}
+    try:
+        container = container_backend.docker_client(result["name"]).containers.get(result["name"])
+
+        def execute(command):
+            exit_code, output = container.exec_run(["sh", "-c", command])
+            if exit_code:
+                raise RuntimeError(output.decode(errors="replace"))
+            return output.decode(errors="replace")
+
+        report = {"data": run_jobs(execute, "/data", args, direct=tier != "tmpfs")}
+        # Слой контейнера лежит на диске Docker и ограничен тем же лимитом
+        report["rootfs"] = check_limits(run_jobs(execute, "/var/tmp", args), io_class)
+        if tier != "tmpfs":
+            check_limits(report["data"], io_class)
+        return report
+    finally:
+        container_backend.remove_container(result["name"])
+
+
+def vm_case(vm_backend, io_class, args):
+    job = run.new_job("vm")
+    result = vm_backend.create_and_start_vm(
+        2, 2, 20, run.OS_NAME, run.LOCATION, 60, "standard", io_class, job=job
+    )
+    if result is None or not result["ready"]:
+        if result is not None:
+            vm_backend.remove_vm(result["name"])
+        errors = [text for level, text in job.snapshot()["messages"] if level in ("error", "warning")]
+        return {"error": errors[-1] if errors else "ВМ не загрузилась"}
+    try:
+        return check_limits(run_jobs(lambda command: vm_profiles.ssh(result, command), "/var/tmp", args), io_class)
+    finally:
+        vm_backend.remove_vm(result["name"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка классов хранилища и лимитов ввода-вывода")
+    parser.add_argument("--suite", default="container,vm", help="наборы через запятую: container, vm")
+    parser.add_argument("--tiers", default="bind,volume,tmpfs", help="классы хранилища контейнеров")
+    parser.add_argument("--io-classes", default="basic,standard,fast", help="классы ввода-вывода")
+    parser.add_argument("--storage", type=int, default=2, help="размер тома и tmpfs (ГБ)")
+    parser.add_argument("--size-mb", type=int, default=512, help="объём последовательных записи и чтения")
+    parser.add_argument("--iops-count", type=int, default=4000, help="число операций по 4 КиБ")
+    parser.add_argument("--out", help="файл результата (по умолчанию bench/results/storage-qos-<коммит>.json)")
+    args = parser.parse_args()
+
+    commit, dirty = run.git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {"storage": args.storage, "size_mb": args.size_mb, "iops_count": args.iops_count},
+        "container": {},
+        "vm": {},
+    }
+    io_classes = args.io_classes.split(",")
+    suites = args.suite.split(",")
+    if "container" in suites:
+        import container_backend
+
+        container_backend.local_backend()
+        for tier in args.tiers.split(","):
+            for io_class in io_classes:
+                print(f"Контейнер: {tier}/{io_class}...", file=sys.stderr)
+                report["container"][f"{tier}/{io_class}"] = container_case(container_backend, tier, io_class, args)
+    if "vm" in suites:
+        import vm_backend
+
+        for io_class in io_classes:
+            print(f"ВМ: {io_class}...", file=sys.stderr)
+            report["vm"][io_class] = vm_case(vm_backend, io_class, args)
+
+    os.makedirs(run.RESULTS_DIR, exist_ok=True)
+    out = args.out or os.path.join(run.RESULTS_DIR, f"storage-qos-{commit[:12]}{'-dirty' if dirty else ''}.json")
+    with open(out, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(json.dumps(report, ensure_ascii=False, indent=1))
+    print(f"Результаты сохранены в {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import run
+
+# Сравнение профилей производительности ВМ на настоящем хосте KVM (не на драйвере test:///default):
+# для каждого профиля создаётся ВМ, по SSH замеряются дрожание планировщика CPU и скорость диска, затем ВМ удаляется.
+#   sudo python bench/vm_profiles.py                           # все профили, 4 vCPU, 8 ГБ
+#   sudo python bench/vm_profiles.py --profiles standard,io --cpu 8 --repeats 5
+sys.path.insert(0, run.REPO_DIR)
+
+# Занятый цикл на каждом vCPU: максимальные паузы между итерациями - время, когда vCPU не работал
+JITTER_SCRIPT = """
+import json, os, sys, time
+from multiprocessing import Pool
+
+def spin(seconds):
+    gaps = []
+    last = started = time.perf_counter_ns()
+    while last - started < seconds * 1e9:
+        now = time.perf_counter_ns()
+        if now - last > 20000:
+            gaps.append((now - last) / 1000)
+        last = now
+    return gaps
+
+with Pool(os.cpu_count()) as pool:
+    gaps = sorted(gap for result in pool.map(spin, [float(sys.argv[1])] * os.cpu_count()) for gap in result)
+print(json.dumps({"count": len(gaps), "p99_us": gaps[int(len(gaps) * 0.99)] if gaps else 0, "max_us": gaps[-1] if gaps else 0}))
+"""
+
+# Последовательная запись крупными блоками и синхронная запись по 4 КиБ в обход кеша гостя
+DD_SEQUENTIAL = "dd if=/dev/zero of=/var/tmp/bench.bin bs=1M count={size} oflag=direct 2>&1 | tail -1"
+DD_RANDOM = "dd if=/dev/zero of=/var/tmp/bench.bin bs=4k count={count} oflag=direct,dsync conv=notrunc 2>&1 | tail -1"
+
+
+def ssh(result, command, timeout=600):
+    target = result["address"] or "127.0.0.1"
+    return subprocess.run(
+        [
+            "ssh", "-i", result["private_key_path"], "-p", str(result["ssh_port"]),
+            "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-o", "BatchMode=yes",
+            f"cloud-user@{target}", command,
+        ],
+        capture_output=True, text=True, timeout=timeout, check=True,
+    ).stdout
+
+
+# Секунды из последней строки dd: "... copied, 2.5 s, 430 MB/s"
+def dd_seconds(line):
+    match = re.search(r"copied, ([0-9.,]+) s", line)
+    if match is None:
+        raise RuntimeError(f"Не удалось разобрать вывод dd: {line!r}")
+    return float(match.group(1).replace(",", "."))
+
+
+def measure_vm(result, args):
+    samples = {"jitter_p99_us": [], "jitter_max_us": [], "seq_write_mb_s": [], "sync_write_iops": []}
+    for _ in range(args.repeats):
+        jitter = json.loads(ssh(result, f"python3 -c '{JITTER_SCRIPT}' {args.seconds}").strip().splitlines()[-1])
+        samples["jitter_p99_us"].append(jitter["p99_us"])
+        samples["jitter_max_us"].append(jitter["max_us"])
+        seconds = dd_seconds(ssh(result, DD_SEQUENTIAL.format(size=args.disk_mb)))
+        samples["seq_write_mb_s"].append(args.disk_mb / seconds)
+        seconds = dd_seconds(ssh(result, DD_RANDOM.format(count=args.iops_count)))
+        samples["sync_write_iops"].append(args.iops_count / seconds)
+    ssh(result, "rm -f /var/tmp/bench.bin")
+    return {key: round(statistics.median(values), 1) for key, values in samples.items()}
+
+
+def run_profile(vm_backend, profile, args):
+    job = run.new_job("vm")
+    started = time.perf_counter()
+    # Без лимитов ввода-вывода: сравниваются сами профили, а не классы ввода-вывода
+    result = vm_backend.create_and_start_vm(
+        args.cpu, args.ram, 20, run.OS_NAME, run.LOCATION, 120, profile, None, job=job
+    )
+    if result is None or not result["ready"]:
+        messages = [text for level, text in job.snapshot()["messages"] if level in ("error", "warning")]
+        if result is not None:
+            vm_backend.remove_vm(result["name"])
+        return {"error": messages[-1] if messages else "ВМ не загрузилась"}
+    try:
+        report = {"ready_s": round(time.perf_counter() - started, 1)}
+        report["warnings"] = [text for level, text in job.snapshot()["messages"] if level == "warning"]
+        report.update(measure_vm(result, args))
+        return report
+    finally:
+        vm_backend.remove_vm(result["name"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение профилей производительности ВМ")
+    parser.add_argument("--profiles", default="standard,compute,io")
+    parser.add_argument("--cpu", type=int, default=4)
+    parser.add_argument("--ram", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10, help="длительность замера дрожания CPU")
+    parser.add_argument("--disk-mb", type=int, default=1024, help="объём последовательной записи")
+    parser.add_argument("--iops-count", type=int, default=5000, help="число синхронных записей по 4 КиБ")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--out", help="файл результата (по умолчанию bench/results/vm-profiles-<коммит>.json)")
+    args = parser.parse_args()
+
+    import vm_backend
+
+    commit, dirty = run.git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {"cpu": args.cpu, "ram": args.ram, "repeats": args.repeats},
+        "profiles": {},
+    }
+    for profile in args.profiles.split(","):
+        print(f"Профиль {profile}...", file=sys.stderr)
+        report["profiles"][profile] = run_profile(vm_backend, profile, args)
+
+    baseline = report["profiles"].get("standard", {})
+    for profile, values in report["profiles"].items():
+        if profile == "standard" or "error" in values or "error" in baseline or not baseline:
+            continue
+        values["vs_standard"] = {
+            key: round(values[key] / baseline[key], 2) for key in baseline if key in values
+            and isinstance(baseline[key], float) and baseline[key]
+        }
+    os.makedirs(run.RESULTS_DIR, exist_ok=True)
+    out = args.out or os.path.join(run.RESULTS_DIR, f"vm-profiles-{commit[:12]}{'-dirty' if dirty else ''}.json")
+    with open(out, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(json.dumps(report, ensure_ascii=False, indent=1))
+    print(f"Результаты сохранены в {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import json
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import jobs
+import metrics
+import settings
+
+
+# Массовая аренда: count одинаковых аренд одной заявкой.
+# create(*args, job=item_job) создаёт и запускает одну аренду и возвращает словарь с "name" или None,
+# remove(name) удаляет уже созданную аренду при откате.
+# Аренды создаются параллельно в ограниченном пуле потоков. После первой ошибки новые аренды
+# не начинаются; при rollback=True удаляются и уже созданные, иначе они остаются в манифесте.
+def run_bulk(kind, count, create, remove, args, rollback=True, job=None):
+    count = min(int(count), settings.BULK_MAX)
+    stop = threading.Event()
+    lock = threading.Lock()
+    created = []
+    failed = []
+
+    def _one(index):
+        if stop.is_set():
+            return
+        item_job = jobs.Job(kind, f"{kind}:bulk:{index}", args)
+        try:
+            result = create(*args, job=item_job)
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            item_job.error(str(e))
+            result = None
+        item_job.result = result
+        item_job._finish(jobs.DONE if result is not None else jobs.FAILED)
+        metrics.job_finished(item_job)
+        with lock:
+            if result is None:
+                failed.append({"index": index, "error": _last_error(item_job)})
+                stop.set()
+            else:
+                created.append(result)
+            job.progress((len(created) + len(failed)) / count)
+
+    job.stage("создание")
+    job.info(f"Создание {count} аренд, параллельно не более {settings.BULK_WORKERS}...")
+    with ThreadPoolExecutor(max_workers=settings.BULK_WORKERS, thread_name_prefix="bulk") as executor:
+        list(executor.map(_one, range(count)))
+
+    if failed:
+        for item in sorted(failed, key=lambda item: item["index"]):
+            job.error(f"Аренда №{item['index'] + 1}: {item['error']}")
+        if rollback:
+            job.stage("откат")
+            job.warning(f"Часть пачки не создана, удаляем {len(created)} уже созданных аренд...")
+            with ThreadPoolExecutor(max_workers=settings.BULK_WORKERS, thread_name_prefix="bulk") as executor:
+                list(executor.map(lambda result: _remove(remove, result["name"]), created))
+            return None
+        job.warning(f"Создано {len(created)} из {count}, остальные отменены после ошибки.")
+    else:
+        job.success(f"Все {count} аренд созданы.")
+    return manifest(kind, created, failed)
+
+
+def _last_error(item_job):
+    errors = [text for level, text in item_job.messages if level == "error"]
+    return errors[-1] if errors else "неизвестная ошибка"
+
+
+def _remove(remove, name):
+    try:
+        remove(name)
+    except Exception as e:
+        print(f"Не удалось удалить '{name}' при откате: {e}", file=sys.stderr)
+
+
+def manifest(kind, created, failed):
+    return {
+        "kind": kind,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "count": len(created),
+        "failed": len(failed),
+        "items": sorted(created, key=lambda item: item["name"]),
+    }
+
+
+# Манифест для скачивания: вместе с путями кладём и сами приватные ключи
+def manifest_json(data):
+    items = []
+    for item in data["items"]:
+        item = dict(item)
+        try:
+            with open(item["private_key_path"]) as f:
+                item["private_key"] = f.read()
+        except (KeyError, OSError):
+            pass
+        items.append(item)
+    return json.dumps(dict(data, items=items), ensure_ascii=False, indent=2)
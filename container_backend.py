@@ -0,0 +1,402 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import docker
+
+import bulk
+import idle
+import image_builder
+import image_puller
+import inventory
+import lease_reaper
+import metrics
+import readiness
+import scheduler
+import settings
+import ssh_keys
+import storage_tiers
+import warm_pool
+
+# Логика аренды контейнеров без Streamlit: её вызывают и страница, и HTTP API.
+# Сообщения пишутся в out (или job) - это st на странице или jobs.Job в фоне и в API.
+
+_backend = None
+_backend_lock = threading.Lock()
+
+# Клиент Docker локального хоста, пул контейнеров и список контейнеров создаются один раз
+# на процесс при первом обращении, а не при импорте страницы. Остальные хосты берутся из планировщика.
+# Если Docker недоступен, исключение уходит вызывающему, а следующий вызов пробует снова.
+def local_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _start_backend()
+        return _backend
+
+def _start_backend():
+    client = scheduler.get_scheduler().default_host("container").docker()
+    # Заранее скачиваем базовые образы и собираем образы с sshd на всех хостах, дальше обновляем их по расписанию
+    for host in scheduler.get_scheduler().hosts.values():
+        if host.supports("container"):
+            image_puller.start_refresh(host.docker())
+    # Пул заранее запущенных контейнеров для мгновенной аренды
+    pool = warm_pool.WarmPool(client) if settings.WARM_POOL_ENABLED else None
+    if pool is not None:
+        pool.start()
+    # Список контейнеров в памяти, обновляемый по событиям Docker
+    inventory.containers(client)
+    return client, pool
+
+def warm_pool_instance():
+    return local_backend()[1]
+
+# Хост, на котором размещён контейнер
+def host_for(container_name):
+    return scheduler.get_scheduler().host_of(container_name) or scheduler.get_scheduler().default_host("container")
+
+# Адрес для SSH-подключения пользователя: у локального хоста - публичный адрес сервиса, как у ВМ
+def public_address(container_name):
+    host = host_for(container_name)
+    if not host.local:
+        return host.address
+    import net_alloc
+
+    return net_alloc.public_address()
+
+# Клиент Docker и список контейнеров хоста, на котором размещён контейнер
+def docker_client(container_name):
+    return host_for(container_name).docker()
+
+def inventory_for(container_name):
+    return inventory.containers(docker_client(container_name))
+
+# Функция для расчета стоимости
+def calculate_price(cpu, ram, duration, tier="bind", storage=0, io_class=storage_tiers.DEFAULT_IO_CLASS):
+    base_price = 1000
+    cpu_cost = cpu * 20
+    ram_cost = ram * 15
+    duration_cost = duration * 50
+    # Хранилище /data и класс ввода-вывода
+    storage_cost = storage_tiers.price(tier, storage, io_class)
+    return base_price + cpu_cost + ram_cost + duration_cost + storage_cost
+
+#функция для установки образа. Одновременные заявки на один образ ждут одну загрузку,
+# ход загрузки по слоям показывается в задании.
+def ensure_image_exists(image_name, job, host_client):
+    try:
+        host_client.images.get(image_name)
+        job.success(f"Образ '{image_name}' найден локально.")
+        return True
+    except docker.errors.ImageNotFound:
+        pass
+    job.info(f"Образ '{image_name}' не найден локально. Загрузка из Docker Hub...")
+    progress_bar = job.progress(0)
+
+    def _progress(done, total, layers_done, layers):
+        if total:
+            progress_bar.progress(
+                min(1.0, done / total),
+                text=f"слои {layers_done}/{layers}, {done / 1024 ** 2:.0f} из {total / 1024 ** 2:.0f} МБ",
+            )
+
+    try:
+        with metrics.span("docker.pull", job):
+            layers = image_puller.pull(host_client, image_name, progress=_progress)
+        job.success(f"Образ '{image_name}' успешно загружен (слоёв: {layers}).")
+    except Exception as e:
+        job.error(f"Не удалось загрузить образ '{image_name}': {e}")
+        return False
+    return True
+
+# Функция для выдачи SSH-ключа: ключ сохраняется на хосте, публичная часть кладётся в контейнер
+def provision_key(container_name, job, host_client):
+    job.stage("ключи")
+    with metrics.span("ssh.key", job):
+        private_key_path, public_key = ssh_keys.provision(os.path.join(settings.KEYS_DIR, container_name))
+    with metrics.span("docker.put_archive", job):
+        ssh_keys.inject_into_container(host_client, container_name, public_key)
+    return private_key_path
+
+# Каталог ключа аренды удаляется вместе с контейнером
+def remove_key(container_name):
+    shutil.rmtree(os.path.join(settings.KEYS_DIR, container_name), ignore_errors=True)
+
+# Функция для создания контейнера. tier и storage - класс и размер (ГБ) хранилища /data,
+# io_class - класс ввода-вывода из storage_tiers.IO_CLASSES (None - без лимитов).
+def create_container(cpu, ram, os_name, location, duration, tier, storage, io_class, job):
+    container_name = f"container_{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:4]}"
+    
+    if os_name not in image_builder.BASE_IMAGES:
+        raise ValueError("Unsupported OS")
+    if tier not in storage_tiers.STORAGE_TIERS:
+        raise ValueError(f"Неизвестный класс хранилища: {tier}")
+    if io_class is not None and io_class not in storage_tiers.IO_CLASSES:
+        raise ValueError(f"Неизвестный класс ввода-вывода: {io_class}")
+    if tier == "tmpfs" and not 1 <= storage <= settings.CONTAINER_TMPFS_MAX_GB:
+        raise ValueError(f"Размер tmpfs должен быть от 1 до {settings.CONTAINER_TMPFS_MAX_GB} ГБ")
+    # Страницы tmpfs учитываются в памяти контейнера, поэтому резервируем и ограничиваем RAM вместе с ними
+    memory = ram + storage if tier == "tmpfs" else ram
+    
+    # Выбираем хост в нужной локации, на котором хватает CPU и RAM
+    job.stage("размещение")
+    try:
+        host = scheduler.get_scheduler().reserve("container", container_name, cpu, memory, location)
+    except scheduler.NoCapacity as e:
+        job.error(str(e))
+        return None
+    host_client = host.docker()
+    job.info(f"Контейнер будет размещён на хосте {host.name}.")
+
+    # Аренды ещё нет, поэтому при любой ошибке (выдача ключа, взятие из пула, сбой Docker)
+    # контейнер, хранилище, ключ и резерв планировщика освобождаем здесь
+    try:
+        result = _create_on_host(
+            cpu, memory, os_name, duration, tier, storage, io_class, container_name, host, host_client, job
+        )
+    except BaseException:
+        _discard(container_name, host_client)
+        raise
+    if result is None:
+        remove_key(container_name)
+        scheduler.get_scheduler().release(container_name)
+    return result
+
+# Удаление недосозданного контейнера вместе с его хранилищем, ключом и резервом
+def _discard(container_name, host_client):
+    try:
+        host_client.api.remove_container(container_name, force=True)
+    except docker.errors.DockerException:
+        pass
+    storage_tiers.release(host_client, ([os.path.join(settings.DOCKER_DATA_DIR, container_name)],
+                                        [storage_tiers.volume_name(container_name)]))
+    remove_key(container_name)
+    scheduler.get_scheduler().release(container_name)
+
+def _create_on_host(cpu, ram, os_name, duration, tier, storage, io_class, container_name, host, host_client, job):
+    # Сначала пробуем взять уже запущенный контейнер из пула (пул есть только у локального хоста).
+    # Контейнеры пула созданы с каталогом на хосте и лимитами ввода-вывода по умолчанию.
+    pooled = tier == "bind" and io_class == storage_tiers.DEFAULT_IO_CLASS
+    if warm_pool_instance() is not None and host.local and pooled:
+        job.stage("пул")
+        with metrics.span("pool.claim", job):
+            ssh_port = warm_pool_instance().claim(os_name, cpu, ram, container_name)
+        if ssh_port:
+            private_key_path = provision_key(container_name, job, host_client)
+            job.success(f"Контейнер '{container_name}' готов. SSH доступен на порте {ssh_port}.")
+            job.info(f"Контейнер будет удалён через {duration} минут.")
+            delete_container_after_timeout(container_name, duration)
+            return {"name": container_name, "ssh_port": ssh_port, "private_key_path": private_key_path}
+
+    try:
+        job.stage("образ")
+        if not image_builder.is_built(host_client, os_name):
+            base_image, _ = image_builder.BASE_IMAGES[os_name]
+            if not ensure_image_exists(base_image, job, host_client):
+                return None
+            job.info(f"Сборка образа с SSH для {os_name}, это делается один раз...")
+        image = image_builder.ensure_ssh_image(host_client, os_name)
+        image_puller.get_cache().touch(host_client, image)
+        job.stage("хранилище")
+        with metrics.span("storage.prepare", job):
+            mount = storage_tiers.data_mount(host_client, tier, storage, container_name)
+        limits = storage_tiers.io_limits(io_class, storage_tiers.io_devices(host_client, host.local))
+        if io_class is not None and not limits:
+            job.warning(f"На хосте {host.name} не найдено блочное устройство Docker, лимиты ввода-вывода не применены.")
+        job.stage("создание")
+        with metrics.span("docker.create", job):
+            container = host_client.containers.create(
+                image=image,
+                name=container_name,
+                cpu_period=100000,
+                cpu_quota=cpu * 100000,  # Исправлено
+                mem_limit=f"{ram}g",
+                tty=True,
+                ports={'22/tcp': 0},  # Автоматическое назначение порта
+                **mount,
+                **limits,
+            )
+        private_key_path = provision_key(container_name, job, host_client)
+        job.success(f"Контейнер '{container_name}' успешно создан, но пока не запущен.")
+        job.write(f"Хранилище /data: {storage_tiers.STORAGE_TIERS[tier]['title']}"
+                  + (f", {storage} ГБ" if storage_tiers.STORAGE_TIERS[tier]["sized"] else ""))
+        if limits:
+            job.write(f"Ввод-вывод: {storage_tiers.describe_io(io_class)}.")
+        job.info(f"Контейнер будет удалён через {duration} минут.")
+        
+        # Запускаем таймер для удаления контейнера
+        delete_container_after_timeout(container_name, duration)
+        return {"name": container_name, "ssh_port": None, "private_key_path": private_key_path}
+    except Exception as e:
+        job.error(f"Ошибка при создании контейнера: {e}")
+        _discard(container_name, host_client)
+        return None
+
+# Массовая аренда: создание и запуск одного контейнера пачки
+def create_and_start_container(cpu, ram, os_name, location, duration, tier, storage, io_class, job):
+    result = create_container(cpu, ram, os_name, location, duration, tier, storage, io_class, job)
+    if result is None:
+        return None
+    job.stage("запуск")
+    container_name = result["name"]
+    host = host_for(container_name)
+    # Созданный контейнер ещё не попал в пачку, и откат о нём не знает: при ошибке запуска удаляем его здесь
+    try:
+        with metrics.span("docker.start", job):
+            host.docker().api.start(container_name)
+        ssh_port, ready_seconds = readiness.wait_container_ready(
+            host.docker(), inventory_for(container_name), container_name, probe_host=host.address
+        )
+    except BaseException:
+        remove_container(container_name)
+        raise
+    result.update(
+        host=host.name, address=public_address(container_name), ssh_port=ssh_port, ready=ready_seconds is not None
+    )
+    return result
+
+# Удаление контейнера при откате массовой аренды
+def remove_container(container_name):
+    lease_reaper.get_reaper().cancel("container", container_name)
+    host_client = docker_client(container_name)
+    try:
+        mounts = storage_tiers.rental_mounts(host_client.api.inspect_container(container_name))
+        host_client.api.remove_container(container_name, force=True)
+        storage_tiers.release(host_client, mounts)
+    except docker.errors.NotFound:
+        pass
+    remove_key(container_name)
+    scheduler.get_scheduler().release(container_name)
+
+def create_bulk(count, rollback, cpu, ram, os_name, location, duration, tier, storage, io_class, job):
+    return bulk.run_bulk(
+        "container", count, create_and_start_container, remove_container,
+        (cpu, ram, os_name, location, duration, tier, storage, io_class), rollback=rollback, job=job,
+    )
+
+# Функция для запуска контейнера и получения SSH-порта
+def start_container(container_name, out):
+    try:
+        host = host_for(container_name)
+        with metrics.span("docker.start"):
+            host.docker().api.start(container_name)
+        
+        # Ждем события запуска, порта и ответа sshd вместо фиксированной паузы
+        ssh_port, ready_seconds = readiness.wait_container_ready(
+            host.docker(), inventory_for(container_name), container_name, probe_host=host.address
+        )
+
+        if ssh_port and ready_seconds is not None:
+            out.success(f"Контейнер '{container_name}' готов за {ready_seconds:.1f} с. SSH доступен на порте {ssh_port}.")
+        elif ssh_port:
+            out.warning(f"Контейнер '{container_name}' запущен на порте {ssh_port}, но SSH пока не отвечает.")
+        else:
+            out.warning(f"Контейнер '{container_name}' запущен, но SSH порт не найден.")
+        
+        return {"name": container_name, "host": host.name, "address": public_address(container_name), "ssh_port": ssh_port,
+                "ready": ready_seconds is not None}
+    except docker.errors.NotFound:
+        raise inventory.NotFound(f"Контейнер '{container_name}' не найден.")
+    except Exception as e:
+        out.error(f"Ошибка в запуске контейнера: {e}")
+
+# Функция для управления контейнером. Возвращает описание результата или None, если действие не выполнено.
+def manage_container(action, container_name, out):
+    try:
+        # Состояние берём из списка в памяти, без запроса к Docker
+        host_client = docker_client(container_name)
+        container = inventory_for(container_name).lookup(container_name)
+        if container is None:
+            raise inventory.NotFound(f"Контейнер '{container_name}' не найден.")
+        # Любое действие с арендой, приостановленной из-за простоя, сначала возобновляет её
+        if idle.get_detector().wake("container", container_name):
+            out.info(f"Контейнер '{container_name}' возобновлён после простоя.")
+            container = inventory_for(container_name).lookup(container_name)
+        status = container["status"]
+        if action == "start":
+            if status != "running":
+                return start_container(container_name, out)
+            else:
+                out.warning(f"Контейнер '{container_name}' уже запущен.")
+        elif action == "stop":
+            if status == "running":
+                with metrics.span("docker.stop"):
+                    host_client.api.stop(container_name)
+                out.success(f"Контейнер '{container_name}' остановлен.")
+                return {"name": container_name, "status": "exited"}
+            else:
+                out.warning(f"Контейнер '{container_name}' не запущен, остановка не нужна.")
+        elif action == "delete":
+            if status == "exited" or status == "created":
+                with metrics.span("docker.remove"):
+                    mounts = storage_tiers.rental_mounts(host_client.api.inspect_container(container_name))
+                    host_client.api.remove_container(container_name)
+                    storage_tiers.release(host_client, mounts)
+                remove_key(container_name)
+                lease_reaper.get_reaper().cancel("container", container_name)
+                scheduler.get_scheduler().release(container_name)
+                out.success(f"Контейнер '{container_name}' удалён.")
+                return {"name": container_name, "status": "deleted"}
+            elif status == "running":
+                out.warning(f"Контейнер '{container_name}' запущен, сначала остановите.")
+        else:
+            raise ValueError(f"Неизвестное действие: {action}")
+    except docker.errors.NotFound:
+        raise inventory.NotFound(f"Контейнер '{container_name}' не найден.")
+    except (inventory.NotFound, ValueError):
+        raise
+    except Exception as e:
+        out.error(f"Ошибка в упралении контейнером: {e}")
+    return None
+
+# Функция удаления контейнера, которую вызывает общий сборщик аренд
+def _expire_container(container_name):
+    idle.get_detector().wake("container", container_name, reason="expire")
+    try:
+        container = docker_client(container_name).containers.get(container_name)
+    except docker.errors.NotFound:
+        scheduler.get_scheduler().release(container_name)
+        return
+    with metrics.span("container.expire"):
+        if container.status == "running":
+            container.stop()  # Останавливаем контейнер, если он запущен
+        container.remove()  # Удаляем контейнер
+        # Вместе с контейнером удаляются его каталог /data или том
+        storage_tiers.release(docker_client(container_name), storage_tiers.rental_mounts(container.attrs))
+    remove_key(container_name)
+    scheduler.get_scheduler().release(container_name)
+
+lease_reaper.get_reaper().register("container", _expire_container)
+
+# Функция для удаления контейнера через указанное время
+def delete_container_after_timeout(container_name, duration):
+    lease_reaper.get_reaper().add("container", container_name, duration)
+
+STATUS_NAMES = {
+    "running": "Запущен",
+    "exited": "Остановлен",
+    "paused": "Приостановлен",
+    "created": "Создан",
+    "restarting": "Перезапускается",
+    "dead": "Не работает"
+}
+
+# Контейнеры аренды со всех хостов, на которых работает Docker (из списков в памяти)
+def list_containers():
+    hosts = [host for host in scheduler.get_scheduler().hosts.values() if host.supports("container")]
+    containers = []
+    for host in hosts:
+        with metrics.span("show_all", kind="container", host=host.name):
+            for container in inventory.containers(host.docker()).list():
+                if container["name"].startswith(warm_pool.POOL_PREFIX):
+                    continue
+                status_text = STATUS_NAMES.get(container["status"], container["status"])
+                if idle.get_detector().is_idle("container", container["name"]):
+                    status_text = idle.IDLE_STATUS
+                containers.append({
+                    "name": container["name"], "host": host.name, "status": container["status"],
+                    "status_text": status_text,
+                })
+    return containers
@@ -1,190 +1,82 @@
 import streamlit as st
 import docker
-import time
-import threading
 import os
+import inventory
+import jobs
+import readiness
+import reconciler
+import scheduler
+import settings
+import storage_tiers
+import widgets
+import container_backend
+from container_backend import calculate_price, create_bulk, create_container
+from widgets import lease_controls
 
-# Создаем клиент Docker
-client = docker.from_env()
+# Клиент Docker, пул контейнеров и фоновые службы общие для страницы и HTTP API
+@st.cache_resource
+def local_backend():
+    return container_backend.local_backend()
 
-# Функция для расчета стоимости
-def calculate_price(cpu, ram, duration):
-    base_price = 1000
-    cpu_cost = cpu * 20
-    ram_cost = ram * 15
-    duration_cost = duration * 50
-    return base_price + cpu_cost + ram_cost + duration_cost
-
-#функция для установки образа
-def ensure_image_exists(image_name):
-    try:
-        client.images.get(image_name)
-        st.success(f"Образ '{image_name}' найден локально.")
-    except docker.errors.ImageNotFound:
-        st.info(f"Образ '{image_name}' не найден локально. Загрузка из Docker Hub...")
-        try:
-            client.images.pull(image_name)
-            st.success(f"Образ '{image_name}' успешно загружен.")
-        except Exception as e:
-            st.error(f"Не удалось загрузить образ '{image_name}': {e}")
-            return False
-    return True
-
-# Функция для создания контейнера
-def create_container(cpu, ram, os_name, duration):
-    container_name = f"container_{time.strftime('%Y%m%d-%H%M%S')}"
-    
-    os_images = {
-        "Ubuntu 20.04": "ubuntu:20.04",
-        "CentOS": "centos:8",
-        "Fedora": "fedora:latest"
-    }
-    
-    if os_name not in os_images:
-        raise ValueError("Unsupported OS")
-    
-    image = os_images[os_name]
-    
-    # Создаём папку для монтирования вручную
-    mount_path = os.path.join(os.path.expanduser("~"), "docker_data", container_name)
-    os.makedirs(mount_path, exist_ok=True)
-
-    try:
-        ensure_image_exists(image)
-        container = client.containers.create(
-            image=image,
-            name=container_name,
-            cpu_period=100000,
-            cpu_quota=cpu * 100000,  # Исправлено
-            mem_limit=f"{ram}g",
-            volumes={mount_path: {'bind': '/data', 'mode': 'rw'}},
-            tty=True,
-            ports={'22/tcp': 0},  # Автоматическое назначение порта
-            command="/bin/bash -c 'apt update && apt install -y openssh-server && service ssh start && tail -f /dev/null'"
-        )
-        st.success(f"Контейнер '{container_name}' успешно создан, но пока не запущен.")
-        st.info(f"Контейнер будет удалён через {duration} минут.")
-        
-        # Запускаем таймер для удаления контейнера
-        delete_container_after_timeout(container_name, duration)
-        return container_name
-    except Exception as e:
-        st.error(f"Ошибка при создании контейнера: {e}")
-        return None
+def warm_pool_instance():
+    return local_backend()[1]
 
 # Функция для запуска контейнера и получения SSH-порта
 def start_container(container_name):
-    try:
-        container = client.containers.get(container_name)
-        container.start()
-        
-        # Ждем, чтобы Docker назначил порт
-        time.sleep(2)
-        container.reload()
-        ports = container.attrs['NetworkSettings']['Ports']
-        ssh_port = ports['22/tcp'][0]['HostPort'] if ports and ports['22/tcp'] else None
-
-        if ssh_port:
-            st.success(f"Контейнер '{container_name}' запущен. SSH доступен на порте {ssh_port}.")
-        else:
-            st.warning(f"Контейнер '{container_name}' запущен, но SSH порт не найден.")
-        
-        return ssh_port
-    except docker.errors.NotFound:
-        st.error(f"Контейнер '{container_name}' не найден.")
-    except Exception as e:
-        st.error(f"Ошибка в запуске контейнера: {e}")
+    return manage_container("start", container_name)
 
 # Функция для управления контейнером
 def manage_container(action, container_name):
     try:
-        container = client.containers.get(container_name)
-        if action == "start":
-            if container.status != "running":
-                return start_container(container_name)
-            else:
-                st.warning(f"Контейнер '{container_name}' уже запущен.")
-        elif action == "stop":
-            if container.status == "running":
-                container.stop()
-                st.success(f"Контейнер '{container_name}' остановлен.")
-            else:
-                st.warning(f"Контейнер '{container_name}' не запущен, остановка не нужна.")
-        elif action == "delete":
-            if container.status == "exited" or container.status == "created":
-                container.remove()
-                st.success(f"Контейнер '{container_name}' удалён.")
-            elif container.status == "running":
-                st.warning(f"Контейнер '{container_name}' запущен, сначала остановите.")
-    except docker.errors.NotFound:
-        st.error(f"Контейнер '{container_name}' не найден.")
-    except Exception as e:
-        st.error(f"Ошибка в упралении контейнером: {e}")
-
-# Функция для удаления контейнера через указанное время
-def delete_container_after_timeout(container_name, duration):
-    def _delete_container():
-        time.sleep(duration * 60)  # Исправлено: duration в минутах
-        try:
-            container = client.containers.get(container_name)
-            state = container.status
-            if state == "running":
-                container.stop()  # Останавливаем контейнер, если он запущен
-            container.remove()  # Удаляем контейнер
-            st.success(f"Контейнер '{container_name}' удален по истечении времени аренды.")
-        except Exception as e:
-            st.error(f"Ошибка при удалении контейнера: {e}")
-    threading.Thread(target=_delete_container, daemon=True).start()
+        with st.spinner("Ожидание готовности SSH..." if action == "start" else "Выполнение..."):
+            result = container_backend.manage_container(action, container_name, st)
+        return (result or {}).get("ssh_port")
+    except inventory.NotFound as e:
+        st.error(str(e))
 
 # Функция для отображения всех контейнеров
 def show_all():
     try:
         st.header("Все контейнеры Docker:")
-        containers = client.containers.list(all=True)
-        
+        # Контейнеры со всех хостов, на которых работает Docker
+        containers = container_backend.list_containers()
         if not containers:
             st.write("Контейнеры не найдены")
         else:
-            status_translation = {
-                "running": "Запущен",
-                "exited": "Остановлен",
-                "paused": "Приостановлен",
-                "created": "Создан",
-                "restarting": "Перезапускается",
-                "dead": "Не работает"
-            }
+            several_hosts = len({container["host"] for container in containers}) > 1
             for container in containers:
-                name = container.name
-                status = container.status  # Текущее состояние контейнера
-                translated_status = status_translation.get(status, status)
-                st.write(f"- **{name}**: {translated_status}")
+                where = f" ({container['host']})" if several_hosts else ""
+                st.write(f"- **{container['name']}**{where}: {container['status_text']}")
     except docker.errors.DockerException as e:
         st.error(f"Ошибка подключения к Docker: {e}")
     except Exception as e:
         st.error(f"Произошла ошибка: {e}")
 
-# Основная страница контейнеров
-def container_page():
-    if "container_deleted" in st.session_state and st.session_state["container_deleted"]:
-        st.success("Контейнер успешно удален.")
-        st.session_state["container_deleted"] = False
-
-    st.title("Конфигуратор аренды контейнеров")
-    with st.container():
-        st.header("Что такое контейнер?")
-        st.write("Контейнер – это изолированная среда для запуска приложений. Он использует ядро хостовой системы, но изолирует процессы, файловую систему и сеть.")
-        st.subheader("Как начать работу?")
-        st.write("Вы получаете SSH доступ к контейнеру.")
-        st.subheader("Преимущества контейнеров")
-        st.write("1. Быстродействие.")
-        st.write("2. Универсальность и переносимость между операционными системами.")
-        st.write("3. Легковесность.")
-        
+# Параметры, стоимость и заявка на аренду. Фрагмент: изменение слайдера перерисовывает только его.
+@st.fragment
+def rent_panel():
     st.header("Параметры")
     cpu = st.slider("CPU Cores", min_value=1, max_value=32, value=4)
     ram = st.slider("RAM (GB)", min_value=1, max_value=128, value=8)
     distribute = ["Ubuntu 20.04", "CentOS", "Fedora"]
     os_name = st.selectbox("Дистрибутив Linux", options=distribute)
+    location = st.selectbox("Локация", settings.LOCATIONS)
+    tier = st.selectbox(
+        "Хранилище /data", options=list(storage_tiers.STORAGE_TIERS),
+        format_func=lambda name: storage_tiers.STORAGE_TIERS[name]["title"],
+    )
+    st.caption(storage_tiers.STORAGE_TIERS[tier]["description"])
+    storage = 0
+    if tier == "tmpfs":
+        storage = st.number_input("Размер tmpfs (GB)", min_value=1, max_value=settings.CONTAINER_TMPFS_MAX_GB, value=1)
+    elif tier == "volume":
+        storage = st.number_input("Размер тома (GB)", min_value=1, max_value=1000, value=10)
+    io_class = st.selectbox(
+        "Класс ввода-вывода", options=list(storage_tiers.IO_CLASSES),
+        index=list(storage_tiers.IO_CLASSES).index(storage_tiers.DEFAULT_IO_CLASS),
+        format_func=lambda name: storage_tiers.IO_CLASSES[name]["title"],
+    )
+    st.caption(storage_tiers.describe_io(io_class))
     duration = st.slider("Длительность аренды (минуты)", min_value=1, max_value=60, value=10)
     
     with st.container():
@@ -192,25 +84,57 @@ def container_page():
         st.write(f"**CPU Cores:** {cpu}")
         st.write(f"**RAM:** {ram} GB")
         st.write(f"**Дистрибутив Linux:** {os_name}")
+        st.write(f"**Хранилище:** {storage_tiers.STORAGE_TIERS[tier]['title']}" + (f", {storage} GB" if storage else ""))
+        st.write(f"**Ввод-вывод:** {storage_tiers.IO_CLASSES[io_class]['title']}")
         st.write(f"**Длительность аренды:** {duration} минут")
     
-    price = calculate_price(cpu, ram, duration)
+    price = calculate_price(cpu, ram, duration, tier, storage, io_class)
     with st.container():
         st.subheader("Стоимость аренды")
         st.write(f"**₽{price:.2f}**")
     
+    bulk_mode = st.checkbox("Массовая аренда (несколько одинаковых контейнеров)")
+    if bulk_mode:
+        count = st.number_input("Количество контейнеров", min_value=1, max_value=settings.BULK_MAX, value=10)
+        rollback = st.checkbox("Удалить всю пачку, если хотя бы один контейнер не создан", value=True)
+        st.write(f"**Стоимость пачки:** ₽{price * count:.2f}")
+    
     if st.button("Арендовать сейчас"):
         try:
-            container_name = create_container(cpu, ram, os_name, duration)
-            if container_name:
-                st.session_state.container_created = True
+            if bulk_mode:
+                widgets.submit_rent("container_bulk", (count, rollback, cpu, ram, os_name, location, duration, tier, storage, io_class), create_bulk)
+            else:
+                widgets.submit_rent("container", (cpu, ram, os_name, location, duration, tier, storage, io_class), create_container)
         except Exception as e:
             st.error(str(e))
             st.session_state.container_created = False
-    
+    rent_job = widgets.job_status("container")
+    if rent_job is not None and rent_job.status == jobs.DONE:
+        if rent_job.result["ssh_port"]:
+            st.code(f"ssh -i {os.path.basename(rent_job.result['private_key_path'])} root@{container_backend.public_address(rent_job.result['name'])} -p {rent_job.result['ssh_port']}", language="bash")
+        private_key_path = rent_job.result["private_key_path"]
+        with open(private_key_path, "rb") as f:
+            st.download_button("Загрузите SSH Key", f.read(), file_name=os.path.basename(private_key_path))
+    bulk_job = widgets.bulk_status("container_bulk")
+    # Пока заявка выполняется, раз в секунду перерисовывается только этот фрагмент
+    widgets.poll(rent_job if rent_job is not None and not rent_job.finished else bulk_job, scope="fragment")
+
+# Список контейнеров, статистика и управление контейнером по имени
+@st.fragment
+def manage_panel():
     if st.button("Показать все контейнеры"):
         show_all()
-    
+    widgets.usage_panel("container")
+    with st.expander("Время до готовности"):
+        st.json(readiness.stats())
+    if warm_pool_instance() is not None:
+        with st.expander("Статистика пула контейнеров"):
+            st.json(warm_pool_instance().stats())
+    with st.expander("Загрузка хостов"):
+        st.table(scheduler.get_scheduler().usage())
+    with st.expander("Сборка брошенных артефактов"):
+        st.json(reconciler.get_reconciler().stats())
+
     # Используем st.session_state для сохранения состояния текстового поля
     if "container_name" not in st.session_state:
         st.session_state.container_name = ""
@@ -230,8 +154,34 @@ def container_page():
             manage_container("stop", container_name)
         if st.button("Удалить контейнер"):
             manage_container("delete", container_name)
+        lease_controls("container", container_name)
     else:
         st.warning("Введите имя контейнера для управления.")
 
+# Основная страница контейнеров
+def container_page():
+    if "container_deleted" in st.session_state and st.session_state["container_deleted"]:
+        st.success("Контейнер успешно удален.")
+        st.session_state["container_deleted"] = False
+
+    st.title("Конфигуратор аренды контейнеров")
+    with st.container():
+        st.header("Что такое контейнер?")
+        st.write("Контейнер – это изолированная среда для запуска приложений. Он использует ядро хостовой системы, но изолирует процессы, файловую систему и сеть.")
+        st.subheader("Как начать работу?")
+        st.write("Вы получаете SSH доступ к контейнеру.")
+        st.subheader("Преимущества контейнеров")
+        st.write("1. Быстродействие.")
+        st.write("2. Универсальность и переносимость между операционными системами.")
+        st.write("3. Легковесность.")
+        
+    try:
+        local_backend()
+    except docker.errors.DockerException as e:
+        st.error(f"Docker недоступен: {e}")
+        return
+    rent_panel()
+    manage_panel()
+
 if __name__ == "__main__":
     container_page()
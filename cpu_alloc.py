@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+
+import libvirt_pool
+import settings
+
+
+def parse_cpuset(text):
+    cpus = set()
+    for part in filter(None, (item.strip() for item in (text or "").split(","))):
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def format_cpuset(cpus):
+    return ",".join(str(cpu) for cpu in sorted(cpus))
+
+
+# Ядра каждого узла NUMA из capabilities хоста: {узел: [номера CPU]}
+def parse_topology(capabilities_xml):
+    topology = {}
+    for cell in ET.fromstring(capabilities_xml).iterfind("host/topology/cells/cell"):
+        topology[int(cell.get("id"))] = sorted(int(cpu.get("id")) for cpu in cell.iterfind("cpus/cpu"))
+    return topology
+
+
+# Закрепление vCPU за физическими ядрами хоста. Ядра выдаются целиком из одного узла NUMA,
+# чтобы память и процессор ВМ были рядом; назначения хранятся в SQLite и переживают перезапуск.
+class CpuAllocator:
+    def __init__(self, db_path=settings.STATE_DB):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cpu_pins ("
+            "vm_name TEXT PRIMARY KEY, host TEXT NOT NULL, node INTEGER NOT NULL, cpus TEXT NOT NULL)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._topology = {}  # имя хоста -> {узел: [CPU]}
+
+    def topology(self, host):
+        if host.name not in self._topology:
+            capabilities = libvirt_pool.call("getCapabilities", lambda conn: conn.getCapabilities(), uri=host.libvirt_uri)
+            reserved = parse_cpuset(settings.CPU_RESERVED)
+            self._topology[host.name] = {
+                node: [cpu for cpu in cpus if cpu not in reserved]
+                for node, cpus in parse_topology(capabilities).items()
+            }
+        return self._topology[host.name]
+
+    # Возвращает (список CPU, узел NUMA) или (None, None), если ни в одном узле нет count свободных ядер.
+    # Берём узел с наименьшим подходящим остатком, чтобы большие ВМ потом тоже поместились.
+    def allocate(self, vm_name, host, count):
+        topology = self.topology(host)
+        with self._lock:
+            row = self._db.execute("SELECT node, cpus FROM cpu_pins WHERE vm_name = ?", (vm_name,)).fetchone()
+            if row is not None:
+                return sorted(parse_cpuset(row[1])), row[0]
+            used = set()
+            for (cpus,) in self._db.execute("SELECT cpus FROM cpu_pins WHERE host = ?", (host.name,)):
+                used |= parse_cpuset(cpus)
+            free = {node: [cpu for cpu in cpus if cpu not in used] for node, cpus in topology.items()}
+            fitting = [node for node, cpus in free.items() if len(cpus) >= count]
+            if not fitting:
+                return None, None
+            node = min(fitting, key=lambda item: len(free[item]))
+            cpus = free[node][:count]
+            self._db.execute(
+                "INSERT INTO cpu_pins (vm_name, host, node, cpus) VALUES (?, ?, ?, ?)",
+                (vm_name, host.name, node, format_cpuset(cpus)),
+            )
+            self._db.commit()
+            return cpus, node
+
+    def get(self, vm_name):
+        with self._lock:
+            row = self._db.execute("SELECT host, node, cpus FROM cpu_pins WHERE vm_name = ?", (vm_name,)).fetchone()
+        return {"host": row[0], "node": row[1], "cpus": sorted(parse_cpuset(row[2]))} if row else None
+
+    def release(self, vm_name):
+        with self._lock:
+            self._db.execute("DELETE FROM cpu_pins WHERE vm_name = ?", (vm_name,))
+            self._db.commit()
+
+    # Хватит ли свободных huge pages на узле (или на всём хосте, если узел не задан) для ram ГБ памяти
+    def hugepages_available(self, host, ram, node=None):
+        size = settings.HUGEPAGE_SIZE_KIB
+        needed = ram * 1024 * 1024 // size
+        cells = [node] if node is not None else list(self.topology(host))
+        try:
+            free = libvirt_pool.call(
+                "getFreePages", lambda conn: conn.getFreePages([size], min(cells), max(cells) - min(cells) + 1),
+                uri=host.libvirt_uri,
+            )
+        except Exception:
+            return False
+        return sum(pages.get(size, 0) for cell, pages in free.items() if cell in cells) >= needed
+
+
+_allocator = None
+_lock = threading.Lock()
+
+
+# Общий для процесса экземпляр
+def get_allocator():
+    global _allocator
+    with _lock:
+        if _allocator is None:
+            _allocator = CpuAllocator()
+        return _allocator
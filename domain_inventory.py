@@ -0,0 +1,80 @@
+import threading
+
+import libvirt
+
+import libvirt_pool
+from inventory import Inventory
+
+
+# Есть ли у домена память, сохранённая через managed save (приостановлен на диск)
+def _saved(domain):
+    try:
+        return bool(domain.hasManagedSaveImage(0))
+    except libvirt.libvirtError:
+        return False
+
+
+# Домены libvirt: начальная загрузка и обратные вызовы о событиях жизненного цикла
+class DomainInventory(Inventory):
+    name = "domains"
+
+    def __init__(self, connection):
+        super().__init__()
+        self.connection = connection
+
+    # Как get, но при промахе один раз спрашивает libvirt
+    def lookup(self, name):
+        item = self.get(name)
+        if item is not None:
+            return item
+        try:
+            domain = self.connection.call("lookupByName", lambda conn: conn.lookupByName(name))
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                return None
+            raise
+        self._set(name, uuid=domain.UUIDString(), state=domain.state()[0], saved=_saved(domain))
+        return self.get(name)
+
+    def reload(self):
+        def _load(conn):
+            return {
+                domain.name(): {
+                    "name": domain.name(), "uuid": domain.UUIDString(), "state": domain.state()[0],
+                    "saved": _saved(domain),
+                }
+                for domain in conn.listAllDomains()
+            }
+        self._replace(self.connection.call("inventory.reload", _load))
+
+    # Подписка повторяется после каждого переподключения
+    def _subscribe(self):
+        self.connection.add_listener(self._on_connect)
+
+    def _on_connect(self, conn):
+        conn.domainEventRegisterAny(None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._on_event, None)
+        if self._items:
+            threading.Thread(target=self.reload, daemon=True).start()
+
+    def _on_event(self, conn, domain, event, detail, opaque):
+        name = domain.name()
+        try:
+            state = domain.state()[0]
+        except libvirt.libvirtError:
+            self._remove(name)  # домен удалён
+            return
+        self._set(name, uuid=domain.UUIDString(), state=state, saved=_saved(domain))
+
+
+_domains = {}
+_lock = threading.Lock()
+
+
+# Общий для всех сессий экземпляр на каждый URI libvirt (хост)
+def domains(uri=None):
+    connection = libvirt_pool.get_connection(uri)
+    with _lock:
+        if connection.uri not in _domains:
+            _domains[connection.uri] = DomainInventory(connection)
+            _domains[connection.uri].start()
+        return _domains[connection.uri]
@@ -0,0 +1,119 @@
+import xml.etree.ElementTree as ET
+
+import settings
+
+# Профили производительности ВМ. Все профили используют машину q35 и консоль на последовательном порту
+# без видеокарты; отличаются закреплением ядер, памятью и настройками диска и сети.
+PROFILES = {
+    "standard": {
+        "title": "Стандартный",
+        "description": "Общие ядра хоста, настройки диска и сети по умолчанию.",
+        "price_factor": 1.0,
+        "pinning": False,
+        "hugepages": False,
+        "iothreads": 0,
+        "multiqueue": False,
+    },
+    "compute": {
+        "title": "Вычислительный",
+        "description": "vCPU закреплены за ядрами одного узла NUMA, память на huge pages, CPU хоста без эмуляции.",
+        "price_factor": 1.5,
+        "pinning": True,
+        "hugepages": True,
+        "iothreads": 0,
+        "multiqueue": False,
+    },
+    "io": {
+        "title": "Ввод-вывод",
+        "description": "Диск без кеша хоста с native AIO в отдельном потоке, многоочередная virtio-net.",
+        "price_factor": 1.3,
+        "pinning": False,
+        "hugepages": False,
+        "iothreads": 1,
+        "multiqueue": True,
+    },
+}
+
+# Больше очередей virtio-net, чем vCPU, не даёт выигрыша, а vhost ограничивает их число
+MAX_NET_QUEUES = 8
+
+
+def _sub(parent, tag, text=None, **attributes):
+    element = ET.SubElement(parent, tag, {key: str(value) for key, value in attributes.items()})
+    if text is not None:
+        element.text = str(text)
+    return element
+
+
+# XML домена libvirt для профиля. cpus и node - ядра и узел NUMA из cpu_alloc (для профилей с закреплением),
+# hugepages - есть ли на хосте свободные huge pages под память ВМ,
+# uuid - UUID домена, если его надо сохранить (восстановление сохранённой ВМ под другим именем),
+# iotune - лимиты диска {элемент <iotune>: значение} из storage_tiers.iotune.
+def build(name, cpu, ram, disk_path, seed_path, mac, profile="standard", cpus=None, node=None, hugepages=False,
+          uuid=None, iotune=None):
+    spec = PROFILES[profile]
+    domain = ET.Element("domain", type=settings.VM_DOMAIN_TYPE)
+    _sub(domain, "name", name)
+    if uuid is not None:
+        _sub(domain, "uuid", uuid)
+    _sub(domain, "memory", ram * 1024 * 1024, unit="KiB")
+    if hugepages:
+        backing = _sub(domain, "memoryBacking")
+        _sub(_sub(backing, "hugepages"), "page", size=settings.HUGEPAGE_SIZE_KIB, unit="KiB")
+    _sub(domain, "vcpu", cpu, placement="static")
+    if spec["iothreads"]:
+        _sub(domain, "iothreads", spec["iothreads"])
+    if cpus:
+        cputune = _sub(domain, "cputune")
+        for vcpu, host_cpu in enumerate(cpus):
+            _sub(cputune, "vcpupin", vcpu=vcpu, cpuset=host_cpu)
+        # Поток эмулятора и потоки ввода-вывода работают на тех же ядрах, а не на ядрах соседей
+        _sub(cputune, "emulatorpin", cpuset=",".join(str(host_cpu) for host_cpu in cpus))
+        for iothread in range(1, spec["iothreads"] + 1):
+            _sub(cputune, "iothreadpin", iothread=iothread, cpuset=",".join(str(host_cpu) for host_cpu in cpus))
+    if node is not None:
+        _sub(_sub(domain, "numatune"), "memory", mode="strict", nodeset=node)
+
+    os_element = _sub(domain, "os")
+    _sub(os_element, "type", "hvm", arch="x86_64", machine="q35")
+    _sub(os_element, "boot", dev="hd")
+    features = _sub(domain, "features")
+    _sub(features, "acpi")
+    _sub(features, "apic")
+    if spec["pinning"]:
+        cpu_element = _sub(domain, "cpu", mode="host-passthrough", check="none")
+        _sub(cpu_element, "topology", sockets=1, cores=cpu, threads=1)
+    _sub(domain, "clock", offset="utc")
+
+    devices = _sub(domain, "devices")
+    disk = _sub(devices, "disk", type="file", device="disk")
+    driver = {"name": "qemu", "type": "qcow2", "discard": "unmap"}
+    if spec["iothreads"]:
+        driver.update(cache="none", io="native", iothread=1)
+    _sub(disk, "driver", **driver)
+    _sub(disk, "source", file=disk_path)
+    _sub(disk, "target", dev="vda", bus="virtio")
+    if iotune:
+        # QEMU ограничивает запросы диска сам, до очереди хоста, поэтому лимит действует и для cache=none
+        tune = _sub(disk, "iotune")
+        for key, value in iotune.items():
+            _sub(tune, key, value)
+
+    seed = _sub(devices, "disk", type="file", device="cdrom")
+    _sub(seed, "driver", name="qemu", type="raw")
+    _sub(seed, "source", file=seed_path)
+    _sub(seed, "target", dev="sda", bus="sata")
+    _sub(seed, "readonly")
+
+    interface = _sub(devices, "interface", type="network")
+    _sub(interface, "mac", address=mac)
+    _sub(interface, "source", network=settings.LIBVIRT_NETWORK)
+    _sub(interface, "model", type="virtio")
+    if spec["multiqueue"] and cpu > 1:
+        _sub(interface, "driver", name="vhost", queues=min(cpu, MAX_NET_QUEUES))
+
+    # Консоль без графики: virsh console работает через последовательный порт
+    _sub(_sub(devices, "serial", type="pty"), "target", port=0)
+    _sub(_sub(devices, "console", type="pty"), "target", type="serial", port=0)
+    _sub(devices, "memballoon", model="virtio")
+    return ET.tostring(domain, encoding="unicode")
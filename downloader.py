@@ -0,0 +1,294 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+
+import requests
+
+import settings
+
+CHUNK_SIZE = 1024 * 1024
+# Как часто сохранять состояние сегментов для докачки (байты)
+STATE_SAVE_BYTES = 16 * 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ChecksumError(DownloadError):
+    pass
+
+
+# Ищем SHA256 файла в опубликованном списке контрольных сумм.
+# Поддерживаются форматы "<hash>  <file>", "<hash> *<file>" и "SHA256 (<file>) = <hash>".
+# Если в файле одна сумма (например, для ссылки "latest"), берём её.
+def parse_checksums(text, file_name):
+    found = []
+    for line in text.splitlines():
+        line = line.strip()
+        match = re.match(r"^SHA256 \((.+)\) = ([0-9a-fA-F]{64})$", line)
+        if match:
+            found.append((match.group(1), match.group(2).lower()))
+            continue
+        match = re.match(r"^([0-9a-fA-F]{64})\s+\*?(.+)$", line)
+        if match:
+            found.append((match.group(2), match.group(1).lower()))
+    for name, digest in found:
+        if name == file_name:
+            return digest
+    if len(found) == 1:
+        return found[0][1]
+    return None
+
+
+def fetch_checksum(checksums_url, file_name):
+    response = requests.get(checksums_url, timeout=30)
+    response.raise_for_status()
+    digest = parse_checksums(response.text, file_name)
+    if digest is None:
+        raise DownloadError(f"Контрольная сумма для {file_name} не найдена в {checksums_url}")
+    return digest
+
+
+def store_path(digest):
+    return os.path.join(settings.DOWNLOAD_STORE_DIR, digest)
+
+
+_index_lock = threading.Lock()
+
+
+def _index_path():
+    return os.path.join(settings.DOWNLOAD_STORE_DIR, "index.json")
+
+
+def _read_index():
+    try:
+        with open(_index_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _remember(url, digest):
+    with _index_lock:
+        index = _read_index()
+        if index.get(url) == digest:
+            return
+        index[url] = digest
+        tmp = f"{_index_path()}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp, _index_path())
+
+
+# Путь к уже скачанному и проверенному файлу для URL или None
+def cached_path(url):
+    digest = _read_index().get(url)
+    if digest and os.path.exists(store_path(digest)):
+        return store_path(digest)
+    return None
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Одно скачивание, которое разделяют все одновременные запросы одного файла
+class _Flight:
+    def __init__(self):
+        self.done = 0
+        self.total = 0
+        self.path = None
+        self.error = None
+        self.finished = threading.Event()
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _probe(url):
+    response = requests.get(url, headers={"Range": "bytes=0-0"}, stream=True, allow_redirects=True, timeout=30)
+    response.raise_for_status()
+    response.close()
+    final_url = response.url
+    if response.status_code == 206:
+        total = int(response.headers["Content-Range"].rsplit("/", 1)[1])
+        return final_url, total, True, response.headers.get("ETag")
+    return final_url, int(response.headers.get("Content-Length", 0)), False, response.headers.get("ETag")
+
+
+def _load_state(state_path, total, etag):
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("total") != total or state.get("etag") != etag:
+        return None
+    return state["segments"]
+
+
+def _save_state(state_path, total, etag, segments):
+    tmp = f"{state_path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"total": total, "etag": etag, "segments": segments}, f)
+    os.replace(tmp, state_path)
+
+
+# Скачиваем [start + done, end] одного сегмента во временный файл
+def _fetch_segment(url, part_path, segment, flight, lock, save):
+    start, end = segment[0], segment[1]
+    if start + segment[2] > end:
+        return
+    headers = {"Range": f"bytes={start + segment[2]}-{end}"}
+    with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise DownloadError("Сервер перестал поддерживать HTTP Range")
+        with open(part_path, "r+b") as f:
+            f.seek(start + segment[2])
+            unsaved = 0
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                with lock:
+                    segment[2] += len(chunk)
+                    flight.done += len(chunk)
+                unsaved += len(chunk)
+                if unsaved >= STATE_SAVE_BYTES:
+                    f.flush()
+                    save()
+                    unsaved = 0
+    if start + segment[2] <= end:
+        raise DownloadError(f"Сегмент {start}-{end} скачан не полностью")
+
+
+def _fetch_ranges(url, part_path, state_path, total, etag, segments_count, flight):
+    segments = _load_state(state_path, total, etag) if os.path.exists(part_path) else None
+    if segments is None:
+        size = -(-total // segments_count)
+        segments = [[start, min(start + size, total) - 1, 0] for start in range(0, total, size)]
+        with open(part_path, "wb") as f:
+            f.truncate(total)
+    flight.done = sum(segment[2] for segment in segments)
+    lock = threading.Lock()
+
+    def save():
+        with lock:
+            _save_state(state_path, total, etag, [list(segment) for segment in segments])
+
+    save()
+    errors = []
+
+    def worker(segment):
+        try:
+            _fetch_segment(url, part_path, segment, flight, lock, save)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(segment,), daemon=True) for segment in segments]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    save()
+    if errors:
+        raise DownloadError(f"Ошибка при скачивании {url}: {errors[0]}")
+
+
+# Запасной вариант для серверов без поддержки Range: один поток, без докачки
+def _fetch_stream(url, part_path, flight):
+    flight.done = 0
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(part_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                flight.done += len(chunk)
+
+
+def _download(url, expected, segments_count, flight):
+    os.makedirs(os.path.join(settings.DOWNLOAD_STORE_DIR, "tmp"), exist_ok=True)
+    key = expected or hashlib.sha256(url.encode()).hexdigest()
+    base = os.path.join(settings.DOWNLOAD_STORE_DIR, "tmp", key)
+    part_path, state_path = f"{base}.part", f"{base}.state"
+    # Блокировка между процессами: один и тот же файл качает только один процесс
+    with open(f"{base}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if expected and os.path.exists(store_path(expected)):
+            return store_path(expected)
+        final_url, total, ranges, etag = _probe(url)
+        flight.total = total
+        if ranges and total > 0:
+            _fetch_ranges(final_url, part_path, state_path, total, etag, segments_count, flight)
+        else:
+            _fetch_stream(final_url, part_path, flight)
+        digest = sha256_file(part_path)
+        if expected and digest != expected:
+            os.remove(part_path)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            raise ChecksumError(f"SHA256 не совпадает для {url}: ожидалось {expected}, получено {digest}")
+        os.replace(part_path, store_path(digest))
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return store_path(digest)
+
+
+def _run_flight(key, url, expected, segments_count, flight):
+    try:
+        flight.path = _download(url, expected, segments_count, flight)
+        _remember(url, os.path.basename(flight.path))
+    except Exception as e:
+        flight.error = e
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.finished.set()
+
+
+# Скачивает файл в хранилище по SHA256 и возвращает путь к нему.
+# progress(done, total) вызывается в потоке вызывающего не чаще раза в progress_interval секунд.
+def download(url, checksums_url=None, sha256=None, progress=None, segments=None, progress_interval=0.5):
+    os.makedirs(settings.DOWNLOAD_STORE_DIR, exist_ok=True)
+    expected = sha256.lower() if sha256 else None
+    if expected is None and checksums_url:
+        try:
+            expected = fetch_checksum(checksums_url, url.split("/")[-1])
+        except requests.exceptions.RequestException:
+            path = cached_path(url)
+            if path:
+                return path  # сети нет, но файл уже скачан и проверен
+            raise
+    if expected and os.path.exists(store_path(expected)):
+        _remember(url, expected)
+        return store_path(expected)
+
+    key = expected or url
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            _flights[key] = flight
+            threading.Thread(
+                target=_run_flight,
+                args=(key, url, expected, segments or settings.DOWNLOAD_SEGMENTS, flight),
+                name="download",
+                daemon=True,
+            ).start()
+
+    while not flight.finished.wait(progress_interval):
+        if progress is not None:
+            progress(flight.done, flight.total)
+    if flight.error is not None:
+        raise flight.error
+    if progress is not None:
+        progress(flight.total or flight.done, flight.total or flight.done)
+    return flight.path
@@ -0,0 +1,83 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+import downloader
+
+# Каталог облачных образов: один подготовленный образ на дистрибутив
+GOLDEN_IMAGES = {
+    "Ubuntu 20.04": {
+        "url": "https://cloud-images.ubuntu.com/focal/current/focal-server-cloudimg-amd64.img",
+        "checksums": "https://cloud-images.ubuntu.com/focal/current/SHA256SUMS",
+    },
+    "CentOS": {
+        "url": "https://cloud.centos.org/centos/10-stream/x86_64/images/CentOS-Stream-GenericCloud-10-latest.x86_64.qcow2",
+        "checksums": "https://cloud.centos.org/centos/10-stream/x86_64/images/CentOS-Stream-GenericCloud-10-latest.x86_64.qcow2.SHA256SUM",
+    },
+    "Fedora": {
+        "url": "https://download.fedoraproject.org/pub/fedora/linux/releases/41/Cloud/x86_64/images/Fedora-Cloud-Base-Generic-41-1.4.x86_64.qcow2",
+        "checksums": "https://download.fedoraproject.org/pub/fedora/linux/releases/41/Cloud/x86_64/images/Fedora-Cloud-41-1.4-x86_64-CHECKSUM",
+    },
+}
+
+
+# Скачивает (или берёт из кэша) проверенный по SHA256 образ и возвращает путь к нему
+def fetch_golden_image(os_name, progress=None):
+    image = GOLDEN_IMAGES.get(os_name)
+    if image is None:
+        raise ValueError(f"Образ для {os_name} не подходит.")
+    return downloader.download(image["url"], checksums_url=image["checksums"], progress=progress)
+
+
+def is_cached(os_name):
+    return downloader.cached_path(GOLDEN_IMAGES[os_name]["url"]) is not None
+
+
+# Диск ВМ - это qcow2-надстройка над golden image: создаётся за миллисекунды
+# и хранит только изменения относительно исходного образа
+def create_overlay(disk_path, backing_path, size):
+    subprocess.run(
+        ['qemu-img', 'create', '-f', 'qcow2', '-F', 'qcow2', '-b', backing_path, disk_path, f'{size}G'],
+        check=True,
+    )
+
+
+def cloud_init_user_data(public_key):
+    return (
+        "#cloud-config\n"
+        "users:\n"
+        "  - name: cloud-user\n"
+        "    sudo: ALL=(ALL) NOPASSWD:ALL\n"
+        "    shell: /bin/bash\n"
+        "    ssh_authorized_keys:\n"
+        f"      - {public_key}\n"
+        "ssh_pwauth: false\n"
+    )
+
+
+def cloud_init_meta_data(vm_name):
+    return f"instance-id: {vm_name}\nlocal-hostname: {vm_name}\n"
+
+
+# Seed-диск NoCloud для cloud-init: ISO с меткой cidata и файлами user-data/meta-data
+def create_seed_iso(seed_path, user_data, meta_data):
+    with tempfile.TemporaryDirectory() as tmp:
+        user_data_path = os.path.join(tmp, "user-data")
+        meta_data_path = os.path.join(tmp, "meta-data")
+        with open(user_data_path, "w") as f:
+            f.write(user_data)
+        with open(meta_data_path, "w") as f:
+            f.write(meta_data)
+        if shutil.which("cloud-localds"):
+            command = ["cloud-localds", seed_path, user_data_path, meta_data_path]
+        elif shutil.which("genisoimage") or shutil.which("mkisofs"):
+            tool = shutil.which("genisoimage") or shutil.which("mkisofs")
+            command = [tool, "-output", seed_path, "-volid", "cidata", "-joliet", "-rock",
+                       user_data_path, meta_data_path]
+        elif shutil.which("xorriso"):
+            command = ["xorriso", "-as", "mkisofs", "-output", seed_path, "-volid", "cidata", "-joliet", "-rock",
+                       user_data_path, meta_data_path]
+        else:
+            raise RuntimeError("Не найден cloud-localds, genisoimage или xorriso для создания seed ISO.")
+        subprocess.run(command, check=True, capture_output=True)
@@ -0,0 +1,330 @@
+import collections
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import metrics
+import settings
+
+IDLE_STATUS = "Приостановлен (простой)"
+
+# Состояния TCP в /proc/net/tcp: 01 - ESTABLISHED, 03 - SYN_RECV (соединение ждёт accept)
+TCP_SESSION_STATES = ("01", "03")
+
+PAUSES = metrics.counter("rental_idle_pauses_total", "Аренды, приостановленные из-за простоя.")
+WAKES = metrics.counter("rental_idle_wakes_total", "Приостановленные аренды, возобновлённые по SSH или из интерфейса.")
+
+
+# Число TCP-сессий на локальном порту port в тексте /proc/<pid>/net/tcp(6)
+def count_tcp_sessions(text, port=22):
+    count = 0
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) > 3 and fields[3] in TCP_SESSION_STATES and int(fields[1].rsplit(":", 1)[1], 16) == port:
+            count += 1
+    return count
+
+
+# Порты назначения TCP-соединений, которые сейчас открываются или открыты, по таблице conntrack.
+# Проброс SSH к ВМ идёт через DNAT, поэтому dport в исходном направлении - порт хоста из net_alloc.
+def conntrack_ports(text):
+    ports = collections.Counter()
+    for line in text.splitlines():
+        if " tcp " not in f" {line} " or not any(state in line for state in ("ESTABLISHED", "SYN_SENT", "SYN_RECV")):
+            continue
+        for field in line.split():
+            if field.startswith("dport="):
+                ports[int(field[6:])] += 1
+                break  # первое dport - исходное направление
+    return ports
+
+
+def _read_conntrack():
+    try:
+        with open("/proc/net/nf_conntrack") as f:
+            return f.read()
+    except OSError:
+        pass
+    try:
+        return subprocess.run(
+            ["conntrack", "-L", "-p", "tcp"], capture_output=True, text=True, timeout=10
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+# Детектор простоя аренд на локальном хосте. Аренда простаивает, если дольше RENTAL_IDLE_AFTER секунд
+# у неё нет нагрузки на CPU, трафика и SSH-сессий. Контейнер ставится на паузу (cgroup freezer),
+# ВМ приостанавливается (dom.suspend) и/или у неё забирается память через balloon.
+# Отдельный частый цикл следит за приостановленными арендами: новое SSH-подключение ядро хоста
+# принимает и без участия гостя, поэтому аренда возобновляется, пока клиент ждёт ответа sshd.
+# Освобождённые CPU и RAM сообщаются планировщику, который может отдать их часть новым арендам.
+# На удалённых хостах нет доступа к /proc и conntrack, их аренды не приостанавливаются.
+# Приостановленные аренды хранятся в state.db рядом с арендами: после перезапуска процесса
+# они снова отслеживаются и возобновляются по SSH-подключению.
+class IdleDetector:
+    def __init__(self, db_path=settings.STATE_DB):
+        self._last_active = {}  # (вид, имя) -> время последней активности
+        self._paused = {}  # (вид, имя) -> сведения о приостановке
+        self._lock = threading.Lock()
+        self._threads = []
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS idle_paused ("
+            "kind TEXT NOT NULL, name TEXT NOT NULL, host TEXT NOT NULL, since REAL NOT NULL, "
+            "cpu REAL NOT NULL, ram REAL NOT NULL, pid INTEGER, PRIMARY KEY (kind, name))"
+        )
+        self._db.commit()
+
+    def start(self):
+        if self._threads:
+            return
+        self._restore()
+        if not settings.IDLE_AFTER:
+            # Детектор выключен: то, что осталось приостановленным с прошлого запуска, возобновляем сразу
+            for kind, name in list(self._paused):
+                self.wake(kind, name, reason="restart")
+            return
+        metrics.gauge("rental_idle_paused", "Аренды, приостановленные из-за простоя.", self._paused_counts)
+        for target, name in ((self._run, "idle-detector"), (self._watch, "idle-wake")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _restore(self):
+        import scheduler
+
+        rows = self._db.execute("SELECT kind, name, host, since, cpu, ram, pid FROM idle_paused").fetchall()
+        for kind, name, host_name, since, cpu, ram, pid in rows:
+            host = scheduler.get_scheduler().hosts.get(host_name)
+            if host is None or scheduler.get_scheduler().allocation(name) is None:
+                # Хоста больше нет в конфигурации или аренда уже удалена
+                self._forget(kind, name)
+                continue
+            info = {"host": host, "since": since, "cpu": cpu, "ram": ram}
+            if pid is not None:
+                info["pid"] = pid
+            with self._lock:
+                self._paused[(kind, name)] = info
+            scheduler.get_scheduler().set_idle(name, cpu, min(ram, self._allocation(name)[1]))
+
+    def _forget(self, kind, name):
+        with self._lock:
+            self._db.execute("DELETE FROM idle_paused WHERE kind = ? AND name = ?", (kind, name))
+            self._db.commit()
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Ошибка детектора простоя: {e}", file=sys.stderr)
+            time.sleep(settings.IDLE_CHECK_INTERVAL)
+
+    def _watch(self):
+        while True:
+            try:
+                self.watch()
+            except Exception as e:
+                print(f"Ошибка при возобновлении аренд: {e}", file=sys.stderr)
+            time.sleep(settings.IDLE_WAKE_INTERVAL)
+
+    # Была ли нагрузка за последний интервал проверки: смотрим все замеры сборщика за это время
+    def _busy(self, row):
+        samples = max(1, int(settings.IDLE_CHECK_INTERVAL // settings.STATS_INTERVAL))
+        cpu = row["cpu_history"][-samples:]
+        net = [rx + tx for rx, tx in zip(row["net_rx_history"][-samples:], row["net_tx_history"][-samples:])]
+        return max(cpu or [0]) >= settings.IDLE_CPU_PERCENT or max(net or [0]) >= settings.IDLE_NET_KBPS
+
+    def check(self):
+        import scheduler
+        import stats_collector
+
+        now = time.monotonic()
+        conntrack = None
+        for kind in ("container", "vm"):
+            for row in stats_collector.get_collector().snapshot(kind):
+                key = (kind, row["name"])
+                host = scheduler.get_scheduler().host_of(row["name"])
+                if host is None or not host.local:
+                    continue  # не аренда (пул) или удалённый хост
+                with self._lock:
+                    if key in self._paused:
+                        continue
+                if kind == "vm" and conntrack is None:
+                    conntrack = conntrack_ports(_read_conntrack())
+                if self._busy(row) or self._sessions(kind, row["name"], host, conntrack):
+                    self._last_active[key] = now
+                    continue
+                last_active = self._last_active.setdefault(key, now)
+                if now - last_active >= settings.IDLE_AFTER:
+                    try:
+                        self._pause(kind, row["name"], host)
+                    except Exception as e:
+                        print(f"Не удалось приостановить {kind} '{row['name']}': {e}", file=sys.stderr)
+        # Забываем аренды, которых больше нет в замерах
+        seen = {(kind, row["name"]) for kind in ("container", "vm")
+                for row in stats_collector.get_collector().snapshot(kind)}
+        for key in [key for key in self._last_active if key not in seen]:
+            self._last_active.pop(key, None)
+
+    # Открытые SSH-сессии: у контейнера - в /proc/<pid>/net/tcp его сетевого пространства,
+    # у ВМ - соединения на её порт хоста в conntrack
+    def _sessions(self, kind, name, host, conntrack=None, pid=None):
+        if kind == "container":
+            pid = pid or host.docker().api.inspect_container(name)["State"]["Pid"]
+            count = 0
+            for table in ("tcp", "tcp6"):
+                try:
+                    with open(f"/proc/{pid}/net/{table}") as f:
+                        count += count_tcp_sessions(f.read())
+                except OSError:
+                    pass
+            return count
+        import net_alloc
+
+        endpoint = net_alloc.get_allocator().get(name)
+        if endpoint is None:
+            return 0
+        if conntrack is None:
+            conntrack = conntrack_ports(_read_conntrack())
+        return conntrack.get(endpoint["host_port"], 0)
+
+    def _pause(self, kind, name, host):
+        import scheduler
+
+        allocation_cpu, allocation_ram = self._allocation(name)
+        info = {"host": host, "since": time.time(), "cpu": 0, "ram": 0.0}
+        if kind == "container":
+            container = host.docker().containers.get(name)
+            # Остановленный или уже приостановленный контейнер приостанавливать нечего
+            if container.status != "running":
+                return
+            container.pause()
+            info.update(pid=container.attrs["State"]["Pid"], cpu=allocation_cpu)
+        else:
+            import libvirt
+
+            import libvirt_pool
+
+            action = settings.IDLE_VM_ACTION
+
+            def _pause_domain(conn):
+                dom = conn.lookupByName(name)
+                if dom.state()[0] != libvirt.VIR_DOMAIN_RUNNING:
+                    return False
+                if action in ("balloon", "both"):
+                    current = dom.info()[2]  # КиБ
+                    target = max(settings.IDLE_BALLOON_MIN_MB * 1024, int(current * settings.IDLE_BALLOON_FRACTION))
+                    if target < current:
+                        dom.setMemoryFlags(target, libvirt.VIR_DOMAIN_AFFECT_LIVE)
+                        info["ram"] = (current - target) / 1024 ** 2
+                if action in ("suspend", "both"):
+                    dom.suspend()
+                    info["cpu"] = allocation_cpu
+                return True
+
+            if not libvirt_pool.call("idle.pause", _pause_domain, uri=host.libvirt_uri):
+                return
+        with self._lock:
+            self._paused[(kind, name)] = info
+            self._db.execute(
+                "INSERT OR REPLACE INTO idle_paused (kind, name, host, since, cpu, ram, pid) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, name, host.name, info["since"], info["cpu"], info["ram"], info.get("pid")),
+            )
+            self._db.commit()
+        scheduler.get_scheduler().set_idle(name, info["cpu"], min(info["ram"], allocation_ram))
+        PAUSES.inc(kind=kind)
+        print(f"{kind} '{name}' приостановлен из-за простоя", file=sys.stderr)
+
+    def _allocation(self, name):
+        import scheduler
+
+        allocation = scheduler.get_scheduler().allocation(name)
+        return (allocation[2], allocation[3]) if allocation else (0, 0)
+
+    # Возобновляет аренду, если она приостановлена из-за простоя. Возвращает True, если аренда была приостановлена.
+    def wake(self, kind, name, reason="ui"):
+        import scheduler
+
+        with self._lock:
+            info = self._paused.pop((kind, name), None)
+            self._last_active[(kind, name)] = time.monotonic()
+        if info is None:
+            return False
+        self._forget(kind, name)
+        host = info["host"]
+        try:
+            if kind == "container":
+                host.docker().api.unpause(name)
+            else:
+                import libvirt
+
+                import libvirt_pool
+
+                def _resume(conn):
+                    dom = conn.lookupByName(name)
+                    if dom.state()[0] == libvirt.VIR_DOMAIN_PAUSED:
+                        dom.resume()
+                    if info["ram"]:
+                        dom.setMemoryFlags(dom.maxMemory(), libvirt.VIR_DOMAIN_AFFECT_LIVE)
+
+                libvirt_pool.call("idle.resume", _resume, uri=host.libvirt_uri)
+        except Exception as e:
+            print(f"Не удалось возобновить {kind} '{name}': {e}", file=sys.stderr)
+        scheduler.get_scheduler().clear_idle(name)
+        WAKES.inc(kind=kind, reason=reason)
+        return True
+
+    # Частая проверка приостановленных аренд: пришло ли SSH-подключение
+    def watch(self):
+        with self._lock:
+            paused = list(self._paused.items())
+        if not paused:
+            return
+        conntrack = None
+        if any(kind == "vm" for (kind, _), _ in paused):
+            conntrack = conntrack_ports(_read_conntrack())
+        for (kind, name), info in paused:
+            try:
+                sessions = self._sessions(kind, name, info["host"], conntrack, pid=info.get("pid"))
+            except Exception:
+                sessions = 0
+            if sessions:
+                self.wake(kind, name, reason="ssh")
+
+    def is_idle(self, kind, name):
+        with self._lock:
+            return (kind, name) in self._paused
+
+    def _paused_counts(self):
+        with self._lock:
+            counts = collections.Counter(kind for kind, _ in self._paused)
+        return [({"kind": kind}, counts.get(kind, 0)) for kind in ("container", "vm")]
+
+    # Приостановленные аренды для отображения
+    def paused(self, kind):
+        with self._lock:
+            return {
+                name: {"since": time.strftime("%H:%M:%S", time.localtime(info["since"])),
+                       "cpu": info["cpu"], "ram": round(info["ram"], 2)}
+                for (paused_kind, name), info in self._paused.items() if paused_kind == kind
+            }
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+# Общий для процесса экземпляр
+def get_detector():
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            _detector = IdleDetector()
+            _detector.start()
+        return _detector
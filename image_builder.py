@@ -0,0 +1,127 @@
+import hashlib
+import io
+import threading
+
+import docker
+
+import metrics
+
+# Базовые образы и пакетный менеджер для каждой ОС
+BASE_IMAGES = {
+    "Ubuntu 20.04": ("ubuntu:20.04", "apt"),
+    "CentOS": ("centos:8", "dnf"),
+    "Fedora": ("fedora:latest", "dnf"),
+}
+
+# Команды установки sshd для каждого пакетного менеджера
+INSTALL_COMMANDS = {
+    "apt": (
+        "apt-get update && DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends openssh-server"
+        " && rm -rf /var/lib/apt/lists/*"
+    ),
+    "dnf": "dnf install -y openssh-server && dnf clean all",
+}
+
+# CentOS 8 больше не поддерживается, пакеты лежат только в архиве vault.centos.org
+CENTOS_VAULT_FIX = (
+    "sed -i -e 's|^mirrorlist=|#mirrorlist=|g'"
+    " -e 's|^#baseurl=http://mirror.centos.org|baseurl=http://vault.centos.org|g'"
+    " /etc/yum.repos.d/CentOS-*.repo"
+)
+
+IMAGE_REPOSITORY = "rental-sshd"
+
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+_built = {}  # (адрес Docker, os_name) -> тег готового образа
+
+
+def dockerfile_for(os_name):
+    if os_name not in BASE_IMAGES:
+        raise ValueError("Unsupported OS")
+    base, package_manager = BASE_IMAGES[os_name]
+    install = INSTALL_COMMANDS[package_manager]
+    if base.startswith("centos:8"):
+        install = f"{CENTOS_VAULT_FIX} && {install}"
+    # Ключи хоста генерируются при старте, чтобы они не совпадали у всех контейнеров
+    return (
+        f"FROM {base}\n"
+        f"RUN {install} && mkdir -p /run/sshd /root/.ssh && chmod 700 /root/.ssh"
+        " && rm -f /etc/ssh/ssh_host_*\n"
+        "EXPOSE 22\n"
+        'CMD ["/bin/sh", "-c", "ssh-keygen -A >/dev/null && exec /usr/sbin/sshd -D -e"]\n'
+    )
+
+
+# Тег образа зависит от содержимого Dockerfile: при его изменении образ пересобирается
+def image_tag(os_name):
+    dockerfile = dockerfile_for(os_name)
+    digest = hashlib.sha256(dockerfile.encode()).hexdigest()[:12]
+    slug = os_name.lower().replace(" ", "-").replace(".", "")
+    return f"{IMAGE_REPOSITORY}:{slug}-{digest}"
+
+
+def _base_id(client, os_name):
+    try:
+        return client.images.get(BASE_IMAGES[os_name][0]).id
+    except docker.errors.ImageNotFound:
+        return None
+
+
+# Образ считается устаревшим, если он собран из другой версии базового образа, чем та, что сейчас на хосте
+def is_built(client, os_name):
+    tag = image_tag(os_name)
+    if _built.get((client.api.base_url, os_name)) == tag:
+        return True
+    try:
+        image = client.images.get(tag)
+    except docker.errors.ImageNotFound:
+        return False
+    base_id = _base_id(client, os_name)
+    if base_id and image.labels.get("rental.base_id") not in (None, base_id):
+        return False
+    _built[(client.api.base_url, os_name)] = tag
+    return True
+
+
+# Забыть, что образ собран: после обновления базового образа is_built проверит его заново
+def forget(client, os_name):
+    _built.pop((client.api.base_url, os_name), None)
+
+
+def _lock_for(tag):
+    with _build_locks_lock:
+        return _build_locks.setdefault(tag, threading.Lock())
+
+
+# Возвращает тег образа с sshd, собирая его один раз при первом обращении
+def ensure_ssh_image(client, os_name):
+    tag = image_tag(os_name)
+    with _lock_for((client.api.base_url, tag)):
+        if is_built(client, os_name):
+            return tag
+        base, _ = BASE_IMAGES[os_name]
+        base_id = _base_id(client, os_name)
+        if base_id is None:
+            # Через общий загрузчик: одновременные заявки на один образ ждут одну загрузку
+            import image_puller
+
+            image_puller.pull(client, base)
+            base_id = _base_id(client, os_name)
+        print(f"Сборка образа {tag} на основе {base}...")
+        with metrics.span("docker.build"):
+            client.images.build(
+                fileobj=io.BytesIO(dockerfile_for(os_name).encode()),
+                tag=tag,
+                rm=True,
+                labels={"rental.base": base, "rental.base_id": base_id, "rental.os": os_name},
+            )
+        _built[(client.api.base_url, os_name)] = tag
+        print(f"Образ {tag} собран.")
+        return tag
+
+
+if __name__ == "__main__":
+    docker_client = docker.from_env()
+    for name in BASE_IMAGES:
+        print(f"{name}: {ensure_ssh_image(docker_client, name)}")
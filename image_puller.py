@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import docker
+
+import image_builder
+import settings
+
+# Статусы слоя, после которых он считается скачанным
+LAYER_DONE = ("Download complete", "Pull complete", "Already exists")
+
+
+# Одна загрузка образа, которую разделяют все одновременные заявки на этот образ
+class _Pull:
+    def __init__(self):
+        self.layers = {}  # ID слоя -> [скачано байт, всего байт, статус]
+        self.error = None
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+
+    def update(self, event):
+        layer = event.get("id")
+        status = event.get("status", "")
+        if not layer or "progressDetail" not in event:
+            return
+        detail = event["progressDetail"] or {}
+        with self.lock:
+            state = self.layers.setdefault(layer, [0, 0, status])
+            state[2] = status
+            if status == "Downloading":
+                state[0] = detail.get("current", state[0])
+                state[1] = detail.get("total", state[1])
+            elif status in LAYER_DONE:
+                state[0] = state[1]
+
+    # (скачано байт, всего байт, готовых слоёв, всего слоёв)
+    def progress(self):
+        with self.lock:
+            layers = list(self.layers.values())
+        return (
+            sum(state[0] for state in layers),
+            sum(state[1] for state in layers),
+            sum(1 for state in layers if state[2] in LAYER_DONE),
+            len(layers),
+        )
+
+
+_pulls = {}
+_pulls_lock = threading.Lock()
+
+
+def split_image(image):
+    repository, _, tag = image.rpartition(":")
+    if not repository or "/" in tag:
+        return image, "latest"
+    return repository, tag
+
+
+def _run_pull(key, client, image, pull):
+    repository, tag = split_image(image)
+    try:
+        for event in client.api.pull(repository, tag=tag, stream=True, decode=True):
+            if "error" in event:
+                raise docker.errors.APIError(event["error"])
+            pull.update(event)
+        # Запоминаем и тег, и ID: после обновления старая версия теряет тег, но остаётся образом сервиса
+        get_cache().touch(client, image)
+        get_cache().touch(client, client.images.get(image).id)
+    except Exception as e:
+        pull.error = e
+    finally:
+        with _pulls_lock:
+            _pulls.pop(key, None)
+        pull.finished.set()
+
+
+# Скачивает образ через низкоуровневый API с потоком событий по слоям.
+# Одновременные вызовы для одного образа на одном хосте ждут одну загрузку.
+# progress(скачано, всего, готовых слоёв, всего слоёв) вызывается в потоке вызывающего.
+# Возвращает число слоёв образа.
+def pull(client, image, progress=None, progress_interval=0.5):
+    key = (client.api.base_url, image)
+    with _pulls_lock:
+        flight = _pulls.get(key)
+        if flight is None:
+            flight = _pulls[key] = _Pull()
+            threading.Thread(target=_run_pull, args=(key, client, image, flight), name="image-pull", daemon=True).start()
+    while not flight.finished.wait(progress_interval):
+        if progress is not None:
+            progress(*flight.progress())
+    if flight.error is not None:
+        raise flight.error
+    done, total, layers_done, layers = flight.progress()
+    if progress is not None:
+        progress(total, total, layers, layers)
+    return layers
+
+
+# Когда каждый образ использовался в последний раз (для вытеснения по LRU)
+class ImageCache:
+    def __init__(self, db_path=settings.STATE_DB):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS image_usage ("
+            "host TEXT NOT NULL, image TEXT NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (host, image))"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def touch(self, client, image):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO image_usage (host, image, last_used) VALUES (?, ?, ?)",
+                (client.api.base_url, image, time.time()),
+            )
+            self._db.commit()
+
+    def last_used(self, client):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT image, last_used FROM image_usage WHERE host = ?", (client.api.base_url,)
+            ).fetchall()
+        return dict(rows)
+
+    # Старые версии образов каталога (пересобранные sshd-образы и базовые образы, оставшиеся
+    # без тега после обновления) удаляются начиная с давно не использованных,
+    # пока все образы сервиса не поместятся в бюджет. Образы, из которых запущены контейнеры, Docker не даст удалить.
+    # Образами сервиса считаются только собранные им (с меткой rental.*) и скачанные им самим:
+    # Docker может быть общим, и чужие образы тех же дистрибутивов трогать нельзя.
+    def prune(self, client, budget_bytes=None):
+        budget_bytes = settings.IMAGE_DISK_BUDGET if budget_bytes is None else budget_bytes
+        current = {image_builder.image_tag(os_name) for os_name in image_builder.BASE_IMAGES}
+        current |= {base for base, _ in image_builder.BASE_IMAGES.values()}
+        last_used = self.last_used(client)
+        managed = [
+            image for image in client.images.list()
+            if any(label.startswith("rental.") for label in image.labels)
+            or image.id in last_used or any(tag in last_used for tag in image.tags)
+        ]
+        total = sum(image.attrs.get("Size", 0) for image in managed)
+        if total <= budget_bytes:
+            return 0
+
+        def _used_at(image):
+            return max([last_used.get(tag, 0) for tag in image.tags] + [last_used.get(image.id, 0)])
+
+        reclaimed = 0
+        old = [image for image in managed if not current.intersection(image.tags)]
+        for image in sorted(old, key=_used_at):
+            if total - reclaimed <= budget_bytes:
+                break
+            try:
+                client.images.remove(image.id)
+            except docker.errors.APIError as e:
+                print(f"Образ {image.tags or image.short_id} не удалён: {e}", file=sys.stderr)
+                continue
+            reclaimed += image.attrs.get("Size", 0)
+        return reclaimed
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache()
+        return _cache
+
+
+def _base_id(client, base):
+    try:
+        return client.images.get(base).id
+    except docker.errors.ImageNotFound:
+        return None
+
+
+# Одно обновление каталога: свежие базовые образы, пересборка устаревших sshd-образов и очистка
+def refresh(client):
+    for os_name, (base, _) in image_builder.BASE_IMAGES.items():
+        try:
+            before = _base_id(client, base)
+            pull(client, base)
+            if _base_id(client, base) != before:
+                image_builder.forget(client, os_name)
+            image_builder.ensure_ssh_image(client, os_name)
+        except Exception as e:
+            print(f"Не удалось обновить образ для {os_name}: {e}", file=sys.stderr)
+    try:
+        reclaimed = get_cache().prune(client)
+        if reclaimed:
+            print(f"Удалены старые образы: {reclaimed / 1024 ** 3:.1f} ГБ", file=sys.stderr)
+    except docker.errors.DockerException as e:
+        print(f"Не удалось очистить старые образы: {e}", file=sys.stderr)
+
+
+_refreshers = set()
+_refreshers_lock = threading.Lock()
+
+
+# Фоновая загрузка образов каталога при старте и обновление по расписанию, один поток на хост
+def start_refresh(client):
+    with _refreshers_lock:
+        if client.api.base_url in _refreshers or not settings.IMAGE_PREFETCH:
+            return
+        _refreshers.add(client.api.base_url)
+
+    def _loop():
+        while True:
+            refresh(client)
+            time.sleep(settings.IMAGE_REFRESH_INTERVAL)
+
+    threading.Thread(target=_loop, name="image-refresh", daemon=True).start()
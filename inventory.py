@@ -0,0 +1,198 @@
+import abc
+import sys
+import threading
+import time
+
+import docker
+
+import settings
+
+
+# Аренда с таким именем не найдена ни в списке в памяти, ни у Docker или libvirt
+class NotFound(LookupError):
+    pass
+
+
+# Как меняется состояние контейнера по событию Docker
+CONTAINER_EVENT_STATUS = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "stop": "exited",
+}
+
+
+# Список рабочих нагрузок в памяти: загружается один раз и дальше обновляется по событиям.
+# Чтение по имени и список не обращаются к Docker или libvirt.
+class Inventory(abc.ABC):
+    name = "inventory"
+
+    def __init__(self):
+        self._items = {}
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        self.reload()
+        self._subscribe()
+        threading.Thread(target=self._resync_loop, name=f"{self.name}-resync", daemon=True).start()
+
+    def get(self, name):
+        with self._cond:
+            item = self._items.get(name)
+            return dict(item) if item else None
+
+    def list(self):
+        with self._cond:
+            return [dict(self._items[name]) for name in sorted(self._items)]
+
+    # Ждём, пока запись для name не станет удовлетворять predicate(item)
+    def wait_for(self, name, predicate, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                item = self._items.get(name)
+                if predicate(item):
+                    return dict(item) if item else None
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise TimeoutError(f"{name}: состояние не изменилось за {timeout} с")
+                self._cond.wait(left)
+
+    def _replace(self, items):
+        with self._cond:
+            self._items = items
+            self._cond.notify_all()
+
+    def _set(self, name, **fields):
+        with self._cond:
+            self._items.setdefault(name, {"name": name}).update(fields)
+            self._cond.notify_all()
+
+    def _remove(self, name):
+        with self._cond:
+            self._items.pop(name, None)
+            self._cond.notify_all()
+
+    def _resync_loop(self):
+        while True:
+            time.sleep(settings.INVENTORY_RESYNC_INTERVAL)
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"{self.name}: не удалось перечитать список: {e}", file=sys.stderr)
+
+    # Полный список из Docker или libvirt
+    @abc.abstractmethod
+    def reload(self):
+        pass
+
+    # Подписка на события, по которым список обновляется
+    @abc.abstractmethod
+    def _subscribe(self):
+        pass
+
+
+# Контейнеры: начальная загрузка и поток событий Docker
+class ContainerInventory(Inventory):
+    name = "containers"
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+
+    # Как get, но при промахе один раз спрашивает Docker: событие о только что
+    # созданном контейнере могло ещё не прийти
+    def lookup(self, name):
+        item = self.get(name)
+        if item is not None:
+            return item
+        try:
+            container = self.client.api.inspect_container(name)
+        except docker.errors.NotFound:
+            return None
+        self._set(
+            name,
+            id=container["Id"],
+            status=container["State"]["Status"],
+            labels=container["Config"].get("Labels") or {},
+        )
+        return self.get(name)
+
+    def reload(self):
+        items = {}
+        for container in self.client.api.containers(all=True):
+            name = container["Names"][0].lstrip("/")
+            items[name] = {
+                "name": name,
+                "id": container["Id"],
+                "status": container["State"],
+                "labels": container.get("Labels") or {},
+            }
+        self._replace(items)
+
+    def _subscribe(self):
+        threading.Thread(target=self._events_loop, name="containers-events", daemon=True).start()
+
+    def _events_loop(self):
+        since = int(time.time())
+        while True:
+            try:
+                events = self.client.api.events(decode=True, since=since, filters={"type": "container"})
+                for event in events:
+                    since = event.get("time", since)
+                    self._apply(event)
+            except docker.errors.DockerException as e:
+                print(f"Поток событий Docker прерван: {e}", file=sys.stderr)
+            except Exception as e:
+                print(f"Ошибка обработки событий Docker: {e}", file=sys.stderr)
+            # После обрыва перечитываем всё, чтобы не потерять изменения
+            time.sleep(1)
+            try:
+                self.reload()
+            except docker.errors.DockerException as e:
+                print(f"Не удалось перечитать контейнеры: {e}", file=sys.stderr)
+                time.sleep(5)
+
+    def _apply(self, event):
+        action = event.get("Action", event.get("status", ""))
+        actor = event.get("Actor", {})
+        attributes = actor.get("Attributes", {})
+        name = attributes.get("name")
+        if not name:
+            return
+        if action == "destroy":
+            self._remove(name)
+        elif action == "rename":
+            old_name = attributes.get("oldName", "").lstrip("/")
+            with self._cond:
+                item = self._items.pop(old_name, None) or {"id": actor.get("ID")}
+                item["name"] = name
+                self._items[name] = item
+                self._cond.notify_all()
+        elif action in CONTAINER_EVENT_STATUS:
+            labels = {key: value for key, value in attributes.items() if key not in ("name", "image")}
+            fields = {"id": actor.get("ID", event.get("id")), "status": CONTAINER_EVENT_STATUS[action]}
+            if action == "create":
+                fields["labels"] = labels
+            self._set(name, **fields)
+
+
+_containers = {}
+_lock = threading.Lock()
+
+
+# Общий для всех сессий экземпляр на каждый клиент Docker (хост)
+def containers(client):
+    with _lock:
+        if client not in _containers:
+            _containers[client] = ContainerInventory(client)
+            _containers[client].start()
+        return _containers[client]
@@ -0,0 +1,204 @@
+import collections
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import settings
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class _ProgressHandle:
+    def __init__(self, job):
+        self.job = job
+
+    def progress(self, value, text=None):
+        self.job.fraction = value
+        self.job.progress_text = text
+
+    def empty(self):
+        pass
+
+
+# Задание на создание аренды. Методы сообщений повторяют st.info/st.success/...,
+# поэтому код создания пишет в задание так же, как раньше писал на страницу,
+# а страница потом показывает накопленные сообщения.
+class Job:
+    def __init__(self, kind, key, params):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.params = params
+        self.status = QUEUED
+        self.stage_name = None
+        self.stages = []  # [название, начало, конец]
+        self.fraction = 0.0
+        self.progress_text = None
+        self.messages = []  # (уровень, текст)
+        self.spans = []  # (операция, начало, длительность, ошибка) для трассы
+        self.result = None
+        self.error_text = None
+        self.owner = None  # хеш токена API, которым подана заявка (у заявок со страниц - None)
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    # Переход к следующему этапу создания
+    def stage(self, name):
+        now = time.time()
+        with self._lock:
+            if self.stages and self.stages[-1][2] is None:
+                self.stages[-1][2] = now
+            self.stages.append([name, now, None])
+            self.stage_name = name
+            self.fraction = 0.0
+            self.progress_text = None
+
+    def _message(self, level, text):
+        with self._lock:
+            self.messages.append((level, str(text)))
+
+    def info(self, text):
+        self._message("info", text)
+
+    def success(self, text):
+        self._message("success", text)
+
+    def warning(self, text):
+        self._message("warning", text)
+
+    def error(self, text):
+        self._message("error", text)
+
+    def write(self, text):
+        self._message("write", text)
+
+    def markdown(self, text):
+        self._message("markdown", text)
+
+    def code(self, text):
+        self._message("code", text)
+
+    def progress(self, value):
+        self.fraction = value
+        return _ProgressHandle(self)
+
+    def trace(self, name, start, seconds, failed):
+        with self._lock:
+            self.spans.append((name, start, seconds, failed))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "stage": self.stage_name,
+                "progress": self.fraction,
+                "progress_text": self.progress_text,
+                "stages": [
+                    {"name": name, "seconds": round((end or time.time()) - start, 3)}
+                    for name, start, end in self.stages
+                ],
+                "messages": list(self.messages),
+                "result": self.result,
+                "error": self.error_text,
+            }
+
+    def _finish(self, status):
+        now = time.time()
+        with self._lock:
+            if self.stages and self.stages[-1][2] is None:
+                self.stages[-1][2] = now
+            self.status = status
+            self.finished_at = now
+
+
+# Ограниченный пул рабочих потоков и таблица заданий.
+# Повторная заявка с тем же ключом возвращает уже существующее задание.
+class JobEngine:
+    def __init__(self, max_workers=None, queue_limit=None):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or settings.JOB_WORKERS, thread_name_prefix="job"
+        )
+        self.queue_limit = queue_limit or settings.JOB_QUEUE_LIMIT
+        self._jobs = collections.OrderedDict()
+        self._by_key = {}
+        self._lock = threading.Lock()
+        metrics.gauge("rental_jobs_active", "Заявки в очереди и в работе.", self.active_count)
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    # fn(*args, job=job) выполняется в рабочем потоке, её результат попадает в job.result
+    def submit(self, kind, key, fn, *args, owner=None):
+        with self._lock:
+            self._prune()
+            existing = self._by_key.get(key)
+            if existing is not None and existing.status != FAILED:
+                return existing
+            active = sum(1 for job in self._jobs.values() if not job.finished)
+            if active >= self.queue_limit:
+                raise RuntimeError("Слишком много заявок в очереди, попробуйте позже.")
+            job = Job(kind, key, args)
+            job.owner = owner
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        job.status = RUNNING
+        try:
+            job.result = fn(*args, job=job)
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            job.error_text = str(e)
+            job.error(str(e))
+            job._finish(FAILED)
+            metrics.job_finished(job)
+            return
+        job._finish(DONE if job.result is not None else FAILED)
+        metrics.job_finished(job)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, kind=None):
+        with self._lock:
+            return [job for job in self._jobs.values() if kind is None or job.kind == kind]
+
+    # Удаляем давно завершённые задания
+    def _prune(self):
+        deadline = time.time() - settings.JOB_TTL
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.finished_at < deadline:
+                del self._jobs[job_id]
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+# Общий для всех сессий экземпляр
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = JobEngine()
+        return _engine
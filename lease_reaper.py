@@ -0,0 +1,229 @@
+import heapq
+import importlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import metrics
+import settings
+
+
+# Один поток на процесс, который удаляет аренды по истечении времени.
+# Сроки лежат в min-куче, а сами аренды сохраняются в SQLite,
+# поэтому после перезапуска они подгружаются и просроченные удаляются пачкой.
+class LeaseReaper:
+    def __init__(self, db_path=settings.STATE_DB):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "kind TEXT NOT NULL, name TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (kind, name))"
+        )
+        self._db.commit()
+        self._cond = threading.Condition()
+        self._heap = []  # (expires_at, kind, name)
+        self._leases = {}  # (kind, name) -> expires_at
+        self._handlers = {}  # kind -> функция удаления
+        self._orphans = []  # просроченные аренды, для которых ещё нет обработчика
+        self._thread = None
+
+    # Загружаем аренды из базы и запускаем поток
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            for kind, name, expires_at in self._db.execute("SELECT kind, name, expires_at FROM leases"):
+                self._leases[(kind, name)] = expires_at
+                heapq.heappush(self._heap, (expires_at, kind, name))
+            self._thread = threading.Thread(target=self._run, name="lease-reaper", daemon=True)
+            self._thread.start()
+
+    # Регистрируем функцию удаления для вида аренды ("container", "vm")
+    def register(self, kind, handler):
+        with self._cond:
+            self._handlers[kind] = handler
+            waiting = [item for item in self._orphans if item[1] == kind]
+            self._orphans = [item for item in self._orphans if item[1] != kind]
+            for item in waiting:
+                heapq.heappush(self._heap, item)
+            self._cond.notify()
+
+    def add(self, kind, name, duration):
+        expires_at = time.time() + duration * 60
+        with self._cond:
+            self._db.execute(
+                "INSERT OR REPLACE INTO leases (kind, name, expires_at) VALUES (?, ?, ?)",
+                (kind, name, expires_at),
+            )
+            self._db.commit()
+            self._leases[(kind, name)] = expires_at
+            heapq.heappush(self._heap, (expires_at, kind, name))
+            self._cond.notify()
+        return expires_at
+
+    # Продление аренды на minutes минут, возвращает новый срок или None
+    def extend(self, kind, name, minutes):
+        with self._cond:
+            expires_at = self._load(kind, name)
+            if expires_at is None:
+                return None
+            expires_at += minutes * 60
+            self._db.execute(
+                "UPDATE leases SET expires_at = ? WHERE kind = ? AND name = ?",
+                (expires_at, kind, name),
+            )
+            self._db.commit()
+            self._leases[(kind, name)] = expires_at
+            heapq.heappush(self._heap, (expires_at, kind, name))
+            self._cond.notify()
+        return expires_at
+
+    # Отмена аренды: ресурс больше не будет удалён автоматически
+    def cancel(self, kind, name):
+        with self._cond:
+            cur = self._db.execute("DELETE FROM leases WHERE kind = ? AND name = ?", (kind, name))
+            self._db.commit()
+            self._leases.pop((kind, name), None)
+        return cur.rowcount > 0
+
+    def get(self, kind, name):
+        with self._cond:
+            return self._load(kind, name)
+
+    def list(self, kind=None):
+        with self._cond:
+            if kind is None:
+                rows = self._db.execute("SELECT kind, name, expires_at FROM leases ORDER BY expires_at")
+            else:
+                rows = self._db.execute(
+                    "SELECT kind, name, expires_at FROM leases WHERE kind = ? ORDER BY expires_at", (kind,)
+                )
+            return rows.fetchall()
+
+    # Число активных аренд по виду для метрик
+    def active_counts(self):
+        with self._cond:
+            rows = self._db.execute("SELECT kind, COUNT(*) FROM leases GROUP BY kind").fetchall()
+        return [({"kind": kind}, count) for kind, count in rows]
+
+    # База главнее памяти: аренду могли продлить или отменить из другого процесса
+    def _load(self, kind, name):
+        row = self._db.execute(
+            "SELECT expires_at FROM leases WHERE kind = ? AND name = ?", (kind, name)
+        ).fetchone()
+        if row is None:
+            self._leases.pop((kind, name), None)
+            return None
+        self._leases[(kind, name)] = row[0]
+        return row[0]
+
+    # Достаём из кучи все аренды, срок которых уже вышел
+    def _pop_due(self):
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            expires_at, kind, name = item
+            if self._leases.get((kind, name)) != expires_at:
+                continue  # устаревшая запись после продления или отмены
+            current = self._load(kind, name)
+            if current is None:
+                continue
+            if current > now:
+                heapq.heappush(self._heap, (current, kind, name))
+                continue
+            item = (current, kind, name)
+            if kind not in self._handlers:
+                self._orphans.append(item)
+                continue
+            due.append(item)
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due = self._pop_due()
+                if not due:
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                    continue
+                handlers = dict(self._handlers)
+            self._expire(due, handlers)
+
+    # Удаляем пачку просроченных аренд, неудачные откладываем на повтор
+    def _expire(self, due, handlers):
+        done = []
+        for expires_at, kind, name in due:
+            try:
+                handlers[kind](name)
+                done.append((kind, name, expires_at))
+            except Exception as e:
+                print(f"Ошибка при удалении {kind} '{name}' по истечении аренды: {e}", file=sys.stderr)
+                with self._cond:
+                    if self._load(kind, name) == expires_at:
+                        retry_at = time.time() + settings.LEASE_RETRY_DELAY
+                        self._db.execute(
+                            "UPDATE leases SET expires_at = ? WHERE kind = ? AND name = ?",
+                            (retry_at, kind, name),
+                        )
+                        self._db.commit()
+                        self._leases[(kind, name)] = retry_at
+                        heapq.heappush(self._heap, (retry_at, kind, name))
+        if not done:
+            return
+        with self._cond:
+            self._db.executemany(
+                "DELETE FROM leases WHERE kind = ? AND name = ? AND expires_at = ?", done
+            )
+            self._db.commit()
+            for kind, name, expires_at in done:
+                if self._leases.get((kind, name)) == expires_at:
+                    del self._leases[(kind, name)]
+                print(f"{kind} '{name}' удалён по истечении времени аренды.")
+
+
+# Обработчик, который импортирует модуль страницы только при первом истечении аренды.
+# Так сроки соблюдаются, даже если страница в этом процессе ещё ни разу не открывалась.
+def lazy_handler(module_name, function_name):
+    def handler(name):
+        return getattr(importlib.import_module(module_name), function_name)(name)
+    return handler
+
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+# Общий для процесса экземпляр
+def get_reaper():
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = LeaseReaper()
+            _reaper.start()
+            metrics.gauge("rental_active_leases", "Активные аренды по виду.", _reaper.active_counts)
+        return _reaper
+
+
+# Управление арендами для оператора:
+#   python lease_reaper.py list
+#   python lease_reaper.py extend vm 20250101-120000 30
+#   python lease_reaper.py cancel container container_20250101-120000
+if __name__ == "__main__":
+    reaper = LeaseReaper()
+    args = sys.argv[1:]
+    if not args or args[0] == "list":
+        for kind, name, expires_at in reaper.list():
+            left = max(0, int(expires_at - time.time()))
+            print(f"{kind}\t{name}\t{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(expires_at))}\t{left // 60} мин")
+    elif args[0] == "extend" and len(args) == 4:
+        expires_at = reaper.extend(args[1], args[2], int(args[3]))
+        print("Аренда не найдена" if expires_at is None else f"Новый срок: {time.ctime(expires_at)}")
+    elif args[0] == "cancel" and len(args) == 3:
+        print("Аренда отменена" if reaper.cancel(args[1], args[2]) else "Аренда не найдена")
+    else:
+        print("Использование: lease_reaper.py list | extend <kind> <name> <minutes> | cancel <kind> <name>")
+        sys.exit(1)
@@ -0,0 +1,161 @@
+import sys
+import threading
+import time
+
+import libvirt
+
+import metrics
+import settings
+
+# Ошибки, после которых соединение считается потерянным
+CONNECTION_ERRORS = (
+    libvirt.VIR_ERR_SYSTEM_ERROR,
+    libvirt.VIR_ERR_RPC,
+    libvirt.VIR_ERR_NO_CONNECT,
+    libvirt.VIR_ERR_INVALID_CONN,
+)
+
+_event_loop_lock = threading.Lock()
+_event_loop_started = False
+
+
+# Цикл событий libvirt нужен для keepalive и обратных вызовов о событиях доменов.
+# Его нужно зарегистрировать до открытия первого соединения.
+def ensure_event_loop():
+    global _event_loop_started
+    with _event_loop_lock:
+        if _event_loop_started:
+            return
+        libvirt.virEventRegisterDefaultImpl()
+
+        def _run():
+            while True:
+                libvirt.virEventRunDefaultImpl()
+
+        threading.Thread(target=_run, name="libvirt-events", daemon=True).start()
+        _event_loop_started = True
+
+
+# Общее для всех сессий Streamlit соединение с libvirt.
+# Соединение libvirt потокобезопасно, поэтому на один URI достаточно одного;
+# при обрыве оно открывается заново, а операция повторяется один раз.
+class LibvirtConnection:
+    def __init__(self, uri):
+        self.uri = uri
+        self._conn = None
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._stats = {}  # операция -> [количество, суммарное время, максимум, ошибки]
+
+    # Функция listener(conn) вызывается после каждого (пере)подключения
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+            conn = self._conn
+        if conn is not None:
+            listener(conn)
+
+    def get(self):
+        with self._lock:
+            if self._conn is not None and self._conn.isAlive() == 1:
+                return self._conn
+            self._conn = None
+            conn = self._connect()
+            self._conn = conn
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(conn)
+            except libvirt.libvirtError as e:
+                print(f"Ошибка обработчика подключения к {self.uri}: {e}", file=sys.stderr)
+        return conn
+
+    def _connect(self):
+        conn = libvirt.open(self.uri)
+        if conn is None:
+            raise libvirt.libvirtError(f"Не получилось открыть соединение с {self.uri}")
+        try:
+            conn.setKeepAlive(settings.LIBVIRT_KEEPALIVE_INTERVAL, settings.LIBVIRT_KEEPALIVE_COUNT)
+        except libvirt.libvirtError:
+            pass  # локальные драйверы (например, test://) keepalive не поддерживают
+        try:
+            conn.registerCloseCallback(self._on_close, None)
+        except libvirt.libvirtError:
+            pass
+        return conn
+
+    def _on_close(self, conn, reason, opaque):
+        print(f"Соединение с {self.uri} закрыто (причина {reason}), переподключимся при следующем вызове",
+              file=sys.stderr)
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+
+    def _drop(self, conn):
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+        try:
+            conn.close()
+        except libvirt.libvirtError:
+            pass
+
+    # Выполняет fn(conn) с замером времени и повтором после обрыва соединения
+    def call(self, operation, fn):
+        started = time.perf_counter()
+        failed = False
+        try:
+            for attempt in range(2):
+                conn = self.get()
+                try:
+                    return fn(conn)
+                except libvirt.libvirtError as e:
+                    if attempt == 0 and e.get_error_code() in CONNECTION_ERRORS:
+                        self._drop(conn)
+                        continue
+                    raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._record(operation, time.perf_counter() - started, failed)
+
+    def _record(self, operation, elapsed, failed):
+        metrics.LIBVIRT_SECONDS.observe(elapsed, operation=operation)
+        if failed:
+            metrics.ERRORS.inc(operation=f"libvirt.{operation}")
+        with self._lock:
+            stat = self._stats.setdefault(operation, [0, 0.0, 0.0, 0])
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] = max(stat[2], elapsed)
+            stat[3] += int(failed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                operation: {
+                    "calls": count,
+                    "avg_ms": round(total / count * 1000, 2) if count else 0.0,
+                    "max_ms": round(longest * 1000, 2),
+                    "errors": errors,
+                }
+                for operation, (count, total, longest, errors) in self._stats.items()
+            }
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(uri=None):
+    uri = uri or settings.LIBVIRT_URI
+    ensure_event_loop()
+    with _connections_lock:
+        if uri not in _connections:
+            _connections[uri] = LibvirtConnection(uri)
+        return _connections[uri]
+
+
+def call(operation, fn, uri=None):
+    return get_connection(uri).call(operation, fn)
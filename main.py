@@ -1,13 +1,39 @@
 import streamlit as st
-from container_page import container_page
-from vm_page import vm_page
 from home_page import home_page
+import idle
+import lease_reaper
+import metrics
+import reconciler
+import settings
+import widgets
 
 st.set_page_config(
     page_title="Rental",
     page_icon=":computer:",
 )
 
+# Фоновые службы запускаются один раз на процесс. Модули с Docker и libvirt импортируются
+# только при открытии, а удаление просроченных аренд подгружает нужный модуль само.
+@st.cache_resource
+def start_services():
+    # Эндпоинт /metrics для Prometheus, если задан RENTAL_METRICS_PORT
+    metrics.serve()
+    reaper = lease_reaper.get_reaper()
+    reaper.register("container", lease_reaper.lazy_handler("container_backend", "_expire_container"))
+    reaper.register("vm", lease_reaper.lazy_handler("vm_backend", "_expire_vm"))
+    # Приостановка простаивающих аренд, если задан RENTAL_IDLE_AFTER
+    idle.get_detector()
+    # Удаление брошенных каталогов, дисков и ключей аренд, если задан RENTAL_RECONCILE_INTERVAL
+    reconciler.get_reconciler()
+    # HTTP JSON API, если задан RENTAL_API_PORT: работает в этом же процессе с теми же пулами
+    if settings.API_PORT:
+        import api
+
+        api.serve()
+    return reaper
+
+start_services()
+
 if 'page' not in st.session_state:
     st.session_state.page = 'home'
 
@@ -22,9 +48,12 @@ with st.sidebar:
         pass
     if st.button("Контейнеры", on_click=change_page, args=('container',)):
         pass
-if st.session_state.page == 'home':
-    home_page()
-elif st.session_state.page == 'vm':
-    vm_page()
-elif st.session_state.page == 'container':
-    container_page()
\ No newline at end of file
+with widgets.full_run():
+    if st.session_state.page == 'home':
+        home_page()
+    elif st.session_state.page == 'vm':
+        from vm_page import vm_page
+        vm_page()
+    elif st.session_state.page == 'container':
+        from container_page import container_page
+        container_page()
\ No newline at end of file
@@ -0,0 +1,248 @@
+import bisect
+import contextlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import settings
+
+# Границы корзин гистограмм (секунды): от миллисекунд вызовов API до минут скачивания образов
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_NOOP = contextlib.nullcontext()
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="{value.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # метки -> [счётчики по корзинам, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not settings.METRICS_ENABLED:
+            return
+        key = _labels_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not settings.METRICS_ENABLED:
+            return
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+# Значение gauge считается при каждом запросе метрик функцией fn.
+# fn возвращает число или список пар (метки, значение).
+class Gauge:
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Не удалось получить метрику {self.name}: {e}", file=sys.stderr)
+            return lines
+        samples = [({}, value)] if isinstance(value, (int, float)) else value
+        for labels, sample in samples:
+            lines.append(f"{self.name}{_format_labels(_labels_key(labels))} {sample:g}")
+        return lines
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+
+def histogram(name, help_text, buckets=BUCKETS):
+    return _register(Histogram(name, help_text, buckets))
+
+
+def counter(name, help_text):
+    return _register(Counter(name, help_text))
+
+
+# Повторная регистрация с тем же именем заменяет функцию (например, после пересоздания пула)
+def gauge(name, help_text, fn):
+    with _registry_lock:
+        _registry[name] = Gauge(name, help_text, fn)
+        return _registry[name]
+
+
+STAGE_SECONDS = histogram("rental_stage_seconds", "Длительность этапов создания аренды.")
+JOB_SECONDS = histogram("rental_job_seconds", "Полное время выполнения заявки.")
+OPERATION_SECONDS = histogram("rental_operation_seconds", "Длительность отдельных операций Docker, libvirt и хоста.")
+LIBVIRT_SECONDS = histogram("rental_libvirt_call_seconds", "Длительность вызовов libvirt.")
+READY_SECONDS = histogram("rental_ready_seconds", "Время от запуска до ответа SSH.")
+JOBS = counter("rental_jobs_total", "Завершённые заявки по результату.")
+ERRORS = counter("rental_errors_total", "Ошибки операций.")
+
+
+@contextlib.contextmanager
+def _span(name, job, labels):
+    wall = time.time()
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        OPERATION_SECONDS.observe(elapsed, operation=name, **labels)
+        if failed:
+            ERRORS.inc(operation=name, **labels)
+        if job is not None:
+            job.trace(name, wall, elapsed, failed)
+
+
+# Замер одной операции: with metrics.span("docker.pull", job): ...
+# Время попадает в гистограмму и, если передано задание, в его трассу.
+def span(name, job=None, **labels):
+    if not settings.METRICS_ENABLED:
+        return _NOOP
+    return _span(name, job, labels)
+
+
+_trace_lock = threading.Lock()
+
+
+# Завершённое задание: этапы в гистограммы, итог в счётчик, трасса в файл
+def job_finished(job):
+    if not settings.METRICS_ENABLED:
+        return
+    snapshot = job.snapshot()
+    for stage in snapshot["stages"]:
+        STAGE_SECONDS.observe(stage["seconds"], kind=job.kind, stage=stage["name"])
+    JOB_SECONDS.observe(job.finished_at - job.created_at, kind=job.kind, status=job.status)
+    JOBS.inc(kind=job.kind, status=job.status)
+    if settings.TRACE_FILE:
+        record = {
+            "job": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+            "name": job.result.get("name") if isinstance(job.result, dict) else None,
+            "stages": snapshot["stages"],
+            "spans": [
+                {"name": name, "start": start, "seconds": round(seconds, 6), "failed": failed}
+                for name, start, seconds, failed in job.spans
+            ],
+            "error": job.error_text,
+        }
+        with _trace_lock:
+            with open(settings.TRACE_FILE, "a") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+# HTTP-эндпоинт /metrics в формате Prometheus. Запускается один раз на процесс.
+def serve(port=None):
+    global _server
+    port = settings.METRICS_PORT if port is None else port
+    if not settings.METRICS_ENABLED or not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((settings.METRICS_HOST, port), _Handler)
+            except OSError as e:
+                print(f"Не удалось открыть порт метрик {port}: {e}", file=sys.stderr)
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
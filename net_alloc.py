@@ -0,0 +1,212 @@
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+import libvirt_pool
+import settings
+
+NFT_TABLE = "rental"
+NFT_MAP = "ssh_forward"
+
+# Проброс портов через nftables: одно правило и хеш-таблица порт -> (IP гостя, 22),
+# поиск не зависит от числа ВМ, в отличие от отдельного правила iptables на каждую
+NFT_RULESET = f"""
+table ip {NFT_TABLE} {{
+    map {NFT_MAP} {{
+        type inet_service : ipv4_addr . inet_service
+    }}
+    chain prerouting {{
+        type nat hook prerouting priority dstnat; policy accept;
+        dnat ip to tcp dport map @{NFT_MAP}
+    }}
+    chain output {{
+        type nat hook output priority -100; policy accept;
+        fib daddr type local dnat ip to tcp dport map @{NFT_MAP}
+    }}
+    chain forward {{
+        type filter hook forward priority filter - 1; policy accept;
+        ct status dnat accept
+    }}
+}}
+"""
+
+
+# Выдача MAC-адресов и портов на хосте для ВМ. Назначения хранятся в SQLite.
+class EndpointAllocator:
+    def __init__(self, db_path=settings.STATE_DB):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS endpoints ("
+            "vm_name TEXT PRIMARY KEY, mac TEXT NOT NULL UNIQUE, "
+            "host_port INTEGER NOT NULL UNIQUE, guest_ip TEXT)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._nft_ready = False
+
+    # Возвращает (MAC, порт) для ВМ, выдавая новые при первом обращении
+    def allocate(self, vm_name):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT mac, host_port FROM endpoints WHERE vm_name = ?", (vm_name,)
+            ).fetchone()
+            if row is not None:
+                return row
+            used = {port for (port,) in self._db.execute("SELECT host_port FROM endpoints")}
+            first, last = settings.VM_PORT_RANGE
+            port = next((port for port in range(first, last + 1) if port not in used), None)
+            if port is None:
+                raise RuntimeError("Свободные порты для SSH закончились.")
+            for _ in range(100):
+                mac = settings.VM_MAC_PREFIX + "".join(f":{random.randint(0, 255):02x}" for _ in range(3))
+                try:
+                    self._db.execute(
+                        "INSERT INTO endpoints (vm_name, mac, host_port) VALUES (?, ?, ?)", (vm_name, mac, port)
+                    )
+                except sqlite3.IntegrityError:
+                    continue  # такой MAC уже выдан
+                self._db.commit()
+                return mac, port
+            raise RuntimeError("Не удалось подобрать уникальный MAC-адрес.")
+
+    def get(self, vm_name):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT mac, host_port, guest_ip FROM endpoints WHERE vm_name = ?", (vm_name,)
+            ).fetchone()
+        return {"mac": row[0], "host_port": row[1], "guest_ip": row[2]} if row else None
+
+    # Передать MAC и порт другой ВМ (ВМ из пула снимков получает имя аренды)
+    def rename(self, old_name, new_name):
+        with self._lock:
+            self._db.execute("UPDATE endpoints SET vm_name = ? WHERE vm_name = ?", (new_name, old_name))
+            self._db.commit()
+
+    def release(self, vm_name):
+        endpoint = self.get(vm_name)
+        if endpoint is None:
+            return
+        if endpoint["guest_ip"]:
+            self._nft(f"delete element ip {NFT_TABLE} {NFT_MAP} {{ {endpoint['host_port']} }}", check=False)
+        with self._lock:
+            self._db.execute("DELETE FROM endpoints WHERE vm_name = ?", (vm_name,))
+            self._db.commit()
+
+    # IP гостя по его MAC из DHCP-аренд сети libvirt
+    def resolve_ip(self, vm_name):
+        endpoint = self.get(vm_name)
+        if endpoint is None:
+            return None
+        leases = libvirt_pool.call(
+            "DHCPLeases",
+            lambda conn: conn.networkLookupByName(settings.LIBVIRT_NETWORK).DHCPLeases(endpoint["mac"]),
+        )
+        for lease in leases:
+            if lease.get("ipaddr") and ":" not in lease["ipaddr"]:
+                return lease["ipaddr"]
+        return None
+
+    # Направляем порт хоста на SSH гостя
+    def forward(self, vm_name, guest_ip):
+        endpoint = self.get(vm_name)
+        if endpoint is None:
+            return None
+        self._ensure_nft()
+        self._nft(f"delete element ip {NFT_TABLE} {NFT_MAP} {{ {endpoint['host_port']} }}", check=False)
+        self._nft(f"add element ip {NFT_TABLE} {NFT_MAP} {{ {endpoint['host_port']} : {guest_ip} . 22 }}")
+        with self._lock:
+            self._db.execute("UPDATE endpoints SET guest_ip = ? WHERE vm_name = ?", (guest_ip, vm_name))
+            self._db.commit()
+        return endpoint["host_port"]
+
+    # После перезагрузки хоста таблица nftables пуста: восстанавливаем проброс из базы
+    def restore(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT host_port, guest_ip FROM endpoints WHERE guest_ip IS NOT NULL"
+            ).fetchall()
+        if not rows:
+            return
+        self._ensure_nft()
+        elements = ", ".join(f"{port} : {ip} . 22" for port, ip in rows)
+        self._nft(f"flush map ip {NFT_TABLE} {NFT_MAP}")
+        self._nft(f"add element ip {NFT_TABLE} {NFT_MAP} {{ {elements} }}")
+
+    def _ensure_nft(self):
+        if self._nft_ready:
+            return
+        if subprocess.run(["nft", "list", "table", "ip", NFT_TABLE], capture_output=True).returncode != 0:
+            subprocess.run(["nft", "-f", "-"], input=NFT_RULESET, text=True, check=True, capture_output=True)
+        self._nft_ready = True
+
+    def _nft(self, command, check=True):
+        result = subprocess.run(["nft", command], capture_output=True, text=True)
+        if check and result.returncode != 0:
+            raise RuntimeError(f"nft {command}: {result.stderr.strip()}")
+        return result
+
+
+# Публичный адрес хоста кешируется и обновляется в фоне, а не запрашивается при каждом запуске ВМ
+class PublicAddress:
+    def __init__(self):
+        self._value = settings.PUBLIC_HOST or None
+        self._lock = threading.Lock()
+        if not settings.PUBLIC_HOST:
+            threading.Thread(target=self._run, name="public-address", daemon=True).start()
+
+    def _fetch(self):
+        try:
+            value = requests.get(settings.PUBLIC_IP_URL, timeout=5).text.strip()
+        except requests.exceptions.RequestException as e:
+            print(f"Не удалось узнать публичный адрес: {e}", file=sys.stderr)
+            return
+        with self._lock:
+            self._value = value
+
+    def _run(self):
+        while True:
+            self._fetch()
+            time.sleep(settings.PUBLIC_IP_REFRESH)
+
+    def get(self):
+        with self._lock:
+            if self._value is not None:
+                return self._value
+        self._fetch()
+        with self._lock:
+            # Внешний сервис недоступен: отдаём имя хоста, его можно скопировать в команду ssh
+            return self._value or socket.getfqdn()
+
+
+_allocator = None
+_public_address = None
+_lock = threading.Lock()
+
+
+# Общие для процесса экземпляры
+def get_allocator():
+    global _allocator
+    with _lock:
+        if _allocator is None:
+            _allocator = EndpointAllocator()
+            try:
+                _allocator.restore()
+            except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+                print(f"Не удалось восстановить проброс портов: {e}", file=sys.stderr)
+        return _allocator
+
+
+def public_address():
+    global _public_address
+    with _lock:
+        if _public_address is None:
+            _public_address = PublicAddress()
+    return _public_address.get()
@@ -0,0 +1,113 @@
+import collections
+import socket
+import threading
+import time
+
+import metrics
+import settings
+
+_times = collections.defaultdict(lambda: collections.deque(maxlen=1000))
+_times_lock = threading.Lock()
+
+
+def record(kind, seconds):
+    metrics.READY_SECONDS.observe(seconds, kind=kind)
+    with _times_lock:
+        _times[kind].append(seconds)
+
+
+# Время до готовности по видам нагрузок
+def stats():
+    with _times_lock:
+        result = {}
+        for kind, values in _times.items():
+            ordered = sorted(values)
+            result[kind] = {
+                "count": len(ordered),
+                "avg_s": round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+                "p95_s": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3) if ordered else 0.0,
+            }
+        return result
+
+
+# Повторяем check() с экспоненциальной паузой, пока он не вернёт не None или не выйдет срок
+def backoff(check, deadline, initial=0.05, maximum=1.0):
+    delay = initial
+    while True:
+        value = check()
+        if value is not None:
+            return value
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return None
+        time.sleep(min(delay, left))
+        delay = min(delay * 2, maximum)
+
+
+# sshd готов, когда принимает соединение и присылает баннер "SSH-..."
+def ssh_banner(host, port, timeout=2.0):
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+            sock.settimeout(timeout)
+            banner = sock.recv(255)
+    except OSError:
+        return None
+    return banner.decode(errors="replace").strip() if banner.startswith(b"SSH-") else None
+
+
+def wait_for_ssh(host, port, deadline):
+    return backoff(lambda: ssh_banner(host, port), deadline)
+
+
+# Контейнер: ждём событие запуска из inventory, читаем порт и проверяем баннер SSH.
+# Возвращает (порт, секунды до готовности); секунды None, если срок вышел.
+def wait_container_ready(client, container_inventory, name, timeout=None, probe_host=None):
+    started = time.monotonic()
+    deadline = started + (timeout or settings.CONTAINER_READY_TIMEOUT)
+    try:
+        container_inventory.wait_for(
+            name, lambda item: item is not None and item.get("status") == "running", deadline - time.monotonic()
+        )
+    except TimeoutError:
+        return None, None
+    ports = client.api.inspect_container(name)['NetworkSettings']['Ports']
+    bindings = ports.get('22/tcp') if ports else None
+    port = bindings[0]['HostPort'] if bindings else None
+    if port is None or wait_for_ssh(probe_host or settings.READY_PROBE_HOST, port, deadline) is None:
+        return port, None
+    elapsed = time.monotonic() - started
+    record("container", elapsed)
+    return port, elapsed
+
+
+# Адрес гостя: сначала из DHCP-аренд сети libvirt, затем через гостевой агент
+def guest_address(domain):
+    import libvirt
+
+    for source in (libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_LEASE, libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_AGENT):
+        try:
+            interfaces = domain.interfaceAddresses(source)
+        except libvirt.libvirtError:
+            continue
+        for name, interface in (interfaces or {}).items():
+            if name == "lo":
+                continue
+            for address in interface.get("addrs") or []:
+                if address["type"] == libvirt.VIR_IP_ADDR_TYPE_IPV4:
+                    return address["addr"]
+    return None
+
+
+# ВМ: ждём IP гостя и баннер SSH на нём. Возвращает (IP, секунды до готовности или None).
+# resolve() может вернуть адрес по-своему, например по выданному MAC.
+# probe_ssh=False - готовность по одному адресу из аренды DHCP или гостевого агента: адрес в сети libvirt
+# удалённого хоста отсюда недоступен, а проброса порта на удалённых хостах нет.
+def wait_vm_ready(domain, timeout=None, resolve=None, probe_ssh=True):
+    started = time.monotonic()
+    deadline = started + (timeout or settings.VM_READY_TIMEOUT)
+    address = backoff(resolve or (lambda: guest_address(domain)), deadline, initial=0.5, maximum=5.0)
+    if address is None or (probe_ssh and wait_for_ssh(address, 22, deadline) is None):
+        return address, None
+    elapsed = time.monotonic() - started
+    record("vm", elapsed)
+    return address, elapsed
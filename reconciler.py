@@ -0,0 +1,344 @@
+import collections
+import os
+import re
+import shutil
+import struct
+import sys
+import threading
+import time
+
+import metrics
+import settings
+
+RECLAIMED = metrics.counter("rental_reclaimed_bytes_total", "Место на диске, освобождённое сборщиком брошенных артефактов.")
+REMOVED = metrics.counter("rental_orphans_removed_total", "Удалённые брошенные артефакты аренд.")
+
+# Имена аренд, которые выдаёт сервис (см. create_vm и create_container): каталоги образов и Docker
+# общие, поэтому трогаем только то, что названо по этой схеме
+RENTAL_NAME = r"\d{8}-\d{6}-[0-9a-f]{4}"
+VM_NAME = re.compile(rf"^{RENTAL_NAME}$")
+CONTAINER_NAME = re.compile(rf"^container_{RENTAL_NAME}$")
+# Контейнеры пула (warm_pool: pool_<ОС>_<класс>_<8 hex>) и ВМ пула снимков (vm_snapshots: snap-<ОС>-<8 hex>)
+POOL_CONTAINER_NAME = re.compile(r"^pool_[a-z0-9-]+_\w+_[0-9a-f]{8}$")
+# Файлы ВМ в LIBVIRT_IMAGES_DIR: диск, seed cloud-init и каталог ключей (см. vm_backend.artifact_paths)
+VM_ARTIFACT = re.compile(rf"^(?P<name>{RENTAL_NAME})(\.qcow2|-seed\.iso|_ssh)$")
+# Файлы ВМ пула снимков: диск, seed, сохранённая память и ключи (см. vm_snapshots.SnapshotPool._paths)
+SNAPSHOT_ARTIFACT = re.compile(r"^(?P<name>snap-[a-z0-9-]+-[0-9a-f]{8})(\.qcow2|-seed\.iso|\.save|_ssh)$")
+# Файлы хранилища загрузок называются по SHA256 содержимого
+STORE_FILE = re.compile(r"^[0-9a-f]{64}$")
+QCOW2_MAGIC = b"QFI\xfb"
+
+
+# Место, которое занимает файл или каталог (по выделенным блокам: диски qcow2 разрежённые)
+def disk_usage(path):
+    try:
+        if not os.path.isdir(path) or os.path.islink(path):
+            return os.lstat(path).st_blocks * 512
+    except OSError:
+        return 0
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def remove_path(path):
+    size = disk_usage(path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+    return size
+
+
+# Путь к базовому образу из заголовка qcow2 (смещение и длина имени - байты 8-19) или None.
+# Читаем заголовок сами, чтобы не запускать qemu-img на каждый диск.
+def backing_file(path):
+    try:
+        with open(path, "rb") as f:
+            header = f.read(20)
+            if len(header) < 20 or header[:4] != QCOW2_MAGIC:
+                return None
+            offset, size = struct.unpack(">QI", header[8:20])
+            if not offset or not size:
+                return None
+            f.seek(offset)
+            return f.read(size).decode(errors="replace")
+    except OSError:
+        return None
+
+
+# Сборщик брошенных артефактов аренд. Раз в RENTAL_RECONCILE_INTERVAL секунд сравнивает контейнеры
+# и домены libvirt с файлами на диске и удаляет названное по схеме аренд, но не принадлежащее ни одной из них:
+# каталоги /data и ключи контейнеров (в том числе каталоги контейнеров пула), тома сервиса без контейнера,
+# диски, seed и ключи ВМ, файлы ВМ пула снимков, а также временные домены, оставшиеся работать после undefine. Артефакт удаляется, только если
+# он старше RENTAL_RECONCILE_GRACE секунд и имя не занято в планировщике (аренда может ещё создаваться).
+# Удаление идёт пачками по RENTAL_RECONCILE_BATCH с паузой между ними, чтобы не нагружать диск хоста.
+# После этого образы контейнеров и golden images ужимаются до своих бюджетов места.
+class Reconciler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last = None
+        self._totals = collections.Counter()
+
+    def start(self):
+        if self._thread is not None or not settings.RECONCILE_INTERVAL:
+            return
+        self._thread = threading.Thread(target=self._run, name="reconciler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Ошибка сборщика брошенных артефактов: {e}", file=sys.stderr)
+            time.sleep(settings.RECONCILE_INTERVAL)
+
+    def run_once(self):
+        started = time.time()
+        report = {"removed": collections.Counter(), "bytes": collections.Counter(), "errors": 0}
+        orphans = []
+        for find in (self._container_orphans, self._vm_orphans):
+            try:
+                orphans += find()
+            except Exception as e:
+                report["errors"] += 1
+                print(f"Не удалось найти брошенные артефакты ({find.__name__}): {e}", file=sys.stderr)
+        for index in range(0, len(orphans), settings.RECONCILE_BATCH):
+            if index:
+                time.sleep(settings.RECONCILE_BATCH_PAUSE)
+            for kind, what, remove in orphans[index:index + settings.RECONCILE_BATCH]:
+                try:
+                    with metrics.span("reconcile.remove", kind=kind):
+                        size = remove()
+                except Exception as e:
+                    report["errors"] += 1
+                    print(f"Не удалось удалить {what}: {e}", file=sys.stderr)
+                    continue
+                print(f"Удалён брошенный артефакт {what} ({size / 1024 ** 2:.1f} МБ)", file=sys.stderr)
+                self._record(report, kind, size)
+        for kind, prune in (("image", self._prune_images), ("golden_image", self._prune_golden_images)):
+            try:
+                for size in prune():
+                    self._record(report, kind, size)
+            except Exception as e:
+                report["errors"] += 1
+                print(f"Не удалось освободить место ({kind}): {e}", file=sys.stderr)
+        report.update(
+            started_at=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+            seconds=round(time.time() - started, 2),
+            reclaimed_mb=round(sum(report["bytes"].values()) / 1024 ** 2, 1),
+        )
+        with self._lock:
+            self._last = report
+        return report
+
+    def _record(self, report, kind, size):
+        report["removed"][kind] += 1
+        report["bytes"][kind] += size
+        REMOVED.inc(kind=kind)
+        RECLAIMED.inc(size, kind=kind)
+        with self._lock:
+            self._totals[kind] += size
+
+    # Достаточно старый артефакт без аренды с таким именем
+    def _stale(self, path, name):
+        import scheduler
+
+        try:
+            age = time.time() - os.lstat(path).st_mtime
+        except OSError:
+            return False
+        return age >= settings.RECONCILE_GRACE and scheduler.get_scheduler().host_of(name) is None
+
+    # Файловая система доступна только на локальном хосте, поэтому сверяем только его контейнеры
+    def _container_orphans(self):
+        import docker
+
+        import scheduler
+        import storage_tiers
+
+        host = scheduler.get_scheduler().default_host("container")
+        if host is None or not host.local:
+            return []
+        client = host.docker()
+        names, sources, volumes_in_use = set(), set(), set()
+        # Краткий список контейнеров уже содержит их монтирования, inspect по каждому не нужен
+        for summary in client.api.containers(all=True):
+            names.update(name.lstrip("/") for name in summary.get("Names") or [])
+            for mount in summary.get("Mounts") or []:
+                if mount.get("Type") == "bind":
+                    sources.add(mount.get("Source"))
+                elif mount.get("Type") == "volume":
+                    volumes_in_use.add(mount.get("Name"))
+        orphans = []
+        # Каталоги /data есть и у контейнеров пула; ключи выдаются только арендам
+        for directory, kind, patterns in (
+            (settings.DOCKER_DATA_DIR, "container_data", (CONTAINER_NAME, POOL_CONTAINER_NAME)),
+            (settings.KEYS_DIR, "container_key", (CONTAINER_NAME,)),
+        ):
+            try:
+                entries = os.listdir(directory)
+            except FileNotFoundError:
+                continue
+            for name in entries:
+                path = os.path.join(directory, name)
+                if not any(pattern.match(name) for pattern in patterns):
+                    continue
+                if name in names or path in sources or not self._stale(path, name):
+                    continue
+                orphans.append((kind, path, lambda path=path: remove_path(path)))
+        for volume in client.volumes.list(filters={"dangling": True}):
+            if not volume.name.startswith(storage_tiers.VOLUME_PREFIX) or volume.name in volumes_in_use:
+                continue
+            container_name = volume.name[len(storage_tiers.VOLUME_PREFIX):]
+            if not CONTAINER_NAME.match(container_name) or scheduler.get_scheduler().host_of(container_name) is not None:
+                continue
+
+            def _remove_volume(volume=volume):
+                size = disk_usage(volume.attrs.get("Mountpoint") or "")
+                try:
+                    volume.remove()
+                except docker.errors.NotFound:
+                    return 0
+                return size
+            orphans.append(("container_volume", f"том {volume.name}", _remove_volume))
+        return orphans
+
+    def _vm_orphans(self):
+        import libvirt
+
+        import libvirt_pool
+        import scheduler
+        import vm_snapshots
+
+        host = scheduler.get_scheduler().default_host("vm")
+        if host is None or not host.local:
+            return []
+        # Свежий список доменов из libvirt, а не из памяти: удалять по отстающему списку нельзя
+        domains = libvirt_pool.call("reconcile.list", lambda conn: conn.listAllDomains(), uri=host.libvirt_uri)
+        names = {domain.name() for domain in domains}
+        orphans = []
+        for domain in domains:
+            name = domain.name()
+            # Временный работающий домен аренды без резерва в планировщике - остаток undefine без destroy.
+            # Чужие домены (virsh create и т. п.) и ВМ пула снимков сюда не попадают по имени.
+            if not VM_NAME.match(name) or domain.isPersistent() or scheduler.get_scheduler().host_of(name):
+                continue
+
+            def _destroy(domain=domain):
+                try:
+                    libvirt_pool.call("reconcile.destroy", lambda conn: domain.destroy(), uri=host.libvirt_uri)
+                except libvirt.libvirtError as e:
+                    if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                        raise
+                return 0
+            orphans.append(("vm_ghost", f"временный домен {name}", _destroy))
+        # Файлы ВМ пула снимков принадлежат пулу, пока ВМ записана в state.db или ещё загружается
+        snapshots = vm_snapshots.get_pool().names()
+        for directory, kind, pattern, owned in (
+            (settings.LIBVIRT_IMAGES_DIR, "vm_artifact", VM_ARTIFACT, names),
+            (vm_snapshots.snapshot_dir(), "vm_snapshot", SNAPSHOT_ARTIFACT, names | snapshots),
+        ):
+            try:
+                entries = os.listdir(directory)
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                match = pattern.match(entry)
+                path = os.path.join(directory, entry)
+                if match is None or match.group("name") in owned or not self._stale(path, match.group("name")):
+                    continue
+                orphans.append((kind, path, lambda path=path: remove_path(path)))
+        return orphans
+
+    # Старые версии образов контейнеров сверх бюджета на каждом хосте (см. image_puller.ImageCache.prune)
+    def _prune_images(self):
+        import image_puller
+        import scheduler
+
+        reclaimed = []
+        for host in scheduler.get_scheduler().hosts.values():
+            if host.supports("container"):
+                size = image_puller.get_cache().prune(host.docker())
+                if size:
+                    reclaimed.append(size)
+        return reclaimed
+
+    # Скачанные golden images, которые не являются текущей версией ни одного дистрибутива
+    # и не служат базой ни одному диску, удаляются от самых старых, пока хранилище не уложится в бюджет
+    def _prune_golden_images(self):
+        import downloader
+        import golden_images
+        import vm_snapshots
+
+        store = settings.DOWNLOAD_STORE_DIR
+        try:
+            files = [name for name in os.listdir(store) if STORE_FILE.match(name)]
+        except FileNotFoundError:
+            return []
+        sizes = {name: disk_usage(os.path.join(store, name)) for name in files}
+        total = sum(sizes.values())
+        if total <= settings.GOLDEN_DISK_BUDGET:
+            return []
+        in_use = set()
+        for image in golden_images.GOLDEN_IMAGES.values():
+            path = downloader.cached_path(image["url"])
+            if path:
+                in_use.add(os.path.basename(path))
+        for directory in (settings.LIBVIRT_IMAGES_DIR, vm_snapshots.snapshot_dir()):
+            try:
+                disks = [name for name in os.listdir(directory) if name.endswith(".qcow2")]
+            except FileNotFoundError:
+                continue
+            for disk in disks:
+                backing = backing_file(os.path.join(directory, disk))
+                if backing:
+                    in_use.add(os.path.basename(backing))
+
+        reclaimed = []
+        unused = sorted(
+            (name for name in files if name not in in_use),
+            key=lambda name: os.path.getmtime(os.path.join(store, name)),
+        )
+        for name in unused:
+            if total <= settings.GOLDEN_DISK_BUDGET:
+                break
+            os.remove(os.path.join(store, name))
+            total -= sizes[name]
+            reclaimed.append(sizes[name])
+            print(f"Удалён неиспользуемый golden image {name[:12]} ({sizes[name] / 1024 ** 2:.1f} МБ)", file=sys.stderr)
+        return reclaimed
+
+    def stats(self):
+        with self._lock:
+            last = dict(self._last) if self._last else None
+            totals = dict(self._totals)
+        if last is not None:
+            last["removed"] = dict(last["removed"])
+            last["bytes"] = dict(last["bytes"])
+        return {
+            "last": last,
+            "reclaimed_mb_total": round(sum(totals.values()) / 1024 ** 2, 1),
+            "reclaimed_mb_by_kind": {kind: round(size / 1024 ** 2, 1) for kind, size in totals.items()},
+        }
+
+
+_reconciler = None
+_reconciler_lock = threading.Lock()
+
+
+# Общий для процесса экземпляр
+def get_reconciler():
+    global _reconciler
+    with _reconciler_lock:
+        if _reconciler is None:
+            _reconciler = Reconciler()
+            _reconciler.start()
+        return _reconciler
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import settings
+
+
+class NoCapacity(Exception):
+    pass
+
+
+# Адрес Docker из контекста docker CLI (~/.docker/contexts)
+def docker_context_endpoint(context_name):
+    meta_path = os.path.join(
+        os.path.expanduser("~"), ".docker", "contexts", "meta",
+        hashlib.sha256(context_name.encode()).hexdigest(), "meta.json",
+    )
+    with open(meta_path) as f:
+        return json.load(f)["Endpoints"]["docker"]["Host"]
+
+
+# Хост, на котором размещаются аренды: libvirt и/или Docker
+class Host:
+    def __init__(self, name, locations, libvirt_uri=None, docker=None, cpu=None, ram=None,
+                 overcommit_cpu=None, overcommit_ram=None, local=False, address=None):
+        self.name = name
+        # Адрес, по которому доступны опубликованные на хосте порты
+        self.address = address or (settings.READY_PROBE_HOST if local else name)
+        self.locations = list(locations)
+        self.libvirt_uri = libvirt_uri
+        self.docker_endpoint = docker
+        self.cpu = cpu
+        self.ram = ram
+        self.overcommit_cpu = overcommit_cpu or settings.OVERCOMMIT_CPU
+        self.overcommit_ram = overcommit_ram or settings.OVERCOMMIT_RAM
+        self.local = local
+        self._docker_client = None
+        self._lock = threading.Lock()
+
+    def supports(self, kind):
+        return self.libvirt_uri is not None if kind == "vm" else self.docker_endpoint is not None
+
+    def docker(self):
+        import docker
+
+        with self._lock:
+            if self._docker_client is None:
+                if self.docker_endpoint == "env":
+                    self._docker_client = docker.from_env()
+                elif self.docker_endpoint.startswith("context:"):
+                    base_url = docker_context_endpoint(self.docker_endpoint[len("context:"):])
+                    self._docker_client = docker.DockerClient(base_url=base_url)
+                else:
+                    self._docker_client = docker.DockerClient(base_url=self.docker_endpoint)
+            return self._docker_client
+
+    # Ёмкость хоста, если она не задана явно, узнаём у libvirt или Docker
+    def probe(self):
+        if self.cpu is not None and self.ram is not None:
+            return
+        if self.libvirt_uri is not None:
+            import libvirt_pool
+
+            info = libvirt_pool.call("getInfo", lambda conn: conn.getInfo(), uri=self.libvirt_uri)
+            cpu, ram = info[2], info[1] // 1024
+        else:
+            info = self.docker().info()
+            cpu, ram = info["NCPU"], info["MemTotal"] // (1024 ** 3)
+        self.cpu = self.cpu if self.cpu is not None else cpu
+        self.ram = self.ram if self.ram is not None else ram
+
+    def capacity(self):
+        return self.cpu * self.overcommit_cpu, self.ram * self.overcommit_ram
+
+
+def load_hosts():
+    raw = os.environ.get("RENTAL_HOSTS")
+    if raw is None and os.path.exists(settings.HOSTS_FILE):
+        with open(settings.HOSTS_FILE) as f:
+            raw = f.read()
+    if raw is None:
+        # По умолчанию - один локальный хост для всех локаций
+        return [Host("local", settings.LOCATIONS, libvirt_uri=settings.LIBVIRT_URI, docker="env", local=True)]
+    return [Host(**config) for config in json.loads(raw)]
+
+
+# Реестр хостов по локациям с учётом занятых CPU и RAM.
+# Заявка, которая никуда не помещается, отклоняется или ждёт в очереди.
+class Scheduler:
+    def __init__(self, hosts=None, db_path=settings.STATE_DB, strategy=None):
+        self.hosts = {host.name: host for host in (hosts or load_hosts())}
+        self.strategy = strategy or settings.PLACEMENT_STRATEGY
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS allocations ("
+            "name TEXT PRIMARY KEY, kind TEXT NOT NULL, host TEXT NOT NULL, "
+            "cpu INTEGER NOT NULL, ram INTEGER NOT NULL)"
+        )
+        self._db.commit()
+        self._cond = threading.Condition()
+        self._allocations = {
+            name: (kind, host, cpu, ram)
+            for name, kind, host, cpu, ram in self._db.execute("SELECT name, kind, host, cpu, ram FROM allocations")
+        }
+        self._idle = {}  # имя -> (CPU, RAM), освобождённые приостановленной из-за простоя арендой
+
+    def default_host(self, kind):
+        for host in self.hosts.values():
+            if host.local and host.supports(kind):
+                return host
+        return next((host for host in self.hosts.values() if host.supports(kind)), None)
+
+    def host_of(self, name):
+        with self._cond:
+            allocation = self._allocations.get(name)
+        return self.hosts.get(allocation[1]) if allocation else None
+
+    def allocation(self, name):
+        with self._cond:
+            return self._allocations.get(name)
+
+    # Простаивающие аренды учитываются не полностью: доля RENTAL_IDLE_RECLAIM освобождённых ими
+    # CPU и RAM отдаётся новым арендам, остальное остаётся запасом на их возобновление
+    def used(self, host_name):
+        cpu = ram = 0
+        for name, (_, host, alloc_cpu, alloc_ram) in self._allocations.items():
+            if host == host_name:
+                idle_cpu, idle_ram = self._idle.get(name, (0, 0))
+                cpu += alloc_cpu - idle_cpu * settings.IDLE_RECLAIM
+                ram += alloc_ram - idle_ram * settings.IDLE_RECLAIM
+        return cpu, ram
+
+    def idle(self, host_name):
+        cpu = ram = 0
+        for name, (idle_cpu, idle_ram) in self._idle.items():
+            if name in self._allocations and self._allocations[name][1] == host_name:
+                cpu += idle_cpu
+                ram += idle_ram
+        return cpu, ram
+
+    # Детектор простоя сообщает, сколько ресурсов освободила приостановленная аренда
+    def set_idle(self, name, cpu, ram):
+        with self._cond:
+            if name not in self._allocations:
+                return
+            self._idle[name] = (cpu, ram)
+            self._cond.notify_all()
+
+    def clear_idle(self, name):
+        with self._cond:
+            self._idle.pop(name, None)
+
+    # Ёмкость хостов узнаётся сетевым запросом, поэтому опрашиваем их без блокировки:
+    # медленный или недоступный хост не должен задерживать остальные заявки и освобождения
+    def _reachable(self, kind, location):
+        hosts = []
+        for host in self.hosts.values():
+            if not host.supports(kind) or (location and location not in host.locations):
+                continue
+            try:
+                host.probe()
+            except Exception as e:
+                print(f"Хост {host.name} недоступен: {e}", file=sys.stderr)
+                continue
+            hosts.append(host)
+        return hosts
+
+    def _candidates(self, hosts, cpu, ram):
+        candidates = []
+        for host in hosts:
+            cap_cpu, cap_ram = host.capacity()
+            # Хост с нулевой ёмкостью выведен из размещения
+            if cap_cpu <= 0 or cap_ram <= 0:
+                continue
+            used_cpu, used_ram = self.used(host.name)
+            free_cpu, free_ram = cap_cpu - used_cpu - cpu, cap_ram - used_ram - ram
+            if free_cpu >= 0 and free_ram >= 0:
+                # Доля ресурсов, которая останется свободной после размещения
+                candidates.append((min(free_cpu / cap_cpu, free_ram / cap_ram), host))
+        return candidates
+
+    # Резервируем ресурсы под аренду. Возвращает хост или бросает NoCapacity.
+    def reserve(self, kind, name, cpu, ram, location=None, timeout=None):
+        timeout = settings.ADMISSION_QUEUE_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        if not any(host.supports(kind) and (not location or location in host.locations)
+                   for host in self.hosts.values()):
+            raise NoCapacity(f"В локации {location} нет хостов для этого типа аренды.")
+        while True:
+            hosts = self._reachable(kind, location)
+            with self._cond:
+                if name in self._allocations:
+                    return self.hosts[self._allocations[name][1]]
+                candidates = self._candidates(hosts, cpu, ram)
+                if candidates:
+                    pick = min if self.strategy == "binpack" else max
+                    _, host = pick(candidates, key=lambda item: item[0])
+                    self._db.execute(
+                        "INSERT INTO allocations (name, kind, host, cpu, ram) VALUES (?, ?, ?, ?, ?)",
+                        (name, kind, host.name, cpu, ram),
+                    )
+                    self._db.commit()
+                    self._allocations[name] = (kind, host.name, cpu, ram)
+                    return host
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise NoCapacity(
+                        f"Недостаточно ресурсов в локации {location or 'любой'} для {cpu} CPU и {ram} GB RAM."
+                    )
+                self._cond.wait(left)
+
+    def release(self, name):
+        with self._cond:
+            self._idle.pop(name, None)
+            if self._allocations.pop(name, None) is None:
+                return
+            self._db.execute("DELETE FROM allocations WHERE name = ?", (name,))
+            self._db.commit()
+            self._cond.notify_all()
+
+    # Загрузка хостов для отображения
+    def usage(self):
+        with self._cond:
+            result = []
+            for host in self.hosts.values():
+                used_cpu, used_ram = self.used(host.name)
+                idle_cpu, idle_ram = self.idle(host.name)
+                result.append({
+                    "host": host.name,
+                    "locations": host.locations,
+                    "cpu": f"{used_cpu:g}/{host.cpu if host.cpu is not None else '?'} x{host.overcommit_cpu:g}",
+                    "ram": f"{used_ram:g}/{host.ram if host.ram is not None else '?'} GB x{host.overcommit_ram:g}",
+                    "idle": f"{idle_cpu:g} CPU, {idle_ram:.1f} GB",
+                })
+            return result
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# Общий для процесса экземпляр
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
@@ -0,0 +1,159 @@
+import os
+
+# Каталог с состоянием сервиса (аренды, ключи, кэш)
+STATE_DIR = os.environ.get("RENTAL_STATE_DIR", os.path.join(os.path.expanduser("~"), ".rental"))
+# База SQLite, в которой хранятся аренды
+STATE_DB = os.path.join(STATE_DIR, "state.db")
+
+# Через сколько секунд повторить удаление, если оно не удалось
+LEASE_RETRY_DELAY = int(os.environ.get("RENTAL_LEASE_RETRY_DELAY", "60"))
+
+# Пул заранее запущенных контейнеров
+WARM_POOL_ENABLED = os.environ.get("RENTAL_WARM_POOL", "1") == "1"
+# Классы размеров: максимальные CPU и RAM (ГБ), которые покрывает класс
+SIZE_CLASSES = {
+    "small": (2, 4),
+    "medium": (8, 32),
+    "large": (32, 128),
+}
+# Нижняя и верхняя граница пула для каждой пары (ОС, класс)
+WARM_POOL_LOW = int(os.environ.get("RENTAL_WARM_POOL_LOW", "1"))
+WARM_POOL_HIGH = int(os.environ.get("RENTAL_WARM_POOL_HIGH", "2"))
+WARM_POOL_CLASSES = os.environ.get("RENTAL_WARM_POOL_CLASSES", "small").split(",")
+# Как часто проверять заполненность пула (секунды)
+WARM_POOL_INTERVAL = int(os.environ.get("RENTAL_WARM_POOL_INTERVAL", "30"))
+# Каталог для папок, монтируемых в контейнеры
+DOCKER_DATA_DIR = os.path.join(os.path.expanduser("~"), "docker_data")
+
+# Каталог libvirt для дисков ВМ
+LIBVIRT_IMAGES_DIR = os.environ.get("RENTAL_LIBVIRT_IMAGES_DIR", "/var/lib/libvirt/images")
+# Подготовленные облачные образы (golden images), от которых клонируются диски ВМ
+GOLDEN_IMAGES_DIR = os.path.join(LIBVIRT_IMAGES_DIR, "golden")
+# Хранилище скачанных образов по их SHA256
+DOWNLOAD_STORE_DIR = os.environ.get("RENTAL_DOWNLOAD_STORE_DIR", os.path.join(GOLDEN_IMAGES_DIR, "sha256"))
+# Число параллельных HTTP Range-сегментов при скачивании
+DOWNLOAD_SEGMENTS = int(os.environ.get("RENTAL_DOWNLOAD_SEGMENTS", "4"))
+
+# Адрес libvirt, например qemu:///system или test:///default для проверки без KVM
+LIBVIRT_URI = os.environ.get("RENTAL_LIBVIRT_URI", "qemu:///system")
+# Keepalive соединения с libvirt: интервал (секунды) и число пропущенных ответов
+LIBVIRT_KEEPALIVE_INTERVAL = int(os.environ.get("RENTAL_LIBVIRT_KEEPALIVE_INTERVAL", "5"))
+LIBVIRT_KEEPALIVE_COUNT = int(os.environ.get("RENTAL_LIBVIRT_KEEPALIVE_COUNT", "3"))
+
+# Как часто полностью перечитывать список контейнеров и ВМ на случай пропущенных событий (секунды)
+INVENTORY_RESYNC_INTERVAL = int(os.environ.get("RENTAL_INVENTORY_RESYNC_INTERVAL", "300"))
+
+# Фоновые задания по созданию аренд: число рабочих потоков и предел очереди
+JOB_WORKERS = int(os.environ.get("RENTAL_JOB_WORKERS", "4"))
+JOB_QUEUE_LIMIT = int(os.environ.get("RENTAL_JOB_QUEUE_LIMIT", "100"))
+# Сколько секунд хранить завершённые задания
+JOB_TTL = int(os.environ.get("RENTAL_JOB_TTL", "3600"))
+
+# SSH-ключи: тип ("ed25519" или "rsa"), размер пула готовых ключей и каталог ключей контейнеров
+SSH_KEY_TYPE = os.environ.get("RENTAL_SSH_KEY_TYPE", "ed25519")
+SSH_KEY_POOL_SIZE = int(os.environ.get("RENTAL_SSH_KEY_POOL_SIZE", "4"))
+KEYS_DIR = os.path.join(STATE_DIR, "keys")
+
+# Ожидание готовности: общий срок (секунды) и адрес хоста для проверки SSH контейнеров
+CONTAINER_READY_TIMEOUT = int(os.environ.get("RENTAL_CONTAINER_READY_TIMEOUT", "30"))
+VM_READY_TIMEOUT = int(os.environ.get("RENTAL_VM_READY_TIMEOUT", "300"))
+READY_PROBE_HOST = os.environ.get("RENTAL_READY_PROBE_HOST", "127.0.0.1")
+
+# Сетевые адреса ВМ: префикс MAC, диапазон портов на хосте для SSH и сеть libvirt
+VM_MAC_PREFIX = os.environ.get("RENTAL_VM_MAC_PREFIX", "52:54:00")
+VM_PORT_RANGE = tuple(int(port) for port in os.environ.get("RENTAL_VM_PORT_RANGE", "22000-22999").split("-"))
+LIBVIRT_NETWORK = os.environ.get("RENTAL_LIBVIRT_NETWORK", "default")
+# Публичный адрес хоста: можно задать явно, иначе он узнаётся через сервис и обновляется раз в интервал
+PUBLIC_HOST = os.environ.get("RENTAL_PUBLIC_HOST", "")
+PUBLIC_IP_URL = os.environ.get("RENTAL_PUBLIC_IP_URL", "https://ifconfig.me")
+PUBLIC_IP_REFRESH = int(os.environ.get("RENTAL_PUBLIC_IP_REFRESH", "600"))
+
+# Хосты для размещения аренд: JSON-файл со списком хостов или переменная RENTAL_HOSTS с тем же JSON.
+# Пример хоста: {"name": "eu-1", "locations": ["Europe"], "libvirt_uri": "qemu+ssh://eu-1/system",
+#               "docker": "ssh://eu-1", "cpu": 64, "ram": 256, "overcommit_cpu": 4, "overcommit_ram": 1}
+HOSTS_FILE = os.environ.get("RENTAL_HOSTS_FILE", os.path.join(STATE_DIR, "hosts.json"))
+LOCATIONS = ["US East", "US West", "Europe", "Asia"]
+# Стратегия размещения: "binpack" (плотно) или "spread" (равномерно)
+PLACEMENT_STRATEGY = os.environ.get("RENTAL_PLACEMENT_STRATEGY", "binpack")
+# Переподписка ресурсов по умолчанию
+OVERCOMMIT_CPU = float(os.environ.get("RENTAL_OVERCOMMIT_CPU", "4"))
+OVERCOMMIT_RAM = float(os.environ.get("RENTAL_OVERCOMMIT_RAM", "1"))
+# Сколько секунд заявка может ждать в очереди освобождения ресурсов (0 - сразу отказ)
+ADMISSION_QUEUE_TIMEOUT = int(os.environ.get("RENTAL_ADMISSION_QUEUE_TIMEOUT", "0"))
+
+# Массовая аренда: наибольший размер пачки и число одновременно создаваемых аренд
+BULK_MAX = int(os.environ.get("RENTAL_BULK_MAX", "50"))
+BULK_WORKERS = int(os.environ.get("RENTAL_BULK_WORKERS", "8"))
+
+# Метрики: сбор замеров, порт HTTP-эндпоинта /metrics для Prometheus (0 - не открывать)
+# и файл JSONL с трассой каждой заявки (пусто - не писать)
+METRICS_ENABLED = os.environ.get("RENTAL_METRICS", "1") == "1"
+METRICS_HOST = os.environ.get("RENTAL_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("RENTAL_METRICS_PORT", "0"))
+TRACE_FILE = os.environ.get("RENTAL_TRACE_FILE", "")
+
+# Тип домена libvirt: "kvm" на реальном хосте, "test" для драйвера test:///default
+VM_DOMAIN_TYPE = os.environ.get("RENTAL_VM_DOMAIN_TYPE", "kvm")
+
+# Сборщик статистики нагрузок: интервал замеров (секунды), длина истории (точек)
+# и число одновременных запросов stats к Docker
+STATS_INTERVAL = int(os.environ.get("RENTAL_STATS_INTERVAL", "5"))
+STATS_HISTORY = int(os.environ.get("RENTAL_STATS_HISTORY", "120"))
+STATS_WORKERS = int(os.environ.get("RENTAL_STATS_WORKERS", "8"))
+
+# Фоновая загрузка и обновление базовых образов контейнеров ("0" - выключить)
+IMAGE_PREFETCH = os.environ.get("RENTAL_IMAGE_PREFETCH", "1") == "1"
+# Как часто проверять обновления базовых образов (секунды)
+IMAGE_REFRESH_INTERVAL = int(os.environ.get("RENTAL_IMAGE_REFRESH_INTERVAL", str(6 * 3600)))
+# Сколько места на диске могут занимать образы сервиса на одном хосте (ГБ), старые версии удаляются по LRU
+IMAGE_DISK_BUDGET = float(os.environ.get("RENTAL_IMAGE_DISK_BUDGET_GB", "20")) * 1024 ** 3
+
+# Ядра хоста, которые не отдаются под закрепление vCPU (оставляем системе), например "0-1"
+CPU_RESERVED = os.environ.get("RENTAL_CPU_RESERVED", "0")
+# Размер huge pages для памяти ВМ вычислительного профиля (КиБ)
+HUGEPAGE_SIZE_KIB = int(os.environ.get("RENTAL_HUGEPAGE_SIZE_KIB", "2048"))
+
+# Пул заранее загруженных и сохранённых на диск ВМ для мгновенной аренды: сколько ВМ держать
+# для каждого golden image (0 - выключен) и их форма "CPU,RAM ГБ,диск ГБ". Аренда другой формы загружается как обычно.
+# Сжатие файлов сохранения настраивается на хосте: save_image_format = "zstd" в /etc/libvirt/qemu.conf
+VM_SNAPSHOT_POOL = int(os.environ.get("RENTAL_VM_SNAPSHOT_POOL", "0"))
+VM_SNAPSHOT_SHAPE = tuple(int(value) for value in os.environ.get("RENTAL_VM_SNAPSHOT_SHAPE", "2,2,20").split(","))
+
+# Приостановка простаивающих аренд: через сколько секунд без нагрузки на CPU, трафика и SSH-сессий
+# аренда ставится на паузу (0 - выключено), пороги нагрузки и как часто проверять
+IDLE_AFTER = int(os.environ.get("RENTAL_IDLE_AFTER", "0"))
+IDLE_CPU_PERCENT = float(os.environ.get("RENTAL_IDLE_CPU_PERCENT", "2"))
+IDLE_NET_KBPS = float(os.environ.get("RENTAL_IDLE_NET_KBPS", "1"))
+IDLE_CHECK_INTERVAL = int(os.environ.get("RENTAL_IDLE_CHECK_INTERVAL", "30"))
+# Как часто проверять, не пришло ли SSH-подключение к приостановленной аренде (секунды)
+IDLE_WAKE_INTERVAL = float(os.environ.get("RENTAL_IDLE_WAKE_INTERVAL", "0.5"))
+# Что делать с простаивающей ВМ: "suspend" (остановить vCPU), "balloon" (забрать память) или "both"
+IDLE_VM_ACTION = os.environ.get("RENTAL_IDLE_VM_ACTION", "both")
+# До какой доли памяти сжимать простаивающую ВМ и нижняя граница (МБ)
+IDLE_BALLOON_FRACTION = float(os.environ.get("RENTAL_IDLE_BALLOON_FRACTION", "0.25"))
+IDLE_BALLOON_MIN_MB = int(os.environ.get("RENTAL_IDLE_BALLOON_MIN_MB", "512"))
+# Какую долю ресурсов простаивающих аренд планировщик может отдать новым арендам
+IDLE_RECLAIM = float(os.environ.get("RENTAL_IDLE_RECLAIM", "0.5"))
+
+# HTTP JSON API для автоматизации: адрес, порт (0 - не открывать), токены доступа через запятую
+# и наибольший размер страницы списка
+API_HOST = os.environ.get("RENTAL_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("RENTAL_API_PORT", "0"))
+API_TOKENS = [token for token in os.environ.get("RENTAL_API_TOKENS", "").split(",") if token]
+API_PAGE_LIMIT = int(os.environ.get("RENTAL_API_PAGE_LIMIT", "100"))
+
+# Устройства хоста для лимитов ввода-вывода контейнеров через запятую, например "/dev/sda,/dev/nvme0n1".
+# Пусто - определяются по каталогам Docker на локальном хосте (на удалённых хостах лимиты не ставятся).
+CONTAINER_IO_DEVICES = [device for device in os.environ.get("RENTAL_CONTAINER_IO_DEVICES", "").split(",") if device]
+# Наибольший размер tmpfs контейнера (ГБ): он занимает оперативную память хоста
+CONTAINER_TMPFS_MAX_GB = int(os.environ.get("RENTAL_CONTAINER_TMPFS_MAX_GB", "16"))
+
+# Сборка брошенных артефактов аренд: как часто проверять (секунды, по умолчанию 0 - выключено, например 3600),
+# сколько секунд артефакт без аренды должен пролежать до удаления, размер пачки удалений и пауза между пачками.
+# Сборщик удаляет файлы, поэтому включается только явно.
+RECONCILE_INTERVAL = int(os.environ.get("RENTAL_RECONCILE_INTERVAL", "0"))
+RECONCILE_GRACE = int(os.environ.get("RENTAL_RECONCILE_GRACE", "3600"))
+RECONCILE_BATCH = int(os.environ.get("RENTAL_RECONCILE_BATCH", "20"))
+RECONCILE_BATCH_PAUSE = float(os.environ.get("RENTAL_RECONCILE_BATCH_PAUSE", "1"))
+# Сколько места могут занимать скачанные golden images (ГБ); неиспользуемые удаляются от самых старых
+GOLDEN_DISK_BUDGET = float(os.environ.get("RENTAL_GOLDEN_DISK_BUDGET_GB", "50")) * 1024 ** 3
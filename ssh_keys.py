@@ -0,0 +1,124 @@
+import io
+import os
+import queue
+import sys
+import tarfile
+import threading
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+import settings
+
+# Имена файлов ключа по типу, как у ssh-keygen
+KEY_FILE_NAMES = {
+    "ed25519": "id_ed25519",
+    "rsa": "id_rsa",
+}
+
+
+# Генерация пары ключей в процессе, без запуска ssh-keygen.
+# Возвращает (приватный ключ в формате OpenSSH, публичный ключ одной строкой).
+def generate_keypair(key_type="ed25519", bits=4096, comment="rental"):
+    if key_type == "ed25519":
+        key = ed25519.Ed25519PrivateKey.generate()
+    elif key_type == "rsa":
+        key = rsa.generate_private_key(public_exponent=65537, key_size=bits)
+    else:
+        raise ValueError(f"Неподдерживаемый тип ключа: {key_type}")
+    private = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.OpenSSH,
+        serialization.NoEncryption(),
+    )
+    public = key.public_key().public_bytes(
+        serialization.Encoding.OpenSSH,
+        serialization.PublicFormat.OpenSSH,
+    ).decode()
+    return private, f"{public} {comment}"
+
+
+# Записываем ключ с правами 0700 на каталог и 0600 на приватный ключ
+def write_keypair(directory, private, public, key_type="ed25519"):
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    os.chmod(directory, 0o700)
+    private_key_path = os.path.join(directory, KEY_FILE_NAMES[key_type])
+    fd = os.open(private_key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(private)
+    os.chmod(private_key_path, 0o600)
+    with open(f"{private_key_path}.pub", "w") as f:
+        f.write(public + "\n")
+    os.chmod(f"{private_key_path}.pub", 0o644)
+    return private_key_path
+
+
+# Небольшой пул готовых ключей, который пополняется в фоне,
+# чтобы создание аренды не ждало генерации
+class KeyPool:
+    def __init__(self, key_type=None, size=None):
+        self.key_type = key_type or settings.SSH_KEY_TYPE
+        self._ready = queue.Queue(maxsize=size or settings.SSH_KEY_POOL_SIZE)
+        self._wakeup = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        threading.Thread(target=self._run, name=f"ssh-keys-{self.key_type}", daemon=True).start()
+
+    def _run(self):
+        while True:
+            while not self._ready.full():
+                try:
+                    self._ready.put_nowait(generate_keypair(self.key_type))
+                except queue.Full:
+                    break
+                except Exception as e:
+                    print(f"Не удалось сгенерировать ключ: {e}", file=sys.stderr)
+                    time.sleep(5)
+            self._wakeup.wait()
+            self._wakeup.clear()
+
+    def take(self):
+        try:
+            pair = self._ready.get_nowait()
+            self.hits += 1
+        except queue.Empty:
+            pair = generate_keypair(self.key_type)
+            self.misses += 1
+        self._wakeup.set()
+        return pair
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key_type=None):
+    key_type = key_type or settings.SSH_KEY_TYPE
+    with _pools_lock:
+        if key_type not in _pools:
+            _pools[key_type] = KeyPool(key_type)
+        return _pools[key_type]
+
+
+# Берём ключ из пула и сохраняем его в directory. Возвращает (путь к приватному ключу, публичный ключ).
+def provision(directory, key_type=None):
+    key_type = key_type or settings.SSH_KEY_TYPE
+    private, public = get_pool(key_type).take()
+    return write_keypair(directory, private, public, key_type), public
+
+
+# Кладём публичный ключ в /root/.ssh/authorized_keys контейнера (работает и до запуска)
+def inject_into_container(client, container_name, public_key):
+    data = (public_key + "\n").encode()
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        ssh_dir = tarfile.TarInfo(".ssh")
+        ssh_dir.type = tarfile.DIRTYPE
+        ssh_dir.mode = 0o700
+        tar.addfile(ssh_dir)
+        authorized_keys = tarfile.TarInfo(".ssh/authorized_keys")
+        authorized_keys.mode = 0o600
+        authorized_keys.size = len(data)
+        tar.addfile(authorized_keys, io.BytesIO(data))
+    client.api.put_archive(container_name, "/root", buffer.getvalue())
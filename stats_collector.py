@@ -0,0 +1,212 @@
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import settings
+
+# Показатели, которые собираются для каждой нагрузки
+FIELDS = ("cpu", "mem", "net_rx", "net_tx", "blk_read", "blk_write")
+
+
+# Кольцевой буфер фиксированного размера на array('d'): 8 байт на точку, без объектов Python
+class Ring:
+    __slots__ = ("values", "index", "count")
+
+    def __init__(self, size):
+        self.values = array("d", bytes(8 * size))
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+
+    def last(self):
+        return self.values[self.index - 1] if self.count else None
+
+    def tolist(self):
+        if self.count < len(self.values):
+            return self.values[:self.count].tolist()
+        return self.values[self.index:].tolist() + self.values[:self.index].tolist()
+
+
+class _Series:
+    __slots__ = ("rings", "counters", "seen_at")
+
+    def __init__(self, size):
+        self.rings = {field: Ring(size) for field in FIELDS}
+        self.counters = None  # накопительные счётчики прошлого замера для расчёта скоростей
+        self.seen_at = 0.0
+
+
+def _rate(current, previous, seconds):
+    if previous is None or seconds <= 0 or current < previous:
+        return 0.0
+    return (current - previous) / seconds
+
+
+# Один фоновый сборщик на процесс: раз в интервал снимает CPU, память, сеть и диск
+# всех контейнеров и ВМ и складывает их в кольцевые буферы.
+# Страницы читают только буферы и не обращаются к Docker и libvirt при перерисовке.
+class StatsCollector:
+    def __init__(self, interval=None, history=None):
+        self.interval = interval or settings.STATS_INTERVAL
+        self.history = history or settings.STATS_HISTORY
+        self._series = {}  # (вид, имя) -> _Series
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=settings.STATS_WORKERS, thread_name_prefix="stats")
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="stats-collector", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            self.collect()
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def collect(self):
+        import scheduler
+
+        for host in scheduler.get_scheduler().hosts.values():
+            for kind, sample in (("vm", self._sample_domains), ("container", self._sample_containers)):
+                if not host.supports(kind):
+                    continue
+                try:
+                    with metrics.span("stats.collect", kind=kind, host=host.name):
+                        sample(host)
+                except Exception as e:
+                    print(f"Не удалось собрать статистику {kind} на хосте {host.name}: {e}", file=sys.stderr)
+        self._forget()
+
+    # Замер нагрузки: время, накопительные счётчики CPU (нс), сети и диска (байты) и текущая память.
+    # Скорости считаются по разнице с прошлым замером, CPU - в процентах одного ядра.
+    def _store(self, kind, name, now, cpu_ns, mem_bytes, rx, tx, read, write):
+        with self._lock:
+            series = self._series.get((kind, name))
+            if series is None:
+                series = self._series[(kind, name)] = _Series(self.history)
+            previous = series.counters
+            series.counters = (now, cpu_ns, rx, tx, read, write)
+            series.seen_at = now
+            if previous is None:
+                return  # для скоростей нужен второй замер
+            seconds = now - previous[0]
+            rings = series.rings
+            rings["cpu"].append(_rate(cpu_ns, previous[1], seconds) / 1e9 * 100)
+            rings["mem"].append(mem_bytes / 1024 ** 2)
+            rings["net_rx"].append(_rate(rx, previous[2], seconds) / 1024)
+            rings["net_tx"].append(_rate(tx, previous[3], seconds) / 1024)
+            rings["blk_read"].append(_rate(read, previous[4], seconds) / 1024)
+            rings["blk_write"].append(_rate(write, previous[5], seconds) / 1024)
+
+    # Все домены хоста одним вызовом getAllDomainStats
+    def _sample_domains(self, host):
+        import libvirt
+
+        import libvirt_pool
+
+        groups = (
+            libvirt.VIR_DOMAIN_STATS_CPU_TOTAL | libvirt.VIR_DOMAIN_STATS_BALLOON
+            | libvirt.VIR_DOMAIN_STATS_INTERFACE | libvirt.VIR_DOMAIN_STATS_BLOCK
+        )
+        records = libvirt_pool.call(
+            "getAllDomainStats",
+            lambda conn: [
+                (domain.name(), stats)
+                for domain, stats in conn.getAllDomainStats(groups, libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE)
+            ],
+            uri=host.libvirt_uri,
+        )
+        now = time.monotonic()
+        for name, stats in records:
+            def total(prefix, suffix):
+                count = stats.get(f"{prefix}.count", 0)
+                return sum(stats.get(f"{prefix}.{index}.{suffix}", 0) for index in range(count))
+
+            self._store(
+                "vm", name, now,
+                stats.get("cpu.time", 0),
+                stats.get("balloon.rss", stats.get("balloon.current", 0)) * 1024,
+                total("net", "rx.bytes"), total("net", "tx.bytes"),
+                total("block", "rd.bytes"), total("block", "wr.bytes"),
+            )
+
+    # Контейнеры: одноразовый снимок stats для каждого запущенного контейнера, запросы идут параллельно
+    def _sample_containers(self, host):
+        import inventory
+        import warm_pool
+
+        client = host.docker()
+        names = [
+            item["name"] for item in inventory.containers(client).list()
+            if item.get("status") == "running" and not item["name"].startswith(warm_pool.POOL_PREFIX)
+        ]
+
+        def _one(name):
+            try:
+                return name, client.api.stats(name, stream=False, one_shot=True)
+            except Exception as e:
+                print(f"Нет статистики контейнера '{name}': {e}", file=sys.stderr)
+                return name, None
+
+        now = time.monotonic()
+        for name, stats in self._executor.map(_one, names):
+            if not stats:
+                continue
+            memory = stats.get("memory_stats") or {}
+            cache = (memory.get("stats") or {}).get("inactive_file", (memory.get("stats") or {}).get("cache", 0))
+            networks = (stats.get("networks") or {}).values()
+            blkio = (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+            self._store(
+                "container", name, now,
+                (stats.get("cpu_stats") or {}).get("cpu_usage", {}).get("total_usage", 0),
+                max(0, memory.get("usage", 0) - cache),
+                sum(network.get("rx_bytes", 0) for network in networks),
+                sum(network.get("tx_bytes", 0) for network in networks),
+                sum(entry.get("value", 0) for entry in blkio if entry.get("op", "").lower() == "read"),
+                sum(entry.get("value", 0) for entry in blkio if entry.get("op", "").lower() == "write"),
+            )
+
+    # Нагрузки, которых давно нет в замерах (удалены или остановлены), выбрасываем
+    def _forget(self):
+        deadline = time.monotonic() - self.interval * 3
+        with self._lock:
+            for key in [key for key, series in self._series.items() if series.seen_at < deadline]:
+                del self._series[key]
+
+    # Последние значения и история каждой нагрузки вида kind
+    def snapshot(self, kind):
+        with self._lock:
+            rows = []
+            for (series_kind, name), series in sorted(self._series.items()):
+                if series_kind != kind:
+                    continue
+                row = {"name": name}
+                for field, ring in series.rings.items():
+                    row[field] = ring.last()
+                    row[f"{field}_history"] = ring.tolist()
+                rows.append(row)
+            return rows
+
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+# Общий для процесса экземпляр
+def get_collector():
+    global _collector
+    with _collector_lock:
+        if _collector is None:
+            _collector = StatsCollector()
+            _collector.start()
+        return _collector
@@ -0,0 +1,177 @@
+import os
+import shutil
+import sys
+import threading
+
+import docker
+
+import settings
+
+# Классы хранилища /data контейнера. Размер задаётся в ГБ; у каталога на хосте размера нет.
+STORAGE_TIERS = {
+    "bind": {
+        "title": "Каталог на хосте",
+        "description": "Каталог на диске хоста без ограничения размера, удаляется вместе с арендой.",
+        "price_per_gb": 0,
+        "sized": False,
+    },
+    "volume": {
+        "title": "Том с квотой",
+        "description": "Именованный том Docker с квотой проекта XFS: запись сверх размера получает ENOSPC.",
+        "price_per_gb": 10,
+        "sized": True,
+    },
+    "tmpfs": {
+        "title": "tmpfs в памяти",
+        "description": "Быстрый временный каталог в оперативной памяти, учитывается в лимите RAM и пропадает при остановке.",
+        "price_per_gb": 15,
+        "sized": True,
+    },
+}
+
+# Классы ввода-вывода: лимиты на чтение и запись (байт/с и операций/с) для устройства хоста.
+# У контейнеров - device read/write bps/iops в cgroup, у ВМ - <iotune> диска в libvirt.
+IO_CLASSES = {
+    "basic": {
+        "title": "Базовый",
+        "bytes_sec": 50 * 1024 ** 2,
+        "iops_sec": 500,
+        "price": 0,
+    },
+    "standard": {
+        "title": "Стандартный",
+        "bytes_sec": 200 * 1024 ** 2,
+        "iops_sec": 2000,
+        "price": 100,
+    },
+    "fast": {
+        "title": "Быстрый",
+        "bytes_sec": 500 * 1024 ** 2,
+        "iops_sec": 10000,
+        "price": 300,
+    },
+}
+DEFAULT_IO_CLASS = "standard"
+
+VOLUME_PREFIX = "rental_"
+
+
+def describe_io(io_class):
+    spec = IO_CLASSES[io_class]
+    return f"{spec['title']}: до {spec['bytes_sec'] // 1024 ** 2} МБ/с и {spec['iops_sec']} IOPS на чтение и на запись"
+
+
+def io_price(io_class):
+    return IO_CLASSES[io_class]["price"] if io_class else 0
+
+
+# Надбавка к цене аренды контейнера за хранилище и класс ввода-вывода
+def price(tier, storage, io_class):
+    cost = STORAGE_TIERS[tier]["price_per_gb"] * storage if STORAGE_TIERS[tier]["sized"] else 0
+    return cost + io_price(io_class)
+
+
+# Блочное устройство (целый диск, не раздел), на котором лежит path: /dev/sda для /dev/sda2
+def block_device(path):
+    try:
+        dev = os.stat(path).st_dev
+    except OSError:
+        return None
+    sys_path = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    if not os.path.exists(sys_path):
+        return None  # overlay, btrfs и другие ФС без своего блочного устройства
+    real = os.path.realpath(sys_path)
+    if os.path.exists(os.path.join(real, "partition")):
+        real = os.path.dirname(real)
+    return f"/dev/{os.path.basename(real)}"
+
+
+_devices = {}
+_devices_lock = threading.Lock()
+
+
+# Устройства, на которые пишут контейнеры хоста: корень Docker (слой контейнера и тома) и каталог /data.
+# На удалённых хостах пути не проверить, устройства берутся из RENTAL_CONTAINER_IO_DEVICES.
+def io_devices(client, local=True):
+    if settings.CONTAINER_IO_DEVICES or not local:
+        return list(settings.CONTAINER_IO_DEVICES)
+    key = client.api.base_url
+    with _devices_lock:
+        if key in _devices:
+            return _devices[key]
+    paths = [settings.DOCKER_DATA_DIR]
+    try:
+        paths.append(client.info().get("DockerRootDir") or "/var/lib/docker")
+    except docker.errors.DockerException:
+        paths.append("/var/lib/docker")
+    devices = sorted({device for device in map(block_device, paths) if device})
+    with _devices_lock:
+        _devices[key] = devices
+    return devices
+
+
+# Лимиты ввода-вывода для containers.create / containers.run
+def io_limits(io_class, devices):
+    if io_class is None or not devices:
+        return {}
+    spec = IO_CLASSES[io_class]
+    bps = [{"Path": device, "Rate": spec["bytes_sec"]} for device in devices]
+    iops = [{"Path": device, "Rate": spec["iops_sec"]} for device in devices]
+    return {"device_read_bps": bps, "device_write_bps": bps, "device_read_iops": iops, "device_write_iops": iops}
+
+
+# Лимиты диска ВМ для <iotune> в XML домена
+def iotune(io_class):
+    if io_class is None:
+        return None
+    spec = IO_CLASSES[io_class]
+    return {
+        "read_bytes_sec": spec["bytes_sec"], "write_bytes_sec": spec["bytes_sec"],
+        "read_iops_sec": spec["iops_sec"], "write_iops_sec": spec["iops_sec"],
+    }
+
+
+def volume_name(container_name):
+    return f"{VOLUME_PREFIX}{container_name}"
+
+
+# Параметры containers.create для /data выбранного класса. Том с квотой создаётся здесь же;
+# если файловая система томов не поддерживает квоты, Docker отказывает и исключение уходит вызывающему.
+def data_mount(client, tier, storage, container_name):
+    if tier == "tmpfs":
+        return {"tmpfs": {"/data": f"size={storage}g,mode=1777"}}
+    if tier == "volume":
+        volume = client.volumes.create(
+            name=volume_name(container_name), driver="local", driver_opts={"size": f"{storage}G"},
+            labels={"rental.container": container_name},
+        )
+        return {"volumes": {volume.name: {"bind": "/data", "mode": "rw"}}}
+    mount_path = os.path.join(settings.DOCKER_DATA_DIR, container_name)
+    os.makedirs(mount_path, exist_ok=True)
+    return {"volumes": {mount_path: {"bind": "/data", "mode": "rw"}}}
+
+
+# Хранилище аренды по описанию контейнера (inspect): каталоги в DOCKER_DATA_DIR и тома сервиса.
+# Берём из Mounts, а не из имени: у контейнера из пула каталог назван по имени в пуле.
+def rental_mounts(attrs):
+    paths, volumes = [], []
+    for mount in attrs.get("Mounts") or []:
+        if mount.get("Type") == "bind" and os.path.dirname(mount.get("Source", "")) == settings.DOCKER_DATA_DIR:
+            paths.append(mount["Source"])
+        elif mount.get("Type") == "volume" and (mount.get("Name") or "").startswith(VOLUME_PREFIX):
+            volumes.append(mount["Name"])
+    return paths, volumes
+
+
+# Удаляем хранилище уже удалённого контейнера. mounts - результат rental_mounts().
+def release(client, mounts):
+    paths, volumes = mounts
+    for volume in volumes:
+        try:
+            client.api.remove_volume(volume)
+        except docker.errors.NotFound:
+            pass
+        except docker.errors.DockerException as e:
+            print(f"Не удалось удалить том '{volume}': {e}", file=sys.stderr)
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
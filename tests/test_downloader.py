@@ -0,0 +1,141 @@
+import hashlib
+import http.server
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import downloader  # noqa: E402
+import settings  # noqa: E402
+
+# Проверка загрузчика против локального HTTP-сервера с поддержкой Range
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+DIGEST = hashlib.sha256(DATA).hexdigest()
+ETAG = '"golden-1"'
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        ranges = self.headers.get("Range")
+        with server.lock:
+            server.requests.append(ranges)
+        if ranges is None:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(DATA)))
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            self.wfile.write(DATA)
+            return
+        start, end = ranges[len("bytes="):].split("-")
+        start, end = int(start), min(int(end), len(DATA) - 1)
+        # Данные отдаём только после сигнала теста, проба "bytes=0-0" проходит сразу
+        if ranges != "bytes=0-0":
+            server.gate.wait(10)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(DATA[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = True
+    httpd.requests = []
+    httpd.lock = threading.Lock()
+    httpd.gate = threading.Event()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.gate.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DOWNLOAD_STORE_DIR", str(tmp_path / "store"))
+    return tmp_path / "store"
+
+
+def _url(server, name="image.img"):
+    return f"http://127.0.0.1:{server.server_address[1]}/{name}"
+
+
+def test_concurrent_downloads_share_one_flight(server):
+    url = _url(server)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(downloader.download(url, sha256=DIGEST, segments=2)))
+        for _ in range(4)
+    ]
+    threads[0].start()
+    # Первый вызов уже зарегистрировал загрузку и ждёт сервера, остальные должны к ней присоединиться
+    while not server.requests:
+        threading.Event().wait(0.01)
+    for thread in threads[1:]:
+        thread.start()
+    threading.Event().wait(0.2)
+    server.gate.set()
+    for thread in threads:
+        thread.join(30)
+
+    assert results == [downloader.store_path(DIGEST)] * 4
+    assert server.requests.count("bytes=0-0") == 1
+    assert len(server.requests) == 3  # проба и два сегмента
+    with open(results[0], "rb") as f:
+        assert f.read() == DATA
+
+
+def test_resume_fetches_only_missing_bytes(server):
+    url = _url(server)
+    server.gate.set()
+    # Состояние прерванной загрузки: первый сегмент скачан наполовину, второй не начат
+    tmp_dir = os.path.join(settings.DOWNLOAD_STORE_DIR, "tmp")
+    os.makedirs(tmp_dir)
+    base = os.path.join(tmp_dir, DIGEST)
+    half, done = len(DATA) // 2, 1024 * 1024
+    with open(f"{base}.part", "wb") as f:
+        f.write(DATA[:done])
+        f.truncate(len(DATA))
+    with open(f"{base}.state", "w") as f:
+        json.dump({"total": len(DATA), "etag": ETAG,
+                   "segments": [[0, half - 1, done], [half, len(DATA) - 1, 0]]}, f)
+
+    path = downloader.download(url, sha256=DIGEST)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert sorted(server.requests) == sorted(["bytes=0-0", f"bytes={done}-{half - 1}", f"bytes={half}-{len(DATA) - 1}"])
+    assert not os.path.exists(f"{base}.part") and not os.path.exists(f"{base}.state")
+
+
+def test_cached_path_after_download(server):
+    url = _url(server)
+    server.gate.set()
+    assert downloader.cached_path(url) is None
+    path = downloader.download(url, sha256=DIGEST)
+    assert downloader.cached_path(url) == path
+    # Повторная загрузка с известной суммой не обращается к серверу
+    requests_before = len(server.requests)
+    assert downloader.download(url, sha256=DIGEST) == path
+    assert len(server.requests) == requests_before
+
+
+def test_bad_checksum_raises(server):
+    url = _url(server)
+    server.gate.set()
+    with pytest.raises(downloader.ChecksumError):
+        downloader.download(url, sha256="0" * 64)
+    assert downloader.cached_path(url) is None
+    assert not os.path.exists(downloader.store_path(DIGEST))
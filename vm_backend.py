@@ -0,0 +1,452 @@
+import os
+import shutil
+import subprocess
+import time
+import uuid
+
+import libvirt
+import requests
+
+import bulk
+import cpu_alloc
+import domain_inventory
+import domain_xml
+import downloader
+import golden_images
+import idle
+import inventory
+import jobs
+import lease_reaper
+import libvirt_pool
+import metrics
+import net_alloc
+import readiness
+import scheduler
+import settings
+import ssh_keys
+import storage_tiers
+import vm_snapshots
+
+# Логика аренды виртуальных машин без Streamlit: её вызывают и страница, и HTTP API.
+# Сообщения пишутся в out (или job) - это st на странице или jobs.Job в фоне и в API.
+
+#Генерация ssh ключа
+def generate_ssh_keys(vm_name):
+    ssh_dir = os.path.join(settings.LIBVIRT_IMAGES_DIR, f"{vm_name}_ssh")
+    # Ключ берётся из пула готовых ключей, генерация идёт в фоне
+    return ssh_keys.provision(ssh_dir)
+
+# Функция для скачивания образа с проверкой SHA256
+def download_iso(os_name, job):
+    image_url = golden_images.GOLDEN_IMAGES[os_name]["url"]
+    job.info(f"Начинается загрузка образа по ссылке: {image_url}...")
+    progress_bar = job.progress(0)
+
+    def _progress(done, total):
+        if total > 0:
+            progress_bar.progress(min(1.0, done / total))
+
+    try:
+        with metrics.span("image.download", job):
+            file_path = golden_images.fetch_golden_image(os_name, progress=_progress)
+        job.success(f"Образ успешно загружен и проверен: {file_path}")
+        print(f"Образ скачен в {file_path}")
+        return file_path
+    except downloader.ChecksumError as e:
+        job.error(f"Контрольная сумма образа не совпала: {e}")
+        raise
+    except (requests.exceptions.RequestException, downloader.DownloadError) as e:
+        job.error(f"Ошибка при загрузке {image_url}: {e}")
+        raise
+    except IOError as e:
+        job.error(f"Ошибка ввода/вывода при сохранении образа: {e}")
+        raise
+    finally:
+        progress_bar.empty()
+
+# Функция для получения golden image выбранной ОС, при необходимости скачивает его
+def get_os_image(os_name, job):
+    if os_name not in golden_images.GOLDEN_IMAGES:
+        raise ValueError(f"Образ для {os_name} не подходит.")
+    if golden_images.is_cached(os_name):
+        job.info(f"Образ для {os_name} уже загружен, проверяем актуальность...")
+    else:
+        job.success(f"Загрузка образа для {os_name}...")
+    return download_iso(os_name, job)
+
+def create_disk(disk_path, size, backing_path, job):
+    try:
+        with metrics.span("qemu-img", job):
+            golden_images.create_overlay(disk_path, backing_path, size)
+        job.success(f"Создан диск по {disk_path} размера {size}GB на основе {backing_path}.")
+        return True
+    except subprocess.CalledProcessError as e:
+        job.error(f"Не получилось создать образ диска: {e}")
+        return False
+
+def create_seed(seed_path, vm_name, public_key, job):
+    try:
+        with metrics.span("cloud-init.seed", job):
+            golden_images.create_seed_iso(
+                seed_path,
+                golden_images.cloud_init_user_data(public_key),
+                golden_images.cloud_init_meta_data(vm_name),
+            )
+        return True
+    except (subprocess.CalledProcessError, RuntimeError) as e:
+        job.error(f"Не получилось создать cloud-init seed: {e}")
+        return False
+
+# Хост, на котором размещена ВМ, и адрес его libvirt
+def host_for(vm_name):
+    return scheduler.get_scheduler().host_of(vm_name) or scheduler.get_scheduler().default_host("vm")
+
+def uri_for(vm_name):
+    return host_for(vm_name).libvirt_uri
+
+UNDEFINE_FLAGS = libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE | libvirt.VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA
+
+# Файлы аренды на хосте: диск, seed cloud-init и каталог ключей
+def artifact_paths(vm_name):
+    return [
+        os.path.join(settings.LIBVIRT_IMAGES_DIR, f"{vm_name}.qcow2"),
+        os.path.join(settings.LIBVIRT_IMAGES_DIR, f"{vm_name}-seed.iso"),
+        os.path.join(settings.LIBVIRT_IMAGES_DIR, f"{vm_name}_ssh"),
+    ]
+
+def remove_artifacts(vm_name):
+    for path in artifact_paths(vm_name):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+# Работающий (или приостановленный) домен сначала останавливаем: после undefine работающей машины
+# она остаётся временным доменом и продолжает занимать память хоста.
+# Временный домен пропадает сам после destroy.
+def delete_domain(dom):
+    persistent = dom.isPersistent()
+    if dom.isActive():
+        dom.destroy()
+    if persistent:
+        # Вместе с доменом удаляется и сохранённая память приостановленной ВМ
+        dom.undefineFlags(UNDEFINE_FLAGS)
+
+# Функция удаления ВМ, которую вызывает общий сборщик аренд
+def _expire_vm(vm_name):
+    idle.get_detector().wake("vm", vm_name, reason="expire")
+    def _delete(conn):
+        try:
+            dom = conn.lookupByName(vm_name)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                return
+            raise
+        delete_domain(dom)
+    libvirt_pool.call("expire", _delete, uri=uri_for(vm_name))
+    remove_artifacts(vm_name)
+    net_alloc.get_allocator().release(vm_name)
+    cpu_alloc.get_allocator().release(vm_name)
+    scheduler.get_scheduler().release(vm_name)
+
+lease_reaper.get_reaper().register("vm", _expire_vm)
+
+# Функция удаления ВМ после заданного времени
+def delete_vm_after_timeout(vm_name, duration):
+    lease_reaper.get_reaper().add("vm", vm_name, duration)
+
+# io_class - класс ввода-вывода диска из storage_tiers.IO_CLASSES (None - без лимитов)
+def create_vm(cpu, ram, storage, os_name, location, duration, profile, io_class, job, os_image=None):
+    vm_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:4]}"
+    disk_path, seed_path, _ = artifact_paths(vm_name)
+    if io_class is not None and io_class not in storage_tiers.IO_CLASSES:
+        raise ValueError(f"Неизвестный класс ввода-вывода: {io_class}")
+    # Выбираем хост в нужной локации, на котором хватает CPU и RAM
+    job.stage("размещение")
+    try:
+        host = scheduler.get_scheduler().reserve("vm", vm_name, cpu, ram, location)
+    except scheduler.NoCapacity as e:
+        job.error(str(e))
+        return None
+    job.info(f"Виртуальная машина будет размещена на хосте {host.name}.")
+    # Аренды ещё нет, поэтому при любой ошибке (загрузка образа, нехватка портов, сбой соединения)
+    # резерв планировщика, порт и ядра освобождаем здесь, иначе они останутся занятыми навсегда
+    try:
+        result = None
+        if host.local and profile == "standard" and snapshot_pool().matches(cpu, ram, storage):
+            result = _claim_snapshot(os_name, duration, io_class, vm_name, disk_path, seed_path, job)
+        if result is None:
+            result = _create_on_host(
+                cpu, ram, storage, os_name, location, duration, profile, io_class, vm_name, disk_path, seed_path,
+                host, job, os_image,
+            )
+    except BaseException:
+        _release_failed(vm_name)
+        raise
+    if result is None:
+        _release_failed(vm_name)
+    return result
+
+def _release_failed(vm_name):
+    remove_artifacts(vm_name)
+    net_alloc.get_allocator().release(vm_name)
+    cpu_alloc.get_allocator().release(vm_name)
+    scheduler.get_scheduler().release(vm_name)
+
+# Пул заранее загруженных ВМ запускается один раз на процесс при первом обращении
+def snapshot_pool():
+    pool = vm_snapshots.get_pool()
+    pool.start()
+    return pool
+
+# Аренда из пула: восстановление уже загруженной ВМ вместо загрузки с нуля
+def _claim_snapshot(os_name, duration, io_class, vm_name, disk_path, seed_path, job):
+    if not snapshot_pool().available(os_name):
+        return None
+    job.stage("восстановление")
+    private_key_path, public_key = generate_ssh_keys(vm_name)
+    started = time.monotonic()
+    with metrics.span("vm.claim", job):
+        claimed = snapshot_pool().claim(
+            os_name, vm_name, disk_path, seed_path, public_key, iotune=storage_tiers.iotune(io_class)
+        )
+    if claimed is None:
+        job.info("Готовых машин в пуле нет, машина будет загружена с нуля.")
+        return None
+    ssh_port, address = claimed
+    job.success(f"Виртуальная машина '{vm_name}' восстановлена из загруженного снимка за {time.monotonic() - started:.1f} с и уже работает.")
+    job.code(f"ssh cloud-user@{net_alloc.public_address()} -p {ssh_port}")
+    job.info(f"Виртуальная машина будет удалена через {duration} минут.")
+    delete_vm_after_timeout(vm_name, duration)
+    return {"name": vm_name, "private_key_path": private_key_path, "ssh_port": ssh_port, "running": True}
+
+def _create_on_host(cpu, ram, storage, os_name, location, duration, profile, io_class, vm_name, disk_path, seed_path, host, job, os_image):
+    if os_image is None:
+        job.stage("образ")
+        os_image = get_os_image(os_name, job)
+    job.stage("диск")
+    if not create_disk(disk_path, storage, os_image, job):
+        return None
+    job.stage("ключи")
+    with metrics.span("ssh.key", job):
+        private_key_path, public_key = generate_ssh_keys(vm_name)
+    job.stage("cloud-init")
+    if not create_seed(seed_path, vm_name, public_key, job):
+        return None
+    job.stage("сеть")
+    with metrics.span("net.allocate", job):
+        mac, ssh_port = net_alloc.get_allocator().allocate(vm_name)
+
+    # Закрепление ядер и huge pages для профилей, которым они нужны
+    spec = domain_xml.PROFILES[profile]
+    cpus = node = None
+    if spec["pinning"]:
+        job.stage("профиль")
+        with metrics.span("cpu.pin", job):
+            cpus, node = cpu_alloc.get_allocator().allocate(vm_name, host, cpu)
+        if cpus is None:
+            job.warning(f"На хосте {host.name} нет {cpu} свободных ядер в одном узле NUMA, vCPU не будут закреплены.")
+    hugepages = spec["hugepages"] and cpu_alloc.get_allocator().hugepages_available(host, ram, node)
+    if spec["hugepages"] and not hugepages:
+        job.warning("Свободных huge pages на хосте не хватает, память будет выделена обычными страницами.")
+
+    job.markdown(f"### Создание машины со следующими параметрами:")
+    job.markdown(f"**CPU:** {cpu}  \n**RAM:** {ram}GB  \n**Storage:** {storage}GB  \n**Дистрибутив Linux:** {os_name}  \n**Локация:** {location}  \n**Профиль:** {spec['title']}  \n**Ввод-вывод:** {storage_tiers.IO_CLASSES[io_class]['title'] if io_class else 'без ограничений'}  \n**Длительность аренды в минутах:** {duration}")
+    if cpus:
+        job.write(f"vCPU закреплены за ядрами {cpu_alloc.format_cpuset(cpus)} узла NUMA {node}.")
+
+    job.write(f"Путь образа диска: {disk_path}")
+
+    vm_xml = domain_xml.build(
+        vm_name, cpu, ram, disk_path, seed_path, mac, profile, cpus=cpus, node=node, hugepages=hugepages,
+        iotune=storage_tiers.iotune(io_class),
+    )
+
+    job.stage("определение")
+    try:
+        job.warning("Попытка определить виртуальную машину в libvirt...")
+        with metrics.span("vm.define", job):
+            domain = libvirt_pool.call("defineXML", lambda conn: conn.defineXML(vm_xml), uri=host.libvirt_uri)
+        job.success(f"Виртуальная машина '{vm_name}' успешно создана") # Определяем виртуальную машину
+        if domain is None:
+            job.error("Не получилось создать виртуальную машину: ")
+        else:
+            job.success("Виртуальная машина успешно определена")
+            # Вызов функции для удаления ВМ после истечения времени аренды
+            job.info(f"Виртуальная машина будет удалена через {duration} минут.")
+            delete_vm_after_timeout(vm_name, duration)
+            return {"name": vm_name, "private_key_path": private_key_path, "ssh_port": ssh_port}
+    except libvirt.libvirtError as e:
+        job.error(f"Ошибка в создании виртуальной машины: {e}")
+    return None
+
+# Фоновое ожидание готовности ВМ после запуска
+def wait_vm_ready(vm_name, job):
+    job.stage("ожидание SSH")
+    host = host_for(vm_name)
+    dom = libvirt_pool.call("lookupByName", lambda conn: conn.lookupByName(vm_name), uri=host.libvirt_uri)
+    allocator = net_alloc.get_allocator()
+    # Аренды DHCP и правила nftables доступны только на локальном хосте. Адрес гостя в сети libvirt
+    # удалённого хоста отсюда недоступен, поэтому там SSH не проверяем: готовность - адрес из аренды или агента.
+    if host.local:
+        resolve = lambda: allocator.resolve_ip(vm_name) or readiness.guest_address(dom)
+    else:
+        resolve = lambda: readiness.guest_address(dom)
+    address, ready_seconds = readiness.wait_vm_ready(dom, resolve=resolve, probe_ssh=host.local)
+    if address is not None and host.local:
+        job.stage("проброс порта")
+        with metrics.span("net.forward", job):
+            ssh_port = allocator.forward(vm_name, address)
+        if ssh_port:
+            job.code(f"ssh cloud-user@{net_alloc.public_address()} -p {ssh_port}")
+    if ready_seconds is None:
+        job.warning(f"Виртуальная машина '{vm_name}' запущена, но SSH пока не отвечает (адрес: {address or 'не получен'}).")
+        return None
+    if host.local:
+        job.success(f"Виртуальная машина '{vm_name}' готова за {ready_seconds:.1f} с, адрес в сети libvirt: {address}.")
+    else:
+        job.success(f"Виртуальная машина '{vm_name}' получила адрес {address} на хосте {host.name} за {ready_seconds:.1f} с.")
+    return {"name": vm_name, "address": address, "ready_seconds": ready_seconds}
+
+# Массовая аренда: создание и запуск одной ВМ пачки
+def create_and_start_vm(cpu, ram, storage, os_name, location, duration, profile, io_class, job, os_image=None):
+    result = create_vm(cpu, ram, storage, os_name, location, duration, profile, io_class, job, os_image=os_image)
+    if result is None:
+        return None
+    host = host_for(result["name"])
+    # Созданная ВМ ещё не попала в пачку, и откат о ней не знает: при ошибке запуска удаляем её здесь
+    try:
+        if not result.get("running"):
+            job.stage("запуск")
+            libvirt_pool.call("create", lambda conn: conn.lookupByName(result["name"]).create(), uri=host.libvirt_uri)
+        ready = wait_vm_ready(result["name"], job)
+    except BaseException:
+        remove_vm(result["name"])
+        raise
+    result.update(
+        host=host.name,
+        address=net_alloc.public_address() if host.local else (ready or {}).get("address"),
+        ready=ready is not None,
+    )
+    return result
+
+# Удаление ВМ при откате массовой аренды
+def remove_vm(vm_name):
+    lease_reaper.get_reaper().cancel("vm", vm_name)
+    _expire_vm(vm_name)
+
+# Golden image скачивается один раз на всю пачку, остальные шаги идут параллельно
+def create_bulk(count, rollback, cpu, ram, storage, os_name, location, duration, profile, io_class, job):
+    job.stage("образ")
+    os_image = get_os_image(os_name, job)
+    return bulk.run_bulk(
+        "vm", count,
+        lambda *args, job: create_and_start_vm(*args, job=job, os_image=os_image),
+        remove_vm,
+        (cpu, ram, storage, os_name, location, duration, profile, io_class), rollback=rollback, job=job,
+    )
+
+
+# Управление ВМ по имени. Возвращает описание результата или None, если действие не выполнено.
+# Готовность после запуска проверяется в фоновом задании, его id возвращается в "ready_job".
+def manage_vm(action, vm_name, out):
+    if action not in ("start", "suspend", "shutdown", "delete"):
+        raise ValueError(f"Неизвестное действие: {action}")
+    try:
+        host = host_for(vm_name)
+        if domain_inventory.domains(host.libvirt_uri).lookup(vm_name) is None:
+            raise inventory.NotFound(f"Виртуальная машина '{vm_name}' не найдена.")
+        dom = libvirt_pool.call("lookupByName", lambda conn: conn.lookupByName(vm_name), uri=host.libvirt_uri)
+        # Любое действие с арендой, приостановленной из-за простоя, сначала возобновляет её
+        if idle.get_detector().wake("vm", vm_name):
+            out.info(f"Виртуальная машина '{vm_name}' возобновлена после простоя.")
+            if action == "start":
+                return {"name": vm_name, "status": "running"}
+        if action == "start":
+            # Если память машины сохранена на диск, libvirt восстанавливает её вместо загрузки
+            saved = dom.hasManagedSaveImage(0)
+            started = time.monotonic()
+            libvirt_pool.call(
+                "create", lambda conn: dom.createWithFlags(libvirt.VIR_DOMAIN_START_BYPASS_CACHE), uri=host.libvirt_uri
+            )
+            if saved:
+                out.success(f"Виртуальная машина '{vm_name}' возобновлена из сохранённого состояния за {time.monotonic() - started:.1f} с.")
+            else:
+                out.success(f"Виртуальная машина '{vm_name}'запущена.")
+            # Готовность (IP гостя и ответ sshd) проверяется в фоне
+            ready_job = jobs.get_engine().submit("vm_ready", f"vm_ready:{vm_name}:{uuid.uuid4().hex}", wait_vm_ready, vm_name)
+            endpoint = net_alloc.get_allocator().get(vm_name)
+            result = {"name": vm_name, "status": "running", "host": host.name, "ready_job": ready_job.id, "ssh_port": None}
+            if not host.local:
+                out.info(f"Машина размещена на хосте {host.name}, адрес для SSH появится после загрузки.")
+            elif endpoint is None:
+                out.warning("Для этой виртуальной машины не выделен порт SSH.")
+            else:
+                result.update(address=net_alloc.public_address(), ssh_port=endpoint["host_port"])
+            return result
+        elif action == "suspend":
+            # Память гостя сохраняется на диск, процесс QEMU завершается, ресурсы хоста освобождаются
+            started = time.monotonic()
+            with metrics.span("vm.managed_save"):
+                libvirt_pool.call(
+                    "managedSave", lambda conn: dom.managedSave(libvirt.VIR_DOMAIN_SAVE_BYPASS_CACHE), uri=host.libvirt_uri
+                )
+            out.success(f"Состояние виртуальной машины '{vm_name}' сохранено на диск за {time.monotonic() - started:.1f} с. Запуск продолжит работу с того же места.")
+            return {"name": vm_name, "status": "saved"}
+        elif action == "shutdown":
+            libvirt_pool.call("destroy", lambda conn: dom.destroy(), uri=host.libvirt_uri)
+            out.success(f"Виртуальная машина '{vm_name}' остановлена.")
+            return {"name": vm_name, "status": "shutoff"}
+        else:
+            libvirt_pool.call("undefine", lambda conn: delete_domain(dom), uri=host.libvirt_uri)
+            remove_artifacts(vm_name)
+            lease_reaper.get_reaper().cancel("vm", vm_name)
+            net_alloc.get_allocator().release(vm_name)
+            cpu_alloc.get_allocator().release(vm_name)
+            scheduler.get_scheduler().release(vm_name)
+            out.success(f"Виртуальная машина '{vm_name}' удалена.")
+            return {"name": vm_name, "status": "deleted"}
+    except libvirt.libvirtError as e:
+        if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+            raise inventory.NotFound(f"Виртуальная машина '{vm_name}' не найдена.")
+        out.error(f"Ошибка в {action} виртуальной машины: {e}")
+    return None
+
+def calculate_price(cpu, ram, storage, duration, profile="standard", io_class=storage_tiers.DEFAULT_IO_CLASS):
+    base_price = 1000
+    cpu_cost = cpu * 20
+    ram_cost = ram * 15
+    storage_cost = storage * 10
+    duration_cost = duration * 50
+    io_cost = storage_tiers.io_price(io_class)
+    # Закреплённые ядра и huge pages нельзя отдать другим арендаторам, поэтому профили дороже
+    return (base_price + cpu_cost + ram_cost + storage_cost + duration_cost) * domain_xml.PROFILES[profile]["price_factor"] + io_cost
+
+STATE_NAMES = {
+    0: "Неизвестно состояние",
+    1: "Запущена",
+    2: "Заблокирована",
+    3: "Приостановлена",
+    4: "Выключена",
+    5: "Остановлена",
+    6: "Приостановлена в режиме сна"
+}
+
+# Виртуальные машины со всех хостов с libvirt (из списков в памяти, обновляемых по событиям)
+def list_vms():
+    hosts = [host for host in scheduler.get_scheduler().hosts.values() if host.supports("vm")]
+    vms = []
+    for host in hosts:
+        with metrics.span("show_all", kind="vm", host=host.name):
+            for domain in domain_inventory.domains(host.libvirt_uri).list():
+                if domain.get("saved") and domain["state"] == libvirt.VIR_DOMAIN_SHUTOFF:
+                    state_text = "Приостановлена, память сохранена на диск"
+                elif idle.get_detector().is_idle("vm", domain["name"]):
+                    state_text = idle.IDLE_STATUS
+                else:
+                    state_text = STATE_NAMES.get(domain["state"], "Неизвестное состояние")
+                vms.append({
+                    "name": domain["name"], "host": host.name, "state": domain["state"],
+                    "saved": bool(domain.get("saved")), "status_text": state_text,
+                })
+    return vms
@@ -0,0 +1,268 @@
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import libvirt
+
+import domain_xml
+import golden_images
+import libvirt_pool
+import metrics
+import net_alloc
+import readiness
+import settings
+import ssh_keys
+
+# Формат файлов сохранения памяти задаётся на хосте в /etc/libvirt/qemu.conf (save_image_format)
+QEMU_CONF = "/etc/libvirt/qemu.conf"
+
+
+# Чем libvirt сжимает файлы managed save и снимков на этом хосте ("raw" - без сжатия)
+def save_image_format(path=QEMU_CONF):
+    try:
+        with open(path) as f:
+            text = f.read()
+    except OSError:
+        return None
+    match = re.search(r'^\s*save_image_format\s*=\s*"([^"]+)"', text, re.MULTILINE)
+    return match.group(1) if match else "raw"
+
+
+def snapshot_dir():
+    return os.path.join(settings.LIBVIRT_IMAGES_DIR, "snapshots")
+
+
+# Пул заранее загруженных ВМ для каждого golden image, только на локальном хосте.
+# ВМ пула один раз загружается (cloud-init, sshd), её память сохраняется в файл, а домен пропадает из libvirt.
+# Аренда восстанавливает сохранённую ВМ через restoreFlags с XML, в котором имя, диск и seed уже от аренды,
+# поэтому гость работает через секунды, без загрузки ОС. У каждой ВМ пула свои UUID и MAC:
+# один файл нельзя восстановить в несколько доменов, libvirt требует совпадения UUID с сохранённым.
+class SnapshotPool:
+    def __init__(self, os_names=None, size=None, shape=None, db_path=settings.STATE_DB):
+        self.os_names = list(os_names or golden_images.GOLDEN_IMAGES)
+        self.size = settings.VM_SNAPSHOT_POOL if size is None else size
+        self.shape = tuple(shape or settings.VM_SNAPSHOT_SHAPE)  # (CPU, RAM ГБ, диск ГБ)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS vm_snapshots ("
+            "name TEXT PRIMARY KEY, os_name TEXT NOT NULL, uuid TEXT NOT NULL, mac TEXT NOT NULL, "
+            "address TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None or not self.size:
+            return
+        os.makedirs(snapshot_dir(), exist_ok=True)
+        self._adopt()
+        metrics.gauge("rental_vm_snapshot_pool_depth", "Сохранённые загруженные ВМ в пуле.", self.depth)
+        self._thread = threading.Thread(target=self._run, name="vm-snapshot-pool", daemon=True)
+        self._thread.start()
+
+    def _paths(self, name):
+        base = os.path.join(snapshot_dir(), name)
+        return {"disk": f"{base}.qcow2", "seed": f"{base}-seed.iso", "state": f"{base}.save", "keys": f"{base}_ssh"}
+
+    # Записи, у которых после прошлого запуска не осталось файлов, выбрасываем
+    def _adopt(self):
+        with self._lock:
+            names = [name for (name,) in self._db.execute("SELECT name FROM vm_snapshots")]
+        for name in names:
+            paths = self._paths(name)
+            if not (os.path.exists(paths["state"]) and os.path.exists(paths["disk"])):
+                self._discard(name)
+
+    def _remove_files(self, name):
+        for path in self._paths(name).values():
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isfile(path):
+                os.remove(path)
+
+    def _discard(self, name):
+        with self._lock:
+            self._db.execute("DELETE FROM vm_snapshots WHERE name = ?", (name,))
+            self._db.commit()
+        self._remove_files(name)
+        net_alloc.get_allocator().release(name)
+
+    # Загружаем одну ВМ пула, ждём SSH и сохраняем её память на диск
+    def _create(self, os_name):
+        cpu, ram, storage = self.shape
+        slug = os_name.lower().replace(" ", "-").replace(".", "")
+        name = f"snap-{slug}-{uuid.uuid4().hex[:8]}"
+        paths = self._paths(name)
+        try:
+            golden_images.create_overlay(paths["disk"], golden_images.fetch_golden_image(os_name), storage)
+            _, public_key = ssh_keys.provision(paths["keys"])
+            golden_images.create_seed_iso(
+                paths["seed"], golden_images.cloud_init_user_data(public_key), golden_images.cloud_init_meta_data(name)
+            )
+            allocator = net_alloc.get_allocator()
+            mac, _ = allocator.allocate(name)
+            xml = domain_xml.build(name, cpu, ram, paths["disk"], paths["seed"], mac)
+            dom = libvirt_pool.call("createXML", lambda conn: conn.createXML(xml, 0))
+            address, ready_seconds = readiness.wait_vm_ready(
+                dom, resolve=lambda: allocator.resolve_ip(name) or readiness.guest_address(dom)
+            )
+            if ready_seconds is None:
+                libvirt_pool.call("destroy", lambda conn: dom.destroy())
+                raise RuntimeError("ВМ пула не загрузилась")
+            domain_uuid = dom.UUIDString()
+            with metrics.span("vm.save"):
+                libvirt_pool.call(
+                    "save",
+                    lambda conn: dom.saveFlags(
+                        paths["state"], None, libvirt.VIR_DOMAIN_SAVE_BYPASS_CACHE | libvirt.VIR_DOMAIN_SAVE_RUNNING
+                    ),
+                )
+        except Exception:
+            self._discard(name)
+            raise
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO vm_snapshots (name, os_name, uuid, mac, address, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, os_name, domain_uuid, mac, address, time.time()),
+            )
+            self._db.commit()
+        return name
+
+    def refill(self):
+        for os_name in self.os_names:
+            while self.available(os_name) < self.size:
+                try:
+                    self._create(os_name)
+                except Exception as e:
+                    print(f"Не удалось пополнить пул снимков {os_name}: {e}", file=sys.stderr)
+                    break
+
+    def _run(self):
+        while True:
+            self.refill()
+            self._wakeup.wait(settings.WARM_POOL_INTERVAL)
+            self._wakeup.clear()
+
+    def available(self, os_name):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM vm_snapshots WHERE os_name = ?", (os_name,)).fetchone()[0]
+
+    # Подходит ли запрос под форму ВМ пула
+    def matches(self, cpu, ram, storage):
+        return bool(self.size) and (cpu, ram, storage) == self.shape
+
+    # Восстанавливаем ВМ пула под именем аренды и отдаём её ключу арендатора.
+    # disk_path и seed_path - пути, по которым у аренды лежат диск и seed.
+    # Возвращает (порт SSH на хосте, адрес гостя) или None, если пул пуст или ВМ непригодна.
+    def claim(self, os_name, vm_name, disk_path, seed_path, public_key, iotune=None):
+        cpu, ram, _ = self.shape
+        with self._lock:
+            row = self._db.execute(
+                "SELECT name, uuid, mac, address FROM vm_snapshots WHERE os_name = ? ORDER BY created_at LIMIT 1",
+                (os_name,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("DELETE FROM vm_snapshots WHERE name = ?", (row[0],))
+            self._db.commit()
+        self._wakeup.set()
+        name, domain_uuid, mac, address = row
+        paths = self._paths(name)
+        allocator = net_alloc.get_allocator()
+        try:
+            os.rename(paths["disk"], disk_path)
+            os.rename(paths["seed"], seed_path)
+            allocator.rename(name, vm_name)
+            xml = domain_xml.build(vm_name, cpu, ram, disk_path, seed_path, mac, uuid=domain_uuid, iotune=iotune)
+
+            def _restore(conn):
+                conn.restoreFlags(
+                    paths["state"], xml, libvirt.VIR_DOMAIN_SAVE_BYPASS_CACHE | libvirt.VIR_DOMAIN_SAVE_RUNNING
+                )
+                # После восстановления домен временный: сохраняем его определение, чтобы он пережил выключение
+                dom = conn.lookupByName(vm_name)
+                conn.defineXML(dom.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE))
+
+            with metrics.span("vm.restore"):
+                libvirt_pool.call("restore", _restore)
+            address = allocator.resolve_ip(vm_name) or address
+            if readiness.wait_for_ssh(address, 22, time.monotonic() + settings.VM_READY_TIMEOUT) is None:
+                raise RuntimeError("SSH восстановленной ВМ не отвечает")
+            self._hand_over(paths["keys"], address, vm_name, public_key)
+            ssh_port = allocator.forward(vm_name, address)
+        except Exception as e:
+            print(f"ВМ пула '{name}' непригодна: {e}", file=sys.stderr)
+            self._drop_claimed(name, vm_name, disk_path, seed_path)
+            return None
+        finally:
+            self._remove_files(name)
+        return ssh_port, address
+
+    # Ключ пула заменяется ключом арендатора, имя хоста - именем аренды
+    def _hand_over(self, keys_dir, address, vm_name, public_key):
+        subprocess.run(
+            [
+                "ssh", "-i", os.path.join(keys_dir, ssh_keys.KEY_FILE_NAMES[settings.SSH_KEY_TYPE]), "-o", "BatchMode=yes",
+                "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-o", "ConnectTimeout=10",
+                f"cloud-user@{address}",
+                f"echo '{public_key}' > ~/.ssh/authorized_keys && sudo hostnamectl set-hostname {vm_name}",
+            ],
+            check=True, capture_output=True, timeout=60,
+        )
+
+    def _drop_claimed(self, name, vm_name, disk_path, seed_path):
+        def _remove(conn):
+            try:
+                dom = conn.lookupByName(vm_name)
+            except libvirt.libvirtError:
+                return
+            if dom.isActive():
+                dom.destroy()
+            if dom.isPersistent():
+                dom.undefineFlags(libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE)
+        try:
+            libvirt_pool.call("undefine", _remove)
+        except libvirt.libvirtError as e:
+            print(f"Не удалось удалить ВМ '{vm_name}': {e}", file=sys.stderr)
+        for path in (disk_path, seed_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        net_alloc.get_allocator().release(vm_name)
+        self._discard(name)
+
+    # Имена ВМ пула, записанные в state.db
+    def names(self):
+        with self._lock:
+            return {name for (name,) in self._db.execute("SELECT name FROM vm_snapshots")}
+
+    def depth(self):
+        return [({"os": os_name}, self.available(os_name)) for os_name in self.os_names]
+
+    def stats(self):
+        return {
+            "save_image_format": save_image_format(),
+            "shape": dict(zip(("cpu", "ram", "storage"), self.shape)),
+            "depth": {os_name: self.available(os_name) for os_name in self.os_names},
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Общий для процесса экземпляр
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SnapshotPool()
+        return _pool
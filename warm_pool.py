@@ -0,0 +1,168 @@
+import collections
+import os
+import sys
+import threading
+import time
+import uuid
+
+import docker
+
+import image_builder
+import metrics
+import settings
+import storage_tiers
+
+POOL_LABEL = "rental.pool"
+POOL_PREFIX = "pool_"
+
+
+# Наименьший класс размера, в который помещается запрос
+def size_class(cpu, ram):
+    for name, (max_cpu, max_ram) in sorted(settings.SIZE_CLASSES.items(), key=lambda item: item[1]):
+        if cpu <= max_cpu and ram <= max_ram:
+            return name
+    return None
+
+
+def _ssh_port(container):
+    ports = container.attrs['NetworkSettings']['Ports']
+    bindings = ports.get('22/tcp') if ports else None
+    return bindings[0]['HostPort'] if bindings else None
+
+
+# Пул запущенных контейнеров для каждой пары (ОС, класс размера).
+# Фоновый поток держит число контейнеров между нижней и верхней границей,
+# аренда забирает готовый контейнер и только меняет ему лимиты.
+class WarmPool:
+    def __init__(self, client, os_names=None, classes=None, low=None, high=None):
+        self.client = client
+        self.os_names = list(os_names or image_builder.BASE_IMAGES)
+        self.classes = list(classes or settings.WARM_POOL_CLASSES)
+        self.low = settings.WARM_POOL_LOW if low is None else low
+        self.high = settings.WARM_POOL_HIGH if high is None else high
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._ready = {(os_name, cls): collections.deque() for os_name in self.os_names for cls in self.classes}
+        self._stats = collections.Counter()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._adopt()
+        metrics.gauge("rental_warm_pool_depth", "Готовые контейнеры в пуле.", self.depth)
+        self._thread = threading.Thread(target=self._run, name="warm-pool", daemon=True)
+        self._thread.start()
+
+    # Подхватываем контейнеры пула, оставшиеся от прошлого запуска
+    def _adopt(self):
+        try:
+            containers = self.client.containers.list(all=True, filters={"label": f"{POOL_LABEL}=1"})
+        except docker.errors.DockerException as e:
+            print(f"Не удалось получить контейнеры пула: {e}", file=sys.stderr)
+            return
+        for container in containers:
+            if not container.name.startswith(POOL_PREFIX):
+                continue  # уже выдан в аренду
+            key = (container.labels.get("rental.os"), container.labels.get("rental.size"))
+            if container.status == "running" and key in self._ready:
+                self._ready[key].append(container.name)
+            else:
+                container.remove(force=True)
+
+    def _create(self, os_name, cls):
+        max_cpu, max_ram = settings.SIZE_CLASSES[cls]
+        image = image_builder.ensure_ssh_image(self.client, os_name)
+        slug = os_name.lower().replace(" ", "-").replace(".", "")
+        name = f"{POOL_PREFIX}{slug}_{cls}_{uuid.uuid4().hex[:8]}"
+        mount_path = os.path.join(settings.DOCKER_DATA_DIR, name)
+        os.makedirs(mount_path, exist_ok=True)
+        container = self.client.containers.run(
+            image=image,
+            name=name,
+            detach=True,
+            cpu_period=100000,
+            cpu_quota=max_cpu * 100000,
+            mem_limit=f"{max_ram}g",
+            memswap_limit=f"{max_ram * 2}g",
+            volumes={mount_path: {'bind': '/data', 'mode': 'rw'}},
+            tty=True,
+            ports={'22/tcp': 0},
+            labels={POOL_LABEL: "1", "rental.os": os_name, "rental.size": cls},
+            # Из пула выдаются только аренды с классом ввода-вывода по умолчанию
+            **storage_tiers.io_limits(storage_tiers.DEFAULT_IO_CLASS, storage_tiers.io_devices(self.client)),
+        )
+        return container.name
+
+    # Пополнение пула до верхней границы, если он опустился ниже нижней
+    def refill(self):
+        for key, ready in self._ready.items():
+            with self._lock:
+                missing = self.high - len(ready) if len(ready) < self.low else 0
+            for _ in range(missing):
+                try:
+                    name = self._create(*key)
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    print(f"Не удалось пополнить пул {key}: {e}", file=sys.stderr)
+                    break
+                with self._lock:
+                    ready.append(name)
+                    self._stats["created"] += 1
+
+    def _run(self):
+        while True:
+            self.refill()
+            self._wakeup.wait(settings.WARM_POOL_INTERVAL)
+            self._wakeup.clear()
+
+    # Забираем контейнер из пула: выставляем лимиты аренды и переименовываем.
+    # Возвращает SSH-порт или None, если пул пуст.
+    def claim(self, os_name, cpu, ram, container_name):
+        key = (os_name, size_class(cpu, ram))
+        if key not in self._ready:
+            self._stats["misses"] += 1
+            return None
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._ready[key]:
+                    self._stats["misses"] += 1
+                    self._wakeup.set()
+                    return None
+                pool_name = self._ready[key].popleft()
+            try:
+                container = self.client.containers.get(pool_name)
+                container.update(
+                    cpu_period=100000,
+                    cpu_quota=cpu * 100000,
+                    mem_limit=f"{ram}g",
+                    memswap_limit=f"{ram * 2}g",
+                )
+                container.rename(container_name)
+                container.reload()
+            except docker.errors.DockerException as e:
+                print(f"Контейнер пула '{pool_name}' непригоден: {e}", file=sys.stderr)
+                self._stats["errors"] += 1
+                try:
+                    self.client.containers.get(pool_name).remove(force=True)
+                except docker.errors.DockerException:
+                    pass
+                continue
+            with self._lock:
+                self._stats["hits"] += 1
+                self._stats["claim_seconds"] += time.monotonic() - started
+            self._wakeup.set()
+            return _ssh_port(container)
+
+    def depth(self):
+        with self._lock:
+            return [({"os": os_name, "size": cls}, len(ready)) for (os_name, cls), ready in self._ready.items()]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["depth"] = {f"{os_name}/{cls}": len(ready) for (os_name, cls), ready in self._ready.items()}
+        claims = stats.get("hits", 0) + stats.get("misses", 0)
+        stats["hit_ratio"] = stats.get("hits", 0) / claims if claims else 0.0
+        return stats
@@ -0,0 +1,163 @@
+import contextlib
+import time
+import uuid
+
+import streamlit as st
+
+import bulk
+import idle
+import jobs
+import lease_reaper
+import settings
+import stats_collector
+
+# Продление и отмена аренды
+def lease_controls(kind, name):
+    reaper = lease_reaper.get_reaper()
+    expires_at = reaper.get(kind, name)
+    if expires_at is None:
+        return
+    minutes_left = max(0, int(expires_at - time.time()) // 60)
+    st.write(f"До окончания аренды: {minutes_left} минут")
+    extra = st.number_input("Продлить на (минуты)", min_value=1, max_value=60, value=10, key=f"{kind}_extend_minutes")
+    if st.button("Продлить аренду", key=f"{kind}_extend"):
+        reaper.extend(kind, name, extra)
+        st.success(f"Аренда '{name}' продлена на {extra} минут.")
+    if st.button("Отменить автоудаление", key=f"{kind}_cancel"):
+        reaper.cancel(kind, name)
+        st.success(f"Автоматическое удаление '{name}' отменено.")
+
+
+# Ключ идемпотентности заявки: повторное нажатие или перезапуск скрипта
+# с теми же параметрами не создаёт второе задание
+def rent_key(kind, params):
+    nonce_key = f"{kind}_rent_nonce"
+    if nonce_key not in st.session_state:
+        st.session_state[nonce_key] = uuid.uuid4().hex
+    return f"{kind}:{st.session_state[nonce_key]}:{params!r}"
+
+
+# Отправка задания в фоновый пул, последнее задание каждого вида запоминается в сессии
+def submit_job(kind, key, fn, *args):
+    job = jobs.get_engine().submit(kind, key, fn, *args)
+    st.session_state[f"{kind}_job"] = job.id
+    return job
+
+
+# Отправка заявки на аренду
+def submit_rent(kind, params, fn):
+    return submit_job(kind, rent_key(kind, params), fn, *params)
+
+
+# Состояние последнего задания сессии. Возвращает задание или None.
+def job_status(kind):
+    job_id = st.session_state.get(f"{kind}_job")
+    job = jobs.get_engine().get(job_id) if job_id else None
+    if job is None:
+        return None
+    snapshot = job.snapshot()
+    with st.container():
+        st.subheader("Ход выполнения заявки")
+        for level, text in snapshot["messages"]:
+            getattr(st, level)(text)
+        if not job.finished:
+            text = f"Этап: {snapshot['stage'] or 'в очереди'}"
+            if snapshot["progress_text"]:
+                text += f" — {snapshot['progress_text']}"
+            st.progress(min(1.0, snapshot["progress"]), text=text)
+            return job
+        stages = ", ".join(f"{stage['name']} {stage['seconds']} с" for stage in snapshot["stages"])
+        if stages:
+            st.caption(f"Время по этапам: {stages}")
+    # Заявка завершена: следующее нажатие создаёт новую аренду
+    if job.key.startswith(f"{kind}:{st.session_state.get(f'{kind}_rent_nonce')}:"):
+        st.session_state[f"{kind}_rent_nonce"] = uuid.uuid4().hex
+    return job
+
+
+# Состояние массовой аренды: таблица созданных аренд и манифест для скачивания
+def bulk_status(kind):
+    job = job_status(kind)
+    if job is None or job.status != jobs.DONE:
+        return job
+    manifest = job.result
+    st.write(f"**Создано:** {manifest['count']}, **не создано:** {manifest['failed']}")
+    st.dataframe(
+        [
+            {key: item.get(key) for key in ("name", "host", "address", "ssh_port", "ready")}
+            for item in manifest["items"]
+        ],
+        use_container_width=True,
+    )
+    st.download_button(
+        "Скачать манифест (имена, порты и ключи)",
+        bulk.manifest_json(manifest),
+        file_name=f"{kind}-{job.id[:8]}.json",
+        mime="application/json",
+    )
+    return job
+
+
+# Сборщик статистики один на процесс и общий для всех сессий
+@st.cache_resource
+def usage_collector():
+    return stats_collector.get_collector()
+
+
+# Таблица использования ресурсов со спарклайнами. Данные берутся из буферов сборщика,
+# поэтому перерисовка страницы не обращается к Docker и libvirt.
+def usage_table(kind):
+    rows = usage_collector().snapshot(kind)
+    if not rows:
+        st.write("Данных пока нет: статистика появится через несколько секунд после запуска.")
+        return
+    st.dataframe(
+        rows,
+        column_order=("name", "cpu", "cpu_history", "mem", "mem_history", "net_rx", "net_tx", "blk_read", "blk_write"),
+        column_config={
+            "name": st.column_config.TextColumn("Имя"),
+            "cpu": st.column_config.NumberColumn("CPU, %", format="%.1f"),
+            "cpu_history": st.column_config.LineChartColumn("CPU", y_min=0),
+            "mem": st.column_config.NumberColumn("RAM, МБ", format="%.0f"),
+            "mem_history": st.column_config.LineChartColumn("RAM", y_min=0),
+            "net_rx": st.column_config.NumberColumn("Сеть вх., КБ/с", format="%.1f"),
+            "net_tx": st.column_config.NumberColumn("Сеть исх., КБ/с", format="%.1f"),
+            "blk_read": st.column_config.NumberColumn("Диск чт., КБ/с", format="%.1f"),
+            "blk_write": st.column_config.NumberColumn("Диск зап., КБ/с", format="%.1f"),
+        },
+        hide_index=True,
+        use_container_width=True,
+    )
+
+
+# Панель использования ресурсов обновляется сама раз в интервал сборщика, не трогая остальную страницу
+@st.fragment(run_every=settings.STATS_INTERVAL)
+def usage_panel(kind):
+    with st.expander("Использование ресурсов"):
+        usage_table(kind)
+        paused = idle.get_detector().paused(kind)
+        if paused:
+            st.write(f"**{idle.IDLE_STATUS}:** возобновятся при подключении по SSH или действии на странице")
+            st.table([dict(name=name, **info) for name, info in paused.items()])
+
+
+# Полный запуск приложения (первая загрузка, навигация, виджет вне фрагмента). Фрагменты выполняются
+# и в нём, но как обычный код; при отдельном запуске фрагмента main.py не выполняется, и флаг сброшен.
+@contextlib.contextmanager
+def full_run():
+    st.session_state["full_run"] = True
+    try:
+        yield
+    finally:
+        st.session_state["full_run"] = False
+
+
+# Пока задание выполняется, перерисовываем страницу раз в секунду.
+# scope="fragment" перерисовывает только фрагмент, из которого вызван poll. Streamlit разрешает это
+# только при отдельном запуске фрагмента, поэтому при полном запуске перерисовываем всё приложение.
+def poll(job, scope="app"):
+    if job is not None and not job.finished:
+        time.sleep(1)
+        if scope == "fragment" and st.session_state.get("full_run", True):
+            scope = "app"
+        st.rerun(scope=scope)